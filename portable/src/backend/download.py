@@ -1,11 +1,154 @@
 import os
 import sys
+import json
 import time
 import socket
+import hashlib
 import zipfile
 import requests
 import shutil
+import threading
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.folders import SETTING_FOLDER
+
+
+# local manifest of downloaded files to verify checkpoints without network requests
+MANIFEST_FILE = os.path.join(SETTING_FOLDER, "manifest.json")
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def _load_manifest() -> dict:
+    global _manifest
+    if _manifest is None:
+        _manifest = {}
+        if os.path.isfile(MANIFEST_FILE):
+            try:
+                with open(MANIFEST_FILE, 'r', encoding="utf8") as f:
+                    _manifest = json.load(f)
+            except (OSError, json.JSONDecodeError) as err:
+                print(f"Error... manifest of downloaded files is broken and will be created again {err}")
+    return _manifest
+
+
+def _save_manifest() -> None:
+    tmp_file = MANIFEST_FILE + ".tmp"
+    with open(tmp_file, 'w', encoding="utf8") as f:
+        json.dump(_manifest, f, indent=2)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Get sha256 of file
+    :param file_path: path to file
+    :param chunk_size: read chunk size
+    :return: hex digest
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def update_manifest(download_path: str, download_link: str = None, sha256: str = None) -> dict:
+    """
+    Record downloaded file in manifest
+    :param download_path: path to file
+    :param download_link: url of file
+    :param sha256: sha256 of file if already calculated during download, if None file is hashed in background thread
+    :return: manifest record
+    """
+    stat = os.stat(download_path)
+    record = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": sha256,
+        "url": download_link
+    }
+    with _manifest_lock:
+        _load_manifest()[os.path.abspath(download_path)] = record
+        _save_manifest()
+    if sha256 is None:
+        # checkpoints are several Gb, they are not hashed on request path
+        threading.Thread(target=_fill_sha256, args=(download_path, record), daemon=True).start()
+    return record
+
+
+def _fill_sha256(download_path: str, record: dict) -> None:
+    try:
+        sha256 = file_sha256(download_path)
+    except OSError as err:
+        print(f"Error... file is not hashed {download_path} {err}")
+        return
+    with _manifest_lock:
+        # record is not updated if file was downloaded again or removed from manifest during hashing
+        if _load_manifest().get(os.path.abspath(download_path)) is record:
+            record["sha256"] = sha256
+            _save_manifest()
+
+
+def remove_from_manifest(download_path: str) -> None:
+    with _manifest_lock:
+        if _load_manifest().pop(os.path.abspath(download_path), None) is not None:
+            _save_manifest()
+
+
+def is_manifest_verified(download_path: str, download_link: str = None) -> bool:
+    """
+    Check file by manifest without network, file is verified if size and mtime were not changed after download
+    :param download_path: path to file
+    :param download_link: url of file, if url was changed in config when file has to be downloaded again
+    :return: bool
+    """
+    with _manifest_lock:
+        record = _load_manifest().get(os.path.abspath(download_path))
+    if record is None:
+        return False
+    if download_link is not None and record.get("url") is not None and record["url"] != download_link:
+        return False
+    try:
+        stat = os.stat(download_path)
+    except OSError:
+        return False
+    return stat.st_size == record["size"] and stat.st_mtime == record["mtime"]
+
+
+def verify_all(max_workers: int = None) -> dict:
+    """
+    Hash all files from manifest in parallel and compare with recorded sha256
+    :param max_workers: number of threads, hashlib release GIL that is why threads are enough
+    :return: dict of path and status: verified, changed or missing
+    """
+    with _manifest_lock:
+        records = dict(_load_manifest())
+
+    def verify(item):
+        path, record = item
+        if not os.path.isfile(path):
+            return path, "missing"
+        if os.path.getsize(path) != record["size"]:
+            return path, "changed"
+        if record["sha256"] is None:
+            # hash was not calculated yet, size is only check
+            _fill_sha256(path, record)
+        elif file_sha256(path) != record["sha256"]:
+            return path, "changed"
+        return path, "verified"
+
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(tqdm(executor.map(verify, records.items()), total=len(records), file=sys.stdout))
+
+    for path, status in results.items():
+        if status != "verified":
+            print(f"File is not verified ({status}) {path}")
+            remove_from_manifest(path)  # file will be checked or downloaded again on next use
+    print(f"Verified {sum(status == 'verified' for status in results.values())} of {len(results)} files")
+    return results
 
 
 def is_connected(model_path):
@@ -71,11 +214,13 @@ def download_model(download_path: str, download_link: str, retry_count: int = 2,
                 progress_bar = tqdm(total=total_size, unit='iB', unit_scale=True, file=sys.stdout)
             else:
                 progress_bar = tqdm(unit='iB', unit_scale=True, file=sys.stdout)
+            sha256 = hashlib.sha256()
             with open(download_path, 'wb') as f:
                 for chunk in response.iter_content(chunk_size=8192):
                     if chunk:
                         progress_bar.update(len(chunk))
                         f.write(chunk)
+                        sha256.update(chunk)
             progress_bar.close()
             if total_size != 0 and progress_bar.n != total_size:
                 print(f'Download failed: network error. You can download the file yourself from the link {download_link}')
@@ -89,6 +234,7 @@ def download_model(download_path: str, download_link: str, retry_count: int = 2,
                         os.system(cmd)
                     except Exception as e:
                         print(e)
+                update_manifest(download_path, download_link, sha256.hexdigest())
                 return True
         except requests.exceptions.RequestException:
             if i == retry_count:
@@ -99,24 +245,39 @@ def download_model(download_path: str, download_link: str, retry_count: int = 2,
 
 
 def check_download_size(download_path: str, download_link: str) -> bool:
+    """
+    Check downloaded file, if file is in manifest it is checked without network
+    :param download_path: path to file
+    :param download_link: url of file
+    :return: bool
+    """
+    if not os.path.exists(download_path):
+        remove_from_manifest(download_path)
+        return download_model(download_path, download_link)
+
+    if is_manifest_verified(download_path, download_link):
+        return True
+
+    # file was downloaded before manifest or was changed, check size by remote only once
+    downloaded_size = os.path.getsize(download_path)
     try:
         # if is internet connection
         response = requests.get(download_link, stream=True)
         total_size = int(response.headers.get('content-length', 0))
-    except:
-        # if not internet connection
-        total_size = os.path.getsize(download_path)
-
-    if not os.path.exists(download_path):
-        return download_model(download_path, download_link)
+        response.close()
+    except (requests.exceptions.RequestException, ValueError):
+        # if not internet connection trust file on disk, but file is not recorded in manifest as verified
+        print(f"File is not verified without internet connection, used file on disk {download_path}")
+        return True
 
-    downloaded_size = os.path.getsize(download_path)
     if downloaded_size == total_size:
         print(f'File verified {download_path}')
+        update_manifest(download_path, download_link)
         return True
     print(f"File is not verified, re-download ones {download_link}")
 
     os.remove(download_path)  # delete not finished file
+    remove_from_manifest(download_path)
 
     return download_model(download_path, download_link)
 
@@ -133,3 +294,16 @@ def get_download_filename(download_link):
                 filename = value.strip("\"'")
 
     return filename
+
+
+if __name__ == "__main__":
+    # python -m backend.download --verify
+    import argparse
+    parser = argparse.ArgumentParser(description="Verify downloaded models by manifest")
+    parser.add_argument("--verify", action="store_true", help="hash all downloaded files in parallel")
+    parser.add_argument("--workers", type=int, default=None, help="number of threads to hash files")
+    args = parser.parse_args()
+    if args.verify:
+        verify_all(args.workers)
+    else:
+        parser.print_help()
@@ -0,0 +1,172 @@
+import os
+import uuid
+import threading
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Number of parallel workers, max of not finished jobs and number of kept done jobs,
+# can be changed by env before start application
+JOB_WORKERS_ENV = "WUNJO_JOB_WORKERS"
+JOB_QUEUE_SIZE_ENV = "WUNJO_JOB_QUEUE_SIZE"
+JOB_HISTORY_ENV = "WUNJO_JOB_HISTORY"
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_FINISHED = "finished"
+JOB_FAILED = "failed"
+
+
+def _get_env_int(env_name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(env_name, default)))
+    except ValueError:
+        print(f"Error... {env_name} has to be integer, used default {default}")
+        return default
+
+
+_current_job = threading.local()  # queue of job which runs in worker thread
+
+
+def set_job_progress(progress: float, message: str = None) -> None:
+    """
+    Set progress of job which runs in current thread, used by modules which do not know about queue.
+    Outside of job nothing happens
+    :param progress: progress in percent
+    :param message: message of current stage
+    :return: None
+    """
+    queue = getattr(_current_job, "queue", None)
+    if queue is not None:
+        queue.set_progress(progress, message)
+
+
+class JobQueue:
+    """
+    Queue of synthesis jobs which run in pool of workers. Submit returns job id immediately,
+    status, progress and result of each job can be got by id
+    """
+    def __init__(self, max_workers: int = None, max_queue: int = None, max_history: int = None, context=None):
+        """
+        Initialization
+        :param max_workers: number of parallel workers, if None read from env, default 1 for one GPU
+        :param max_queue: max number of queued and running jobs, if None read from env
+        :param max_history: max number of finished and failed jobs which are kept with results, if None read from env
+        :param context: function which returns context manager to run job in, for example flask request context
+        """
+        self.max_workers = max_workers or _get_env_int(JOB_WORKERS_ENV, 1)
+        self.max_queue = max_queue or _get_env_int(JOB_QUEUE_SIZE_ENV, 16)
+        self.max_history = max_history or _get_env_int(JOB_HISTORY_ENV, 100)
+        self.context = context
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="wunjo-job")
+        self.jobs = {}  # keep order of submit
+        self.lock = threading.RLock()
+        self.local = threading.local()  # current job of worker thread
+
+    def submit(self, func, *args, mode: str = "", fallback=None, **kwargs):
+        """
+        Submit job
+        :param func: job function, returns list of results
+        :param args: args of function
+        :param mode: name of job for user
+        :param fallback: function with error argument which returns results if job failed
+        :param kwargs: kwargs of function
+        :return: job id or None if queue is full
+        """
+        with self.lock:
+            if self.is_full():
+                return None
+            job_id = str(uuid.uuid4())
+            self.jobs[job_id] = {
+                "job_id": job_id, "mode": mode, "status": JOB_QUEUED, "progress": 0, "message": "",
+                "result": None, "error": None, "created": time(), "started": None, "finished": None
+            }
+        self.executor.submit(self._run, job_id, func, args, kwargs, fallback)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs, fallback):
+        self.local.job_id = job_id
+        _current_job.queue = self
+        self._update(job_id, status=JOB_RUNNING, started=time())
+        try:
+            if self.context is not None:
+                with self.context():
+                    result = func(*args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+            self._update(job_id, status=JOB_FINISHED, progress=100, result=result, finished=time())
+        except Exception as err:
+            print(f"Error ... {err}")
+            result = None
+            if fallback is not None:
+                if self.context is not None:
+                    with self.context():
+                        result = fallback(err)
+                else:
+                    result = fallback(err)
+            self._update(job_id, status=JOB_FAILED, result=result, error=str(err), finished=time())
+        finally:
+            self.local.job_id = None
+            _current_job.queue = None
+            self._prune()
+
+    def _update(self, job_id, **params):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(params)
+
+    def _prune(self) -> None:
+        """Remove oldest done jobs with results if there are more than max_history"""
+        with self.lock:
+            done = [job_id for job_id, job in self.jobs.items() if job["status"] in (JOB_FINISHED, JOB_FAILED)]
+            for job_id in done[:max(0, len(done) - self.max_history)]:
+                del self.jobs[job_id]
+
+    def set_progress(self, progress: float, message: str = None) -> None:
+        """
+        Set progress of current job, call inside job function
+        :param progress: progress in percent
+        :param message: message of current stage
+        :return: None
+        """
+        job_id = getattr(self.local, "job_id", None)
+        if job_id is None:
+            return
+        params = {"progress": max(0, min(100, progress))}
+        if message is not None:
+            params["message"] = message
+        self._update(job_id, **params)
+
+    def get(self, job_id: str):
+        """
+        Get copy of job
+        :param job_id: job id
+        :return: job dict or None
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def get_jobs(self) -> list:
+        """List of jobs in submit order"""
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def results(self) -> list:
+        """Results of all done jobs in submit order"""
+        results = []
+        for job in self.get_jobs():
+            if job["status"] in (JOB_FINISHED, JOB_FAILED) and job["result"]:
+                results += job["result"]
+        return results
+
+    def active(self) -> int:
+        """Number of queued and running jobs"""
+        with self.lock:
+            return sum(job["status"] in (JOB_QUEUED, JOB_RUNNING) for job in self.jobs.values())
+
+    def is_full(self) -> bool:
+        return self.active() >= self.max_queue
+
+    def is_idle(self) -> bool:
+        return self.active() == 0
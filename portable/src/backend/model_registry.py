@@ -0,0 +1,260 @@
+import os
+import gc
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import torch
+
+
+# Budgets in Gb for models kept resident between requests, can be changed by env before start application
+MODEL_RAM_LIMIT_ENV = "WUNJO_MODEL_RAM_LIMIT"
+MODEL_VRAM_LIMIT_ENV = "WUNJO_MODEL_VRAM_LIMIT"
+DEFAULT_RAM_LIMIT = 8  # Gb
+DEFAULT_VRAM_PERCENTAGE = 0.75  # part of total GPU memory if user did not set limit
+
+
+def get_torch_device() -> str:
+    """
+    Get device which user choose in application
+    :return: cuda or cpu
+    """
+    use_cpu = False if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu') else True
+    return "cpu" if use_cpu else "cuda"
+
+
+def _get_limit(env_name: str, default: float) -> int:
+    """
+    Read limit from env in Gb and return in bytes
+    :param env_name: name of env
+    :param default: default limit in Gb
+    :return: limit in bytes
+    """
+    try:
+        limit = float(os.environ.get(env_name, default))
+    except ValueError:
+        print(f"Error... {env_name} has to be number in Gb, used default {default} Gb")
+        limit = default
+    return int(limit * 1024 ** 3)
+
+
+def _get_paths_size(paths) -> int:
+    """
+    Size of checkpoint files or folders on disk
+    :param paths: path or list of paths
+    :return: size in bytes
+    """
+    size = 0
+    for path in paths:
+        if not isinstance(path, str) or not os.path.exists(path):
+            continue
+        if os.path.isfile(path):
+            size += os.path.getsize(path)
+        else:
+            for dirpath, _, filenames in os.walk(path):
+                size += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames)
+    return size
+
+
+def _get_torch_size(obj, seen: set, depth: int = 0, max_depth: int = 4) -> int:
+    """
+    Size of torch modules inside wrapper object, wrappers keep models in attributes, lists or dicts
+    :param obj: model or wrapper
+    :param seen: id of objects which already counted
+    :param depth: current depth
+    :param max_depth: max depth of attributes to search torch module
+    :return: size in bytes
+    """
+    if id(obj) in seen or depth > max_depth:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, torch.nn.Module):
+        tensors = list(obj.parameters()) + list(obj.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, (list, tuple, set)):
+        values = obj
+    elif isinstance(obj, dict):
+        values = obj.values()
+    elif hasattr(obj, "__dict__"):
+        values = vars(obj).values()
+    else:
+        return 0
+    return sum(_get_torch_size(value, seen, depth + 1, max_depth) for value in values)
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of loaded models. Models are keyed by (name, checkpoint, device, dtype) and keep resident
+    between requests, least recently used models are evicted if RAM or VRAM budget is exceeded
+    """
+    def __init__(self, ram_limit: int = None, vram_limit: int = None):
+        """
+        Initialization
+        :param ram_limit: limit for models on cpu in bytes, if None read from env
+        :param vram_limit: limit for models on cuda in bytes, if None read from env or get part of GPU memory
+        """
+        self.models = OrderedDict()  # key: {"model": model, "size": size in bytes, "lock": lock of request state}
+        self.lock = threading.RLock()
+        self.loading = {}  # key: lock of loading, the same model is loaded once while other models are got
+        self.ram_limit = ram_limit
+        self.vram_limit = vram_limit
+
+    @staticmethod
+    def make_key(name: str, checkpoint, device: str, dtype=None) -> tuple:
+        """
+        Create key for model
+        :param name: name of model class, because the same checkpoint can be loaded by different classes
+        :param checkpoint: path or list of paths to checkpoints
+        :param device: cuda or cpu
+        :param dtype: dtype of model as str or torch.dtype, None is default float32
+        :return: key
+        """
+        if isinstance(checkpoint, (list, tuple)):
+            checkpoint = tuple(os.path.abspath(str(c)) for c in checkpoint)
+        else:
+            checkpoint = (os.path.abspath(str(checkpoint)),)
+        return str(name), checkpoint, str(device), str(dtype) if dtype is not None else "float32"
+
+    def get_limit(self, device: str) -> int:
+        """
+        Get budget for device
+        :param device: cuda or cpu
+        :return: limit in bytes
+        """
+        if "cuda" in device:
+            if self.vram_limit is not None:
+                return self.vram_limit
+            if os.environ.get(MODEL_VRAM_LIMIT_ENV) is not None:
+                return _get_limit(MODEL_VRAM_LIMIT_ENV, 0)
+            if torch.cuda.is_available():
+                return int(torch.cuda.get_device_properties(0).total_memory * DEFAULT_VRAM_PERCENTAGE)
+            return 0
+        if self.ram_limit is not None:
+            return self.ram_limit
+        return _get_limit(MODEL_RAM_LIMIT_ENV, DEFAULT_RAM_LIMIT)
+
+    def get(self, name: str, checkpoint, device: str, loader, dtype=None):
+        """
+        Get warm model or load model by loader and keep in registry
+        :param name: name of model class
+        :param checkpoint: path or list of paths to checkpoints
+        :param device: cuda or cpu
+        :param loader: function without arguments which load model
+        :param dtype: dtype of model
+        :return: model
+        """
+        key = self.make_key(name, checkpoint, device, dtype)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                print(f"Model {name} is already loaded")
+                return self.models[key]["model"]
+            loading_lock = self.loading.setdefault(key, threading.Lock())
+
+        # loader runs without registry lock, so requests of loaded models do not wait for loading of other model
+        with loading_lock:
+            with self.lock:
+                if key in self.models:
+                    # model was loaded by other thread while this thread waited
+                    self.models.move_to_end(key)
+                    return self.models[key]["model"]
+            try:
+                model = loader()
+                size = _get_torch_size(model, set())
+                if size == 0:
+                    # onnx sessions and other not torch models, use size of checkpoint on disk
+                    size = _get_paths_size(key[1])
+            except BaseException:
+                with self.lock:
+                    self.loading.pop(key, None)
+                raise
+            with self.lock:
+                # model is visible in models before loading lock is removed, next thread does not load it again
+                self.models[key] = {"model": model, "size": size, "lock": threading.RLock()}
+                self.loading.pop(key, None)
+        self.evict(device, keep=key)
+        return model
+
+    @contextmanager
+    def use(self, name: str, checkpoint, device: str, loader, dtype=None):
+        """
+        Get model and hold it while block runs, for models which keep params of request in attributes.
+        Other jobs which use the same model wait until block ends
+        :param name: name of model class
+        :param checkpoint: path or list of paths to checkpoints
+        :param device: cuda or cpu
+        :param loader: function without arguments which load model
+        :param dtype: dtype of model
+        :return: model
+        """
+        model = self.get(name, checkpoint, device, loader, dtype)
+        with self.lock:
+            entry = self.models.get(self.make_key(name, checkpoint, device, dtype))
+            # model could be evicted by other thread, it is not shared anymore
+            model_lock = entry["lock"] if entry is not None and entry["model"] is model else threading.RLock()
+        with model_lock:
+            yield model
+
+    def used(self, device: str) -> int:
+        """
+        Used memory by models on device
+        :param device: cuda or cpu
+        :return: size in bytes
+        """
+        is_cuda = "cuda" in device
+        with self.lock:
+            return sum(v["size"] for k, v in self.models.items() if ("cuda" in k[2]) == is_cuda)
+
+    def evict(self, device: str, keep: tuple = None) -> None:
+        """
+        Evict least recently used models on device while budget is exceeded
+        :param device: cuda or cpu
+        :param keep: key of model which will not be evicted
+        :return: None
+        """
+        is_cuda = "cuda" in device
+        limit = self.get_limit(device)
+        evicted = False
+        with self.lock:
+            for key in list(self.models.keys()):
+                if self.used(device) <= limit:
+                    break
+                if key == keep or ("cuda" in key[2]) != is_cuda:
+                    continue
+                print(f"Unload model {key[0]} to free memory")
+                del self.models[key]
+                evicted = True
+        if evicted:
+            self.empty_cache()
+
+    def release(self, name: str = None, device: str = None) -> None:
+        """
+        Remove models from registry
+        :param name: remove only models with this name, if None all names
+        :param device: remove only models on this device, if None all devices
+        :return: None
+        """
+        with self.lock:
+            for key in list(self.models.keys()):
+                if name is not None and key[0] != name:
+                    continue
+                if device is not None and ("cuda" in key[2]) != ("cuda" in device):
+                    continue
+                del self.models[key]
+        self.empty_cache()
+
+    def clear(self) -> None:
+        """Remove all models from registry"""
+        self.release()
+
+    @staticmethod
+    def empty_cache() -> None:
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+# registry shared by all modules of application
+model_registry = ModelRegistry()
@@ -1,5 +1,236 @@
-import requests
+import os
 import json
+import importlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from backend.folders import SETTING_FOLDER
+
+
+# Translation backend as module:Class, size of translation cache, can be changed by env before start application
+TRANSLATOR_BACKEND_ENV = "WUNJO_TRANSLATOR_BACKEND"
+TRANSLATION_CACHE_SIZE_ENV = "WUNJO_TRANSLATION_CACHE_SIZE"
+DEFAULT_TRANSLATION_CACHE_SIZE = 10000
+TRANSLATION_CACHE_FILE = os.path.join(SETTING_FOLDER, "translation_cache.json")
+
+
+class TranslatorBackend(ABC):
+    """
+    Interface of translation backend, local offline translator or stub has to implement translate_batch
+    """
+    @abstractmethod
+    def translate_batch(self, texts: list, target_lang: str, source_lang: str = "auto") -> list:
+        """
+        Translate texts
+        :param texts: list of source texts
+        :param target_lang: target language
+        :param source_lang: source language
+        :return: list of translations in the same order, None for text which was not translated
+        """
+
+
+class GoogleTranslator(TranslatorBackend):
+    """
+    Translation by public google api with pooled session, texts are joined by new line into one request
+    """
+    url = "https://translate.googleapis.com/translate_a/single"
+
+    def __init__(self, max_request_length: int = 4000, timeout: float = 10, pool_size: int = 8):
+        """
+        Initialization
+        :param max_request_length: max length of joined texts in one request
+        :param timeout: timeout of request in seconds
+        :param pool_size: size of connection pool
+        """
+        self.max_request_length = max_request_length
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=2)
+        self.session.mount("https://", adapter)
+
+    def request(self, text: str, target_lang: str, source_lang: str):
+        params = {"client": "gtx", "sl": source_lang, "tl": target_lang, "dt": "t", "q": text}
+        try:
+            # params are url encoded, long text is sent in body
+            if len(text) > 1000:
+                response = self.session.post(self.url, data=params, timeout=self.timeout)
+            else:
+                response = self.session.get(self.url, params=params, timeout=self.timeout)
+            response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
+            translation_data = json.loads(response.text)
+            return "".join(item[0] for item in translation_data[0])
+        except requests.RequestException:
+            print(f"Error... during the request to translate text")
+        except (IndexError, TypeError):
+            print("Error... Could not retrieve translation from response")
+        except json.JSONDecodeError:
+            print("Error... decoding the JSON response during translation")
+        except Exception as err:
+            print(f"An unexpected error during translation occurred: {err}")
+        return None
+
+    def get_batches(self, texts: list) -> list:
+        batches = []
+        batch = []
+        length = 0
+        for text in texts:
+            if batch and (length + len(text) + 1 > self.max_request_length or "\n" in text):
+                batches.append(batch)
+                batch = []
+                length = 0
+            batch.append(text)
+            length += len(text) + 1
+            if "\n" in text:
+                # text with new lines can not be split back, translate it alone
+                batches.append(batch)
+                batch = []
+                length = 0
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def translate_batch(self, texts: list, target_lang: str, source_lang: str = "auto") -> list:
+        translations = []
+        for batch in self.get_batches(texts):
+            if len(batch) == 1:
+                translations.append(self.request(batch[0], target_lang, source_lang))
+                continue
+            translation = self.request("\n".join(batch), target_lang, source_lang)
+            parts = translation.split("\n") if translation is not None else []
+            if len(parts) == len(batch):
+                translations += [part.strip() for part in parts]
+            else:
+                # translation merged or split lines, translate texts one by one
+                translations += [self.request(text, target_lang, source_lang) for text in batch]
+        return translations
+
+
+class Translator:
+    """
+    Translation with cache by (text, source language, target language) which is saved in setting folder
+    """
+    def __init__(self, backend: TranslatorBackend = None, cache_file: str = TRANSLATION_CACHE_FILE, max_size: int = None):
+        """
+        Initialization
+        :param backend: translation backend, if None read from env or use google
+        :param cache_file: json file of cache, if None cache is only in memory
+        :param max_size: max number of translations in cache, if None read from env
+        """
+        self.backend = backend or get_backend_from_env()
+        self.cache_file = cache_file
+        self.max_size = max_size or _get_cache_size()
+        self.lock = threading.Lock()
+        self.cache = None  # (source_lang, target_lang, text): translation, loaded lazily
+
+    def _load_cache(self) -> OrderedDict:
+        if self.cache is None:
+            self.cache = OrderedDict()
+            if self.cache_file is not None and os.path.isfile(self.cache_file):
+                try:
+                    with open(self.cache_file, 'r', encoding="utf8") as f:
+                        for source_lang, target_lang, text, translation in json.load(f):
+                            self.cache[(source_lang, target_lang, text)] = translation
+                except (OSError, ValueError) as err:
+                    print(f"Error... translation cache is broken and will be created again {err}")
+        return self.cache
+
+    def _save_cache(self) -> None:
+        if self.cache_file is None:
+            return
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, 'w', encoding="utf8") as f:
+            json.dump([list(key) + [value] for key, value in self.cache.items()], f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
+    def translate_batch(self, texts: list, target_lang: str, source_lang: str = "auto") -> list:
+        """
+        Translate texts, only texts which are not in cache are sent to backend in one batch
+        :param texts: list of source texts
+        :param target_lang: target language
+        :param source_lang: source language
+        :return: list of translations, original text if translation failed
+        """
+        results = list(texts)
+        missing = {}  # text: indexes
+        with self.lock:
+            cache = self._load_cache()
+            for i, text in enumerate(texts):
+                if not text or not text.strip():
+                    continue
+                key = (source_lang, target_lang, text)
+                if key in cache:
+                    cache.move_to_end(key)
+                    results[i] = cache[key]
+                else:
+                    missing.setdefault(text, []).append(i)
+        if not missing:
+            return results
+
+        translations = self.backend.translate_batch(list(missing.keys()), target_lang, source_lang)
+        with self.lock:
+            cache = self._load_cache()
+            for (text, indexes), translation in zip(missing.items(), translations):
+                if translation is None:
+                    continue  # failed translation is not cached, original text is returned
+                for i in indexes:
+                    results[i] = translation
+                cache[(source_lang, target_lang, text)] = translation
+            while len(cache) > self.max_size:
+                cache.popitem(last=False)
+            try:
+                self._save_cache()
+            except OSError as err:
+                print(f"Error... translation cache is not saved {err}")
+        return results
+
+    def translate(self, text: str, target_lang: str, source_lang: str = "auto") -> str:
+        return self.translate_batch([text], target_lang, source_lang)[0]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache = OrderedDict()
+            if self.cache_file is not None and os.path.isfile(self.cache_file):
+                os.remove(self.cache_file)
+
+
+def _get_cache_size() -> int:
+    try:
+        return max(1, int(os.environ.get(TRANSLATION_CACHE_SIZE_ENV, DEFAULT_TRANSLATION_CACHE_SIZE)))
+    except ValueError:
+        print(f"Error... {TRANSLATION_CACHE_SIZE_ENV} has to be integer, used default {DEFAULT_TRANSLATION_CACHE_SIZE}")
+        return DEFAULT_TRANSLATION_CACHE_SIZE
+
+
+def get_backend_from_env() -> TranslatorBackend:
+    """
+    Create backend from env in format module:Class, default google
+    :return: backend
+    """
+    backend_path = os.environ.get(TRANSLATOR_BACKEND_ENV)
+    if backend_path:
+        try:
+            module_name, class_name = backend_path.split(":")
+            return getattr(importlib.import_module(module_name), class_name)()
+        except Exception as err:
+            print(f"Error... {TRANSLATOR_BACKEND_ENV} has to be module:Class of translator backend, used google {err}")
+    return GoogleTranslator()
+
+
+# translator shared by all modules of application
+translator = Translator()
+
+
+def set_translator_backend(backend: TranslatorBackend) -> None:
+    """
+    Set translation backend, for example local offline translator
+    :param backend: backend
+    :return: None
+    """
+    translator.backend = backend
 
 
 def get_translate(text: str, targetLang: str, sourceLang: str="auto") -> str:
@@ -12,22 +243,15 @@ def get_translate(text: str, targetLang: str, sourceLang: str="auto") -> str:
     """
     if not text:
         return text
+    return translator.translate(text, targetLang, sourceLang)  # Return original text if translation fails
 
-    google_url = f"https://translate.googleapis.com/translate_a/single?client=gtx&sl={sourceLang}&tl={targetLang}&dt=t&q={text}"
-
-    try:
-        response = requests.get(google_url)
-        response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
-        translation_data = json.loads(response.text)
-        return "".join(item[0] for item in translation_data[0])
-    except requests.RequestException as e:
-        print(f"Error... during the request to translate text")
-    except (IndexError, TypeError):
-        print("Error... Could not retrieve translation from response")
-    except json.JSONDecodeError:
-        print("Error... decoding the JSON response during translation")
-    except Exception as err:
-        print(f"An unexpected error during translation occurred: {err}")
-
-    return text  # Return original text if translation fails
 
+def get_translate_batch(texts: list, targetLang: str, sourceLang: str="auto") -> list:
+    """
+    Translate list of texts by one request
+    :param texts: source texts
+    :param targetLang: target language
+    :param sourceLang: source language
+    :return: translation texts
+    """
+    return translator.translate_batch(texts, targetLang, sourceLang)
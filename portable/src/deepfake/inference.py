@@ -3,10 +3,12 @@ import cv2
 import sys
 import math
 import torch
+import threading
 import subprocess
 import numpy as np
+from collections import OrderedDict
 from tqdm import tqdm
-from time import strftime
+from time import strftime, time
 from argparse import Namespace
 
 root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -16,7 +18,8 @@ sys.path.insert(0, deepfake_root_path)
 """Video and image"""
 from src.utils.videoio import (
     save_video_with_audio, cut_start_video, get_frames, get_first_frame, encrypted, save_frames,
-    check_media_type, extract_audio_from_video, save_video_from_frames, video_to_frames
+    check_media_type, extract_audio_from_video, save_video_from_frames, video_to_frames, iter_frames, get_video_fps,
+    BackgroundIterator, Watermark
 )
 from src.utils.imageio import save_image_cv2, read_image_cv2, save_colored_mask_cv2
 """Video and image"""
@@ -51,6 +54,8 @@ import json
 
 from backend.folders import DEEPFAKE_MODEL_FOLDER, TMP_FOLDER
 from backend.download import download_model, unzip, check_download_size, get_nested_url, is_connected
+from backend.model_registry import model_registry
+from backend.jobs import set_job_progress
 
 
 DEEPFAKE_JSON_URL = "https://wladradchenko.ru/static/wunjo.wladradchenko.ru/deepfake.json"
@@ -211,21 +216,32 @@ class AnimationFaceTalk:
 
         # init model
         print("Starting to crop and extract frames")
-        preprocess_model = CropAndExtract(DEEPFAKE_MODEL_FOLDER, path_of_net_recon_model, dir_of_BFM_fitting, device, face_fields)
+        set_job_progress(5, "Load models")
+        preprocess_model = model_registry.get(
+            "CropAndExtract", [path_of_net_recon_model, dir_of_BFM_fitting], device,
+            lambda: CropAndExtract(DEEPFAKE_MODEL_FOLDER, path_of_net_recon_model, dir_of_BFM_fitting, device, None)
+        )
 
         print("Starting get audio coefficient")
-        audio_to_coeff = Audio2Coeff(audio2pose_checkpoint, audio2pose_yaml_path, audio2exp_checkpoint, audio2exp_yaml_path, wav2lip_checkpoint, device)
+        audio_to_coeff = model_registry.get(
+            "Audio2Coeff", [audio2pose_checkpoint, audio2exp_checkpoint, wav2lip_checkpoint], device,
+            lambda: Audio2Coeff(audio2pose_checkpoint, audio2pose_yaml_path, audio2exp_checkpoint, audio2exp_yaml_path, wav2lip_checkpoint, device)
+        )
 
         print("Starting animate face from audio coefficient")
-        animate_from_coeff = AnimateFromCoeff(free_view_checkpoint, mapping_checkpoint, facerender_yaml_path, device)
+        animate_from_coeff = model_registry.get(
+            "AnimateFromCoeff", [free_view_checkpoint, mapping_checkpoint, facerender_yaml_path], device,
+            lambda: AnimateFromCoeff(free_view_checkpoint, mapping_checkpoint, facerender_yaml_path, device)
+        )
 
         # crop image and extract 3dmm from image
         first_frame_dir = os.path.join(save_dir, 'first_frame_dir')
         os.makedirs(first_frame_dir, exist_ok=True)
 
         print('Extraction 3DMM for source image')
+        set_job_progress(15, "Extraction 3DMM for source image")
         pic_path_type = check_media_type(source_image)
-        first_coeff_path, crop_pic_path, crop_info = preprocess_model.generate(source_image, first_frame_dir, preprocess, source_image_flag=True, pic_path_type=pic_path_type)
+        first_coeff_path, crop_pic_path, crop_info = preprocess_model.generate(source_image, first_frame_dir, preprocess, source_image_flag=True, pic_path_type=pic_path_type, face_fields=face_fields)
         if first_coeff_path is None:
             print("Can't get the coefficients by 3DMM of the input")
             return
@@ -234,10 +250,12 @@ class AnimationFaceTalk:
         ref_pose_coeff_path = None
 
         # audio2ceoff
+        set_job_progress(30, "Get audio coefficient")
         batch = get_data(first_coeff_path, driven_audio, device, ref_eyeblink_coeff_path, still=still)
         coeff_path = audio_to_coeff.generate(batch, save_dir, pose_style, ref_pose_coeff_path)
 
         # coeff2video
+        set_job_progress(45, "Animate face from audio coefficient")
         data = get_facerender_data(coeff_path, crop_pic_path, first_coeff_path, driven_audio, batch_size, input_yaw, input_pitch, input_roll, expression_scale=expression_scale, still_mode=still, preprocess=preprocess)
         mp4_path = animate_from_coeff.generate(data, save_dir, source_image, crop_info, preprocess=preprocess, pic_path_type=pic_path_type, device=device)
 
@@ -303,26 +321,42 @@ class AnimationMouthTalk:
         # If video_start is not 0 when cut video from start
         face = cut_start_video(face, float(video_start), float(video_end))
 
-        # get video frames
-        # TODO if users will have problem with RAM for this method, when change approach on save frames in files
-        frames, fps = get_frames(video=face, rotate=args.rotate, crop=args.crop, resize_factor=args.resize_factor)
+        # frames are read from video as stream, so only batches of frames are kept in memory
+        fps = get_video_fps(face)
         # get mel of audio
         mel_processor = MelProcessor(audio=audio, save_output=save_dir, fps=fps)
         mel_chunks = mel_processor.process()
         # create wav to lip
-        full_frames = frames[:len(mel_chunks)]
         batch_size = args.wav2lip_batch_size
-        wav2lip = GenerateFakeVideo2Lip(DEEPFAKE_MODEL_FOLDER, emotion_label=emotion_label, similar_coeff=similar_coeff)
-        wav2lip.face_fields = face_fields
-
-        print("Face detect starting")
-        gen = wav2lip.datagen(
-            full_frames.copy(), mel_chunks, box, static, args.img_size, args.wav2lip_batch_size,
-            args.pads, args.nosmooth
-        )
-        # load wav2lip
-        print("Starting mouth animate")
-        wav2lip_processed_video = wav2lip.generate_video_from_chunks(gen, mel_chunks, batch_size, wav2lip_checkpoint, device, save_dir, fps)
+        # model keeps params of request, other jobs with this model wait until mouth animate ends
+        with model_registry.use(
+            "GenerateFakeVideo2Lip", wav2lip_checkpoint, device,
+            lambda: GenerateFakeVideo2Lip(DEEPFAKE_MODEL_FOLDER, emotion_label=emotion_label, similar_coeff=similar_coeff)
+        ) as wav2lip:
+            # model can be warm from previous request, set params of current request
+            wav2lip.set_params(face_fields=face_fields, emotion_label=emotion_label, similar_coeff=similar_coeff)
+
+            def read_frames(max_frames):
+                # decode next frames in background while current frames are processed
+                return BackgroundIterator(
+                    iter_frames(face, rotate=args.rotate, crop=args.crop, resize_factor=args.resize_factor, max_frames=max_frames),
+                    max_size=args.frame_queue_size
+                )
+
+            print("Face detect starting")
+            set_job_progress(20, "Face detect")
+            gen = wav2lip.datagen_stream(
+                read_frames, mel_chunks, box, static, args.img_size, args.wav2lip_batch_size, args.pads, args.nosmooth
+            )
+            # prepare next batch in background while current batch is predicted
+            gen = BackgroundIterator(gen, max_size=1)
+            # load wav2lip
+            print("Starting mouth animate")
+            set_job_progress(30, "Mouth animate")
+            try:
+                wav2lip_processed_video = wav2lip.generate_video_from_chunks(gen, mel_chunks, batch_size, wav2lip_checkpoint, device, save_dir, fps)
+            finally:
+                gen.close()  # stop background thread if generation ended before all batches
         if wav2lip_processed_video is None:
             return
         wav2lip_result_video = wav2lip_processed_video
@@ -348,6 +382,7 @@ class AnimationMouthTalk:
             pads=[0, 10, 0, 0],
             face_det_batch_size=16,
             wav2lip_batch_size=128,
+            frame_queue_size=16,
             resize_factor=1,
             crop=[0, -1, 0, -1],
             rotate=False,
@@ -366,6 +401,7 @@ class FaceSwap:
                       type_file_source: str, target_video_start: float = 0, target_video_end: float = 0,
                       source_current_time: float = 0, source_video_end: float = 0,
                       multiface: bool = False, similarface: bool = False, similar_coeff: float = 0.95):
+        start_time = time()
         args = FaceSwap.load_faceswap_default()
 
         use_cpu = False if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu') else True
@@ -397,52 +433,53 @@ class FaceSwap:
         else:
             check_download_size(faceswap_checkpoint, link_faceswap_checkpoint)
 
-        faceswap = FaceSwapDeepfake(DEEPFAKE_MODEL_FOLDER, faceswap_checkpoint, similarface, similar_coeff, device)
-
-        # transfer video without format from frontend to mp4 format
-        if type_file_source == "video":
-            source = cut_start_video(source, 0, float(source_video_end))
-        # get fps and calculate current frame and get that frame for source
-        source_frame = get_first_frame(source, float(source_current_time))
-        source_face = faceswap.face_detect_with_alignment_from_source_frame(source_frame, source_face_fields)
-
-        # if this is video target
-        type_file_target = check_media_type(target)
-        if type_file_target == "animated":
-            # If video_start for target is not 0 when cut video from start
-            target = cut_start_video(target, float(target_video_start), float(target_video_end))
-
-            # get video frame for source if type is video
-            frame_dir = os.path.join(save_dir, "frames")
-            os.makedirs(frame_dir, exist_ok=True)
-
-            fps, frame_dir = save_frames(video=target, output_dir=frame_dir, rotate=args.rotate, crop=args.crop, resize_factor=args.resize_factor)
-            # create face swap
-            file_name = faceswap.swap_video(frame_dir, source_face, target_face_fields, save_dir, multiface, fps)
-            saved_file = os.path.join(save_dir, file_name)
-            # after generation
-            try:
-                file_name = encrypted(saved_file, save_dir)  # encrypted
-                saved_file = os.path.join(save_dir, file_name)
-            except Exception as err:
-                print(f"Error with encrypted {err}")
-
-            # get audio from video target
-            audio_file_name = extract_audio_from_video(target, save_dir)
-            # combine audio and video
-            file_name = save_video_with_audio(saved_file, os.path.join(save_dir, str(audio_file_name)), save_dir)
-
-        else:  # static file
-            # create face swap on image
-            target_frame = get_first_frame(target)
-            target_image = faceswap.swap_image(target_frame, source_face, target_face_fields, save_dir, multiface)
-            file_name = "swap_result.png"
-            saved_file = save_image_cv2(os.path.join(save_dir, file_name), target_image)
-            # after generation
-            try:
-                file_name = encrypted(saved_file, save_dir)  # encrypted
-            except Exception as err:
-                print(f"Error with encrypted {err}")
+        # model keeps params of request, other jobs with this model wait until face swap ends
+        with model_registry.use(
+            "FaceSwapDeepfake", faceswap_checkpoint, device,
+            lambda: FaceSwapDeepfake(DEEPFAKE_MODEL_FOLDER, faceswap_checkpoint, similarface, similar_coeff, device)
+        ) as faceswap:
+            # model can be warm from previous request, set params of current request
+            faceswap.set_params(similarface=similarface, similar_coeff=similar_coeff)
+
+            # transfer video without format from frontend to mp4 format
+            set_job_progress(10, "Face detect on source")
+            if type_file_source == "video":
+                source = cut_start_video(source, 0, float(source_video_end))
+            # get fps and calculate current frame and get that frame for source
+            source_frame = get_first_frame(source, float(source_current_time))
+            source_face = faceswap.face_detect_with_alignment_from_source_frame(source_frame, source_face_fields)
+
+            # if this is video target
+            type_file_target = check_media_type(target)
+            if type_file_target == "animated":
+                # If video_start for target is not 0 when cut video from start
+                target = cut_start_video(target, float(target_video_start), float(target_video_end))
+
+                # frames of target are piped from ffmpeg, so they are not saved on disk
+                fps = get_video_fps(target)
+                # get audio from video target
+                audio_file_name = extract_audio_from_video(target, save_dir)
+                # create face swap, watermark and audio are added in the same encode pass
+                set_job_progress(20, "Face swap")
+                watermark = Watermark()
+                file_name = faceswap.swap_video(
+                    target, source_face, target_face_fields, save_dir, multiface, fps,
+                    audio=os.path.join(save_dir, str(audio_file_name)), watermark=watermark
+                )
+                job_time = time() - start_time
+                print(f"Watermark took {watermark.elapsed:.2f} s, {100 * watermark.elapsed / max(job_time, 1e-6):.1f}% of face swap {job_time:.2f} s")
+
+            else:  # static file
+                # create face swap on image
+                target_frame = get_first_frame(target)
+                target_image = faceswap.swap_image(target_frame, source_face, target_face_fields, save_dir, multiface)
+                file_name = "swap_result.png"
+                saved_file = save_image_cv2(os.path.join(save_dir, file_name), target_image)
+                # after generation
+                try:
+                    file_name = encrypted(saved_file, save_dir)  # encrypted
+                except Exception as err:
+                    print(f"Error with encrypted {err}")
 
         for f in os.listdir(save_dir):
             if file_name == f:
@@ -600,9 +637,9 @@ class Retouch:
         segment_percentage = segment_percentage / 100
         segmentation = SegmentAnything(segment_percentage)
         if session is None:
-            session = segmentation.init_onnx(onnx_vit_checkpoint, device)
+            session = model_registry.get("SamOnnx", onnx_vit_checkpoint, device, lambda: segmentation.init_onnx(onnx_vit_checkpoint, device))
         if predictor is None:
-            predictor = segmentation.init_vit(sam_vit_checkpoint, vit_model_type, device)
+            predictor = model_registry.get("SamPredictor", sam_vit_checkpoint, device, lambda: segmentation.init_vit(sam_vit_checkpoint, vit_model_type, device))
 
         # cut video
         if source_type == "video":
@@ -677,57 +714,76 @@ class Retouch:
         segmentation.load_models(predictor=predictor, session=session)
         thickness_mask = 10
 
+        # each object has own tracker, but embedding of frame is computed once for all objects on this frame
+        trackers = {}
         for key in masks.keys():
-            print(f"Processing ID: {key}")
             mask_key_save_path = os.path.join(tmp_dir, f"mask_{key}")
             os.makedirs(mask_key_save_path, exist_ok=True)
-            start_time = masks[key]["start_time"]
-            end_time = masks[key]["end_time"]
-            start_frame = math.floor(start_time * fps)
-            end_frame = math.ceil(end_time * fps) + 1
-            # list of frames of list of one frame
-            filter_frames_files = frame_files[start_frame:end_frame]
-            # set progress bar
-            progress_bar = tqdm(total=len(filter_frames_files), unit='it', unit_scale=True)
-            filter_frame_file_name = filter_frames_files[0]
-            # read mot resized files
-            # TODO [1] work_dir has resized frames, but in this case I don't know quality of image after resize influence on segmentation quality? if not when use work_dir better else need to use frame_dir and resized on retouch
-            filter_frame = cv2.imread(os.path.join(work_dir, filter_frame_file_name))  # read first frame file after filter
-            # get segment mask
-            segment_mask = segmentation.set_obj(point_list=masks[key]["point_list"], frame=filter_frame)
-            # save first frame as 0001
-            segmentation.save_black_mask(filter_frame_file_name, segment_mask, mask_key_save_path, kernel_size=thickness_mask, width=work_width, height=work_height)
+            start_frame = min(math.floor(masks[key]["start_time"] * fps), len(frame_files) - 1)
+            end_frame = min(math.ceil(masks[key]["end_time"] * fps) + 1, len(frame_files))
             if mask_color:
-                color = segmentation.hex_to_rgba(mask_color)
                 os.makedirs(os.path.join(save_dir, key), exist_ok=True)
-                orig_filter_frame = cv2.imread(os.path.join(frame_dir, filter_frame_file_name))
-                saving_mask = segmentation.apply_mask_on_frame(segment_mask, orig_filter_frame, color, orig_width, orig_height)
-                saving_mask.save(os.path.join(save_dir, key, filter_frame_file_name))
-
-            # update progress bar
-            progress_bar.update(1)
-
-            if len(filter_frames_files) > 1:
-                for filter_frame_file_name in filter_frames_files[1:]:
-                    # TODO [1] work_dir has resized frames, but in this case I don't know quality of image after resize influence on segmentation quality? if not when use work_dir better else need to use frame_dir and resized on retouch
-                    filter_frame = cv2.imread(os.path.join(work_dir, filter_frame_file_name))  # read frame file after filter
-                    segment_mask = segmentation.draw_mask_frames(frame=filter_frame)
+            tracker = SegmentAnything(segment_percentage)
+            tracker.load_models(predictor=predictor, session=session)
+            # set new key
+            masks[key]["frame_files_path"] = mask_key_save_path
+            trackers[key] = {
+                "segmentation": tracker, "start_frame": start_frame, "end_frame": max(end_frame, start_frame + 1),
+                "save_path": mask_key_save_path, "is_lost": False
+            }
+
+        frame_ids = sorted(set(i for t in trackers.values() for i in range(t["start_frame"], t["end_frame"])))
+        embedding_batch_size = 4 if device == "cuda" else 1  # frames in one image encoder pass
+        progress_bar = tqdm(total=len(frame_ids), unit='it', unit_scale=True)
+
+        for window_start in range(0, len(frame_ids), embedding_batch_size):
+            window_ids = frame_ids[window_start:window_start + embedding_batch_size]
+            # TODO [1] work_dir has resized frames, but in this case I don't know quality of image after resize influence on segmentation quality? if not when use work_dir better else need to use frame_dir and resized on retouch
+            window_frames = [cv2.imread(os.path.join(work_dir, frame_files[i])) for i in window_ids]
+            # embedding cache of window keyed by frame index, shared by all objects
+            embedding_cache = dict(zip(window_ids, segmentation.get_embeddings(predictor, window_frames)))
+
+            for frame_id, filter_frame in zip(window_ids, window_frames):
+                filter_frame_file_name = frame_files[frame_id]
+                active_keys = [
+                    key for key, t in trackers.items()
+                    if t["start_frame"] <= frame_id < t["end_frame"] and not t["is_lost"]
+                ]
+                if not active_keys:
+                    progress_bar.update(1)
+                    continue
+                prompts = []
+                for key in active_keys:
+                    tracker = trackers[key]
+                    is_first = frame_id == tracker["start_frame"]
+                    point_list = masks[key]["point_list"] if is_first else None
+                    prompts.append(tracker["segmentation"].get_obj_prompt(filter_frame.shape, point_list))
+                # decode all objects of frame together
+                decoded_masks = segmentation.decode_masks(prompts, embedding_cache.pop(frame_id), filter_frame.shape)
+
+                orig_filter_frame = None
+                for key, decoded_mask in zip(active_keys, decoded_masks):
+                    tracker = trackers[key]
+                    if frame_id == tracker["start_frame"]:
+                        segment_mask = tracker["segmentation"].init_obj(masks[key]["point_list"], decoded_mask)
+                    else:
+                        segment_mask = tracker["segmentation"].update_obj(decoded_mask, filter_frame.shape)
                     if segment_mask is None:
                         print(key, "Encountered None mask. Breaking the loop.")
-                        break
-                    # save frames after 0002
-                    segmentation.save_black_mask(filter_frame_file_name, segment_mask, mask_key_save_path, kernel_size=thickness_mask, width=work_width, height=work_height)
+                        tracker["is_lost"] = True
+                        continue
+                    segmentation.save_black_mask(filter_frame_file_name, segment_mask, tracker["save_path"], kernel_size=thickness_mask, width=work_width, height=work_height)
                     if mask_color:
                         color = segmentation.hex_to_rgba(mask_color)
-                        orig_filter_frame = cv2.imread(os.path.join(frame_dir, filter_frame_file_name))
+                        if orig_filter_frame is None:
+                            orig_filter_frame = cv2.imread(os.path.join(frame_dir, filter_frame_file_name))
                         saving_mask = segmentation.apply_mask_on_frame(segment_mask, orig_filter_frame, color, orig_width, orig_height)
                         saving_mask.save(os.path.join(save_dir, key, filter_frame_file_name))
 
-                    progress_bar.update(1)
-            # set new key
-            masks[key]["frame_files_path"] = mask_key_save_path
-            # close progress bar for key
-            progress_bar.close()
+                progress_bar.update(1)
+            set_job_progress(50 * progress_bar.n / max(len(frame_ids), 1), "Segmentation")
+        # close progress bar
+        progress_bar.close()
 
         if mask_color:
             print("Mask save is finished. Open folder")
@@ -742,7 +798,7 @@ class Retouch:
                     # Open folder for Linux
                     subprocess.Popen(['xdg-open', save_dir])
 
-        del segmentation, predictor, session
+        del segmentation, trackers, predictor, session
         torch.cuda.empty_cache()
 
         if retouch_model_type is None:
@@ -754,7 +810,10 @@ class Retouch:
 
         if source_media_type == "animated" and retouch_model_type == "improved_retouch_object":
             # raft
-            retouch_processor = VideoRemoveObjectProcessor(device, model_raft_things_path, model_recurrent_flow_path, model_pro_painter_path)
+            retouch_processor = model_registry.get(
+                "VideoRemoveObjectProcessor", [model_raft_things_path, model_recurrent_flow_path, model_pro_painter_path], device,
+                lambda: VideoRemoveObjectProcessor(device, model_raft_things_path, model_recurrent_flow_path, model_pro_painter_path)
+            )
             overlap = int(0.2 * frame_batch_size)
 
             for key in masks.keys():
@@ -794,6 +853,7 @@ class Retouch:
                     comp_frames = retouch_processor.process_video_with_mask(update_frames, masks_dilated, flow_masks, frames_inp, width, height, use_half=use_half)
                     comp_frames = [cv2.resize(f, out_size) for f in comp_frames]
                     comp_frames_bgr = [cv2.cvtColor(f, cv2.COLOR_RGB2BGR) for f in comp_frames]
+                    set_job_progress(50 + 45 * min(i + frame_batch_size, len(mask_files)) / len(mask_files), f"Retouch {key}")
                     # update frames in work dir
                     for j in range(len(comp_frames_bgr)):
                         cv2.imwrite(os.path.join(work_dir, current_frame_files[j]), comp_frames_bgr[j])
@@ -807,7 +867,7 @@ class Retouch:
             torch.cuda.empty_cache()
         else:
             # retouch
-            model_retouch = InpaintModel(model_path=model_retouch_path)
+            model_retouch = model_registry.get("InpaintModel", model_retouch_path, device, lambda: InpaintModel(model_path=model_retouch_path))
 
             for key in masks.keys():
                 mask_files = sorted(os.listdir(masks[key]["frame_files_path"]))
@@ -828,6 +888,7 @@ class Retouch:
                     # update frame
                     cv2.imwrite(os.path.join(work_dir, file_name), pil_to_cv2(retouch_frame))
                     progress_bar.update(1)
+                    set_job_progress(50 + 45 * progress_bar.n / len(mask_files), f"Retouch {key}")
                 # close progress bar for key
                 progress_bar.close()
             # empty cache
@@ -885,15 +946,17 @@ class VideoEdit:
                 device = "cpu"
 
             print("Get audio and video frames")
-            _, fps = get_frames(video=source, rotate=False, crop=[0, -1, 0, -1], resize_factor=1)
+            fps = get_video_fps(source)
             if check_media_type(source) == "animated":
                 source = cut_start_video(source, media_start, media_end)
                 print("Starting improve video")
+                set_job_progress(10, "Improve video")
                 enhanced_name = content_enhancer(source, save_folder=save_dir, method=enhancer, fps=float(fps), device=device)
                 enhanced_path = os.path.join(save_dir, enhanced_name)
                 save_name = save_video_with_audio(enhanced_path, os.path.join(save_dir, audio_file_name), save_dir)
             else:
                 print("Starting improve image")
+                set_job_progress(10, "Improve image")
                 save_name = content_enhancer(source, save_folder=save_dir, method=enhancer, device=device)
 
             for f in os.listdir(save_dir):
@@ -951,6 +1014,11 @@ class VideoEdit:
 
 
 class GetSegment:
+    # embeddings of previewed frames, key is (file, size, mtime, timestamp, registry key of predictor)
+    embedding_cache = OrderedDict()
+    embedding_cache_size = 16
+    embedding_lock = threading.Lock()
+
     @staticmethod
     def load_model():
         use_cpu = False if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu') else True
@@ -1012,29 +1080,78 @@ class GetSegment:
                 check_download_size(onnx_vit_checkpoint, link_onnx_vit_checkpoint)
 
         segmentation = SegmentAnything()
-        predictor = segmentation.init_vit(sam_vit_checkpoint, model_type, device)
-        session = segmentation.init_onnx(onnx_vit_checkpoint, device)
+        predictor = model_registry.get("SamPredictor", sam_vit_checkpoint, device, lambda: segmentation.init_vit(sam_vit_checkpoint, model_type, device))
+        session = model_registry.get("SamOnnx", onnx_vit_checkpoint, device, lambda: segmentation.init_onnx(onnx_vit_checkpoint, device))
 
-        return {"predictor": predictor, "session": session}
+        # id of object can be reused after model was evicted, embeddings are keyed by checkpoint and device
+        model_key = model_registry.make_key("SamPredictor", sam_vit_checkpoint, device)
+
+        return {"predictor": predictor, "session": session, "model_key": model_key}
 
     @staticmethod
-    def get_segment_mask_file(predictor, session, source: str, point_list: list):
-        # set time sleep else file will not still loaded
+    def wait_file_ready(path: str, timeout: float = 5, interval: float = 0.05) -> None:
+        """
+        Wait while uploaded file is still written, file is ready if size does not change
+        :param path: path to file
+        :param timeout: max time to wait in seconds
+        :param interval: time between checks
+        :return: None
+        """
         import time
-        time.sleep(5)
-        # read frame
+        end_time = time.time() + timeout
+        prev_size = -1
+        while time.time() < end_time:
+            size = os.path.getsize(path) if os.path.exists(path) else -1
+            if size > 0 and size == prev_size:
+                return
+            prev_size = size
+            time.sleep(interval)
+
+    @staticmethod
+    def get_frame_embedding(predictor, source: str, current_time: float = 0, model_key: tuple = None):
+        """
+        Get frame shape and image embedding of source at current time. Embedding is computed once
+        for (file, timestamp) and kept in LRU cache, so each click runs only decoder
+        :param predictor: SamPredictor
+        :param source: path to image or video
+        :param current_time: time of frame in video
+        :param model_key: registry key of predictor, if None embedding is not cached
+        :return: frame shape and embedding or None if source is not media
+        """
+        stat = os.stat(source)
+        key = (os.path.abspath(source), stat.st_size, stat.st_mtime, round(float(current_time), 3), model_key)
+        with GetSegment.embedding_lock:
+            if key in GetSegment.embedding_cache:
+                GetSegment.embedding_cache.move_to_end(key)
+                return GetSegment.embedding_cache[key]
+
         source_media_type = check_media_type(source)
-        if source_media_type == "static":
-            frame = read_image_cv2(source)
-        elif source_media_type == "animated":
-            frames, _ = get_frames(video=source, rotate=False, crop=[0, -1, 0, -1], resize_factor=1)
-            frame = frames[0]
-        else:
+        if source_media_type not in ("static", "animated"):
+            return None
+        # decode only requested frame
+        frame = get_first_frame(source, float(current_time))
+        embedding = SegmentAnything.get_embedding(predictor, frame)
+        if model_key is None:
+            return frame.shape, embedding
+
+        with GetSegment.embedding_lock:
+            GetSegment.embedding_cache[key] = (frame.shape, embedding)
+            while len(GetSegment.embedding_cache) > GetSegment.embedding_cache_size:
+                GetSegment.embedding_cache.popitem(last=False)
+        return frame.shape, embedding
+
+    @staticmethod
+    def get_segment_mask_file(predictor, session, source: str, point_list: list, current_time: float = 0, model_key: tuple = None):
+        # file can be still loaded after upload
+        GetSegment.wait_file_ready(source)
+        frame_embedding = GetSegment.get_frame_embedding(predictor, source, current_time, model_key)
+        if frame_embedding is None:
             # return source
             return os.path.basename(source)
-        # segmentation
-        segmentation = SegmentAnything()
-        mask = segmentation.draw_mask(predictor=predictor, session=session, frame=frame, point_list=point_list)
+        frame_shape, embedding = frame_embedding
+        # segmentation, only decoder is run for each click
+        onnx_coord, onnx_label = SegmentAnything.get_prompt(predictor, point_list, frame_shape)
+        mask = SegmentAnything.run_decoder(predictor, session, embedding, onnx_coord, onnx_label, frame_shape)
         # save mask in tmp?
         mask_file_name = save_colored_mask_cv2(TMP_FOLDER, mask)
         return mask_file_name
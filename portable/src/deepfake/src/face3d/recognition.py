@@ -10,14 +10,16 @@ import onnxruntime
 
 class FaceRecognition:
     """ONNX Face Recognition (if I will use onnx models)"""
-    def __init__(self, model_path):
+    def __init__(self, model_path, sess_options=None):
         # use cpu as with cuda on onnx can be problem
         access_providers = onnxruntime.get_available_providers()
         if "CUDAExecutionProvider" in access_providers:
             provider = ["CUDAExecutionProvider"] if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu') else ["CPUExecutionProvider"]
         else:
             provider = ["CPUExecutionProvider"]
-        self.face_analyser = insightface.app.FaceAnalysis(name='buffalo_l', root=model_path, providers=provider)
+        # sess_options can limit threads of onnxruntime if several processes work in parallel
+        session_params = {"sess_options": sess_options} if sess_options is not None else {}
+        self.face_analyser = insightface.app.FaceAnalysis(name='buffalo_l', root=model_path, providers=provider, **session_params)
         self.face_analyser.prepare(ctx_id=0)
 
         self.window = []
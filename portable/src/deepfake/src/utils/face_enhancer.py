@@ -2,14 +2,59 @@ import os
 import cv2
 import json
 import uuid
+import time
 
 from tqdm import tqdm
 
-from deepfake.src.utils.videoio import save_video_from_frames
+from deepfake.src.utils.videoio import FFmpegVideoReader, FFmpegVideoWriter, BackgroundIterator, BackgroundVideoWriter
 from backend.folders import DEEPFAKE_MODEL_FOLDER
 from backend.download import get_nested_url, is_connected
 
 
+# Number of frames enhanced in one batch, can be changed by env before start application
+ENHANCER_BATCH_ENV = "WUNJO_ENHANCER_BATCH"
+
+
+def get_enhancer_batch_size(device: str) -> int:
+    default = 4 if device == "cuda" else 1
+    try:
+        return max(1, int(os.environ.get(ENHANCER_BATCH_ENV, default)))
+    except ValueError:
+        print(f"Error... {ENHANCER_BATCH_ENV} has to be integer, used default {default}")
+        return default
+
+
+def iter_batches(frames, batch_size: int):
+    """Group frames in lists of batch_size"""
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def enhance_batch(restorer, method: str, frames: list) -> list:
+    """
+    Enhance batch of frames
+    :param restorer: GFPGANer or RealESRGANer
+    :param method: name of method
+    :param frames: list of frames with the same size
+    :return: list of enhanced frames
+    """
+    if method == 'gfpgan':
+        return restorer.enhance_batch(frames, only_center_face=False)
+    elif method in ['animesgan', 'realesrgan']:
+        # downgrade quality before upscale
+        frames = [resize_frame_downscale(frame, scale=0.5) for frame in frames]
+        outputs = restorer.enhance_batch(frames)
+        # downscale after upscale
+        return [resize_frame_downscale(output, scale=0.5) for output in outputs]
+    raise ValueError(f'Wrong model version {method}.')
+
+
 def enhancer(media_path, save_folder, method='gfpgan', device='cpu', fps=30):
     if os.path.isfile(os.path.join(DEEPFAKE_MODEL_FOLDER, 'deepfake.json')):
         with open(os.path.join(DEEPFAKE_MODEL_FOLDER, 'deepfake.json'), 'r', encoding="utf8") as file:
@@ -18,8 +63,6 @@ def enhancer(media_path, save_folder, method='gfpgan', device='cpu', fps=30):
         raise "[Error] Config file deepfake.json is not exist"
 
     local_model_path = os.path.join(DEEPFAKE_MODEL_FOLDER, 'gfpgan', 'weights')
-    save_frame_folder = os.path.join(save_folder, "enhancer")
-    os.makedirs(save_frame_folder, exist_ok=True)
 
     if method == 'gfpgan':
         from deepfake.src.utils.gfpganer import GFPGANer
@@ -120,32 +163,32 @@ def enhancer(media_path, save_folder, method='gfpgan', device='cpu', fps=30):
         raise ValueError(f'Wrong model version {method}.')
 
     if media_path.endswith(('.mp4', '.avi', '.mov', '.gif')):  # Video or GIF
-        cap = cv2.VideoCapture(media_path)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-        for idx in tqdm(range(total_frames), desc="Processing video"):
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            if method == 'gfpgan':
-                _, _, output = restorer.enhance(frame, has_aligned=False, only_center_face=False, paste_back=True)
-            elif method in ['animesgan', 'realesrgan']:
-                # downgrade quality before upscale
-                frame = resize_frame_downscale(frame, scale=0.5)
-                output, _ = restorer.enhance(frame)
-                # downscale after upscale
-                output = resize_frame_downscale(output, scale=0.5)
-            else:
-                raise ValueError(f'Wrong model version {method}.')
-
-            # Create a unique filename based on the current frame index
-            file_name = f"{idx:04d}.png"
-            save_path = os.path.join(save_frame_folder, file_name)
-            cv2.imwrite(save_path, output)
-
-        cap.release()
-        file_name = save_video_from_frames(frame_names="%04d.png", save_path=save_frame_folder, fps=fps, alternative_save_path=save_folder)
+        batch_size = get_enhancer_batch_size(device)
+        reader = FFmpegVideoReader(media_path)
+        # decode ahead in background thread
+        frames = BackgroundIterator(reader, max_size=batch_size * 2)
+        file_name = str(uuid.uuid4()) + '.mp4'
+        writer = None
+        num_frames = 0
+        start_time = time.time()
+
+        progress_bar = tqdm(total=len(reader), desc="Processing video")
+        for batch in iter_batches(frames, batch_size):
+            outputs = enhance_batch(restorer, method, batch)
+            if writer is None:
+                # size of output is known only after first enhanced batch, encode in background thread
+                size = (outputs[0].shape[1], outputs[0].shape[0])
+                writer = BackgroundVideoWriter(writer=FFmpegVideoWriter(os.path.join(save_folder, file_name), fps, size), max_size=batch_size * 2)
+            for output in outputs:
+                writer.write(output)
+            num_frames += len(batch)
+            progress_bar.update(len(batch))
+        progress_bar.close()
+
+        if writer is not None:
+            writer.release()
+        elapsed = time.time() - start_time
+        print(f"Enhancer {method}: {num_frames} frames in {elapsed:.2f} s, {num_frames / max(elapsed, 1e-6):.2f} fps")
     else:  # Image
         file_name = str(uuid.uuid4()) + '.png'
         save_path = os.path.join(save_folder, file_name)
@@ -181,4 +224,42 @@ def resize_frame_downscale(frame, scale=0.25, min_side=320):
             new_width = int(new_height / aspect_ratio)
     # Resize the frame
     resized_frame = cv2.resize(frame, (new_width, new_height))
-    return resized_frame
\ No newline at end of file
+    return resized_frame
+
+def benchmark(media_path, save_folder, methods=('gfpgan', 'animesgan', 'realesrgan'), device='cpu'):
+    """
+    Measure frames per second of each enhancer method on video
+    :param media_path: path to video
+    :param save_folder: folder for results
+    :param methods: methods to measure
+    :param device: cpu or cuda
+    :return: dict of method and fps
+    """
+    num_frames = len(FFmpegVideoReader(media_path))
+    fps = FFmpegVideoReader(media_path).fps
+    results = {}
+    for method in methods:
+        start_time = time.time()
+        file_name = enhancer(media_path, save_folder, method=method, device=device, fps=fps)
+        elapsed = time.time() - start_time
+        if file_name == media_path:
+            print(f"Enhancer {method} is skipped on {device}")
+            continue
+        results[method] = num_frames / max(elapsed, 1e-6)
+        os.remove(os.path.join(save_folder, file_name))
+    for method, method_fps in results.items():
+        print(f"{method}: {method_fps:.2f} fps")
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Frames per second benchmark of video enhancer")
+    parser.add_argument("video", help="path to video")
+    parser.add_argument("--methods", nargs="+", default=['gfpgan', 'animesgan', 'realesrgan'])
+    parser.add_argument("--device", default="cuda" if os.environ.get('WUNJO_TORCH_DEVICE', 'cpu') != 'cpu' else "cpu")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        benchmark(args.video, tmp_folder, args.methods, args.device)
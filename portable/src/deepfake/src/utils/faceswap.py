@@ -10,26 +10,67 @@ import onnxruntime
 import insightface
 
 from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
 import threading
 
 root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, os.path.join(root_path, "deepfake"))
 from src.face3d.recognition import FaceRecognition
+from src.utils.videoio import FFmpegVideoReader, FFmpegVideoWriter
 sys.path.pop(0)
 
 
+# Number of processes for face swap on CPU, can be changed by env before start application.
+# Each process loads own onnx sessions for every video, so it pays off only on long videos and many cores
+FACESWAP_WORKERS_ENV = "WUNJO_FACESWAP_WORKERS"
+DEFAULT_FACESWAP_WORKERS = 1
+
+_worker_faceswap = None  # face swap of worker process
+
+
+def get_faceswap_workers() -> int:
+    """
+    Number of processes for face swap on CPU, default is one process without pool
+    :return: number of processes
+    """
+    try:
+        return max(1, int(os.environ.get(FACESWAP_WORKERS_ENV, DEFAULT_FACESWAP_WORKERS)))
+    except ValueError:
+        print(f"Error... {FACESWAP_WORKERS_ENV} has to be integer, used default {DEFAULT_FACESWAP_WORKERS}")
+        return DEFAULT_FACESWAP_WORKERS
+
+
+def _init_shard_worker(model_path, face_swap_model_path, similarface, similar_coeff, num_threads):
+    """Load sessions once in each worker process"""
+    global _worker_faceswap
+    _worker_faceswap = FaceSwapDeepfake(model_path, face_swap_model_path, similarface, similar_coeff, "cpu", num_threads)
+
+
+def _swap_shard(task):
+    target_video, start_frame, num_frames, source_face, target_face_fields, shard_file, multiface, fps, init_face = task
+    return _worker_faceswap.swap_shard(target_video, start_frame, num_frames, source_face, target_face_fields, shard_file, multiface, fps, init_face)
+
+
 class FaceSwapDeepfake:
     """
     Face swap by one photo
     """
-    def __init__(self, model_path, face_swap_model_path, similarface = False, similar_coeff=0.95, device="cpu"):
+    def __init__(self, model_path, face_swap_model_path, similarface = False, similar_coeff=0.95, device="cpu", num_threads=None):
         """
         Initialization
         :param model_path: path to model deepfake where will be download face recognition
         :param face_swap_model_path: path to face swap model
+        :param num_threads: limit of onnxruntime threads, used if several processes work in parallel
         """
         self.device = device
-        self.face_recognition = FaceRecognition(model_path)
+        self.model_path = model_path
+        self.face_swap_model_path = face_swap_model_path
+        self.sess_options = None
+        if num_threads is not None:
+            self.sess_options = onnxruntime.SessionOptions()
+            self.sess_options.intra_op_num_threads = num_threads
+            self.sess_options.inter_op_num_threads = 1
+        self.face_recognition = FaceRecognition(model_path, sess_options=self.sess_options)
         self.access_providers = onnxruntime.get_available_providers()
         self.face_swap_model = self.load(face_swap_model_path)
         self.face_target_fields = None
@@ -38,6 +79,18 @@ class FaceSwapDeepfake:
         self.progress = 0  # Initialize a progress counter
         self.similar_coeff = similar_coeff
 
+    def set_params(self, similarface=False, similar_coeff=0.95):
+        """
+        Set params of request, because object can be reused between requests
+        :param similarface: swap all similar faces in frame
+        :param similar_coeff: similarity coefficient for face
+        :return: None
+        """
+        self.face_target_fields = None
+        self.similarface = similarface
+        self.similar_coeff = similar_coeff
+        self.progress = 0
+
     def load(self, face_swap_model_path):
         """
         Load model ONNX face swap
@@ -50,7 +103,8 @@ class FaceSwapDeepfake:
         else:
             provider = ["CPUExecutionProvider"]
 
-        return insightface.model_zoo.get_model(face_swap_model_path, providers=provider)
+        session_params = {"sess_options": self.sess_options} if self.sess_options is not None else {}
+        return insightface.model_zoo.get_model(face_swap_model_path, providers=provider, **session_params)
 
     @staticmethod
     def get_real_crop_box(frame, squareFace):
@@ -114,23 +168,30 @@ class FaceSwapDeepfake:
             boxes[i] = np.mean(window, axis=0)
         return boxes
 
-    def face_detect_with_alignment_crop(self, image_files, face_fields):
+    def face_detect_with_alignment_crop(self, images, face_fields, init_face=None):
         """
         Detect faces to swap if face_fields
-        :param image_files: list of file paths of target images
+        :param images: list or generator of target frames
         :param face_fields: crop target face
+        :param init_face: target face found before, used if frames are not from start of video
         :return:
         """
         predictions = []
         face_embedding_list = []
         face_gender = None
-
-        # Read the first image to get the center
-        first_image = cv2.imread(image_files[0])
-        x_center, y_center = self.get_real_crop_box(first_image, face_fields)
-
-        for image_file in tqdm(image_files):
-            image = cv2.imread(image_file)
+        x_center, y_center = None, None
+
+        if init_face is not None:
+            x1, y1, x2, y2 = init_face.bbox
+            face_gender = init_face.gender
+            face_embedding_list += [init_face.normed_embedding]
+            x_center = int((x1 + x2) / 2)
+            y_center = int((y1 + y2) / 2)
+
+        for idx, image in enumerate(tqdm(images)):
+            if idx == 0 and init_face is None:
+                # use the first image to get the center
+                x_center, y_center = self.get_real_crop_box(image, face_fields)
             dets = self.face_recognition.get_faces(image)
             if not dets:
                 predictions.append([None])
@@ -192,15 +253,14 @@ class FaceSwapDeepfake:
 
         return predictions
 
-    def face_detect_with_alignment_all(self, image_files):
+    def face_detect_with_alignment_all(self, images):
         """
         Detect all faces in each image
-        :param image_files: list of file paths of images
+        :param images: list or generator of frames
         :return: list of detected faces for each image
         """
         predictions = []
-        for image_file in tqdm(image_files):
-            image = cv2.imread(image_file)
+        for image in tqdm(images):
             dets = self.face_recognition.get_faces(image)
             if not dets:
                 predictions.append([None])
@@ -209,133 +269,205 @@ class FaceSwapDeepfake:
         return predictions
 
     def process_frame(self, args):
-        frame, face_det_result, source_face, progress_bar, output_directory, idx = args
+        frame, face_det_result, source_face, progress_bar = args
         tmp_frame = frame.copy()
         for face in face_det_result:
             if face is None:
                 break
             else:
                 tmp_frame = self.face_swap_model.get(tmp_frame, face, source_face, paste_back=True)
-        # Save the frame with zero-padded filename
-        filename = os.path.join(output_directory, f"frame_{idx:04d}.png")
-        cv2.imwrite(filename, tmp_frame)
         with self.lock:
             self.progress += 1
             progress_bar.update(1)  # Update progress bar in a thread-safe manner
-        return filename
+        return tmp_frame
 
-    def swap_video(self, target_frames_path, source_face, target_face_fields, save_file: str, multiface=False, fps=30, video_format=".mp4"):
+    def swap_video(self, target_video, source_face, target_face_fields, save_file: str, multiface=False, fps=30,
+                   video_format=".mp4", audio=None, watermark=None):
         if "CUDAExecutionProvider" in self.access_providers and torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu'):
             # thread will not work correct with GPU
-            return self.swap_video_cuda(target_frames_path, source_face, target_face_fields, save_file, multiface, fps, video_format)
-        else:
-            return self.swap_video_thread(target_frames_path, source_face, target_face_fields, save_file, multiface, fps,video_format)
+            return self.swap_video_cuda(target_video, source_face, target_face_fields, save_file, multiface, fps, video_format, audio, watermark)
+        workers = get_faceswap_workers()
+        if workers > 1:
+            return self.swap_video_sharded(target_video, source_face, target_face_fields, save_file, multiface, fps, video_format, audio, watermark, workers)
+        return self.swap_video_thread(target_video, source_face, target_face_fields, save_file, multiface, fps, video_format, audio, watermark)
+
+    def detect_video_faces(self, reader, target_face_fields, multiface=False, init_face=None):
+        """
+        Detect faces in video, frames are read from pipe and only detections are kept
+        :param reader: video reader
+        :param target_face_fields: crop field for target face
+        :param multiface: bool use swap all face or use target crop
+        :param init_face: target face found before, used if frames are not from start of video
+        :return: list of detected faces for each frame
+        """
+        if multiface:
+            print("Getting all face...")
+            return self.face_detect_with_alignment_all(reader)
+        print("Getting target face...")
+        return self.face_detect_with_alignment_crop(reader, target_face_fields, init_face)
+
+    def swap_shard(self, target_video, start_frame, num_frames, source_face, target_face_fields, shard_file, multiface=False, fps=30, init_face=None):
+        """
+        Detect and swap faces in contiguous part of video, result is saved as lossless video
+        :param target_video: path to target video
+        :param start_frame: index of first frame of shard
+        :param num_frames: number of frames in shard, None is until end of video
+        :param source_face: source face
+        :param target_face_fields: crop field for target face
+        :param shard_file: path to save shard
+        :param multiface: bool use swap all face or use target crop
+        :param fps: video fps
+        :param init_face: target face from first frame of video
+        :return: path to shard or None if shard is empty
+        """
+        reader = FFmpegVideoReader(target_video, max_frames=num_frames, start_frame=start_frame)
+        face_det_results = self.detect_video_faces(reader, target_face_fields, multiface, init_face)
+        if len(face_det_results) == 0:
+            return None
+        with FFmpegVideoWriter(shard_file, fps, (reader.width, reader.height), lossless=True) as out:
+            for tmp_frame, dets in zip(reader, face_det_results):
+                for face in dets:
+                    if face is None:
+                        break
+                    else:
+                        tmp_frame = self.face_swap_model.get(tmp_frame, face, source_face, paste_back=True)
+                out.write(tmp_frame)
+        return shard_file
+
+    def swap_video_sharded(self, target_video, source_face, target_face_fields, save_path: str, multiface=False, fps=30,
+                           video_format=".mp4", audio=None, watermark=None, workers=2):
+        """
+        Face swap video in process pool. Video is split on contiguous shards, each worker process has own
+        face recognition and face swap sessions, shards are merged in order into encoder
+        :param target_video: path to target video
+        :param source_face: source face
+        :param target_face_fields: crop field for target face
+        :param save_path: save directory
+        :param multiface: bool use swap all face or use target crop
+        :param fps: video fps
+        :param video_format: video format
+        :param audio: path to audio which is added in the same encode, can be None
+        :param watermark: Watermark which is put in frames in the same encode, can be None
+        :param workers: number of processes
+        :return: file name
+        """
+        file_name = str(uuid.uuid4()) + video_format
+        save_file = os.path.join(save_path, file_name)
+        reader = FFmpegVideoReader(target_video)
+        frame_count = len(reader)
+        workers = max(1, min(workers, frame_count))
+        shard_size = int(np.ceil(frame_count / workers))
+
+        init_face = None
+        if not multiface:
+            # shards after first one have to know target face from start of video
+            first_frame = next(iter(FFmpegVideoReader(target_video, max_frames=1)), None)
+            if first_frame is not None:
+                try:
+                    init_face = self.face_detect_with_alignment_from_source_frame(first_frame, target_face_fields)
+                except FaceNotDetectedError:
+                    init_face = None
+
+        tasks = []
+        for i in range(workers):
+            start_frame = i * shard_size
+            # last shard reads until end, because frame count of container can be not exact
+            num_frames = shard_size if i < workers - 1 else None
+            shard_file = os.path.join(save_path, f"shard_{i:03d}_{file_name}")
+            tasks.append((target_video, start_frame, num_frames, source_face, target_face_fields, shard_file,
+                          multiface, fps, None if i == 0 else init_face))
+
+        print(f"Starting face swap in {workers} processes...")
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+        context = multiprocessing.get_context("spawn")
+        # worker processes import this module by the same path as main process
+        sys.path.insert(0, os.path.dirname(root_path))
+        try:
+            pool = context.Pool(
+                processes=workers, initializer=_init_shard_worker,
+                initargs=(self.model_path, self.face_swap_model_path, self.similarface, self.similar_coeff, num_threads)
+            )
+        finally:
+            sys.path.pop(0)
+
+        with pool:
+            shard_files = list(tqdm(pool.imap(_swap_shard, tasks), total=len(tasks), unit='shard'))
+
+        with FFmpegVideoWriter(save_file, fps, (reader.width, reader.height), audio=audio, watermark=watermark) as out:
+            for shard_file in shard_files:
+                if shard_file is None:
+                    continue
+                for frame in FFmpegVideoReader(shard_file):
+                    out.write(frame)
+                os.remove(shard_file)
 
-    def swap_video_thread(self, target_frames_path, source_face, target_face_fields, save_path: str, multiface=False, fps=30, video_format=".mp4"):
+        print("Face swap processing finished...")
+        return file_name
+
+    def swap_video_thread(self, target_video, source_face, target_face_fields, save_path: str, multiface=False, fps=30,
+                          video_format=".mp4", audio=None, watermark=None):
         """
         Face swap video with Threads. Will not work with CUDA
-        :param target_frames_path: directory containing target frames
+        :param target_video: path to target video
         :param source_face: source face
         :param target_face_fields: crop field for target face
         :param save_file: save file path
         :param multiface: bool use swap all face or use target crop
         :param fps: video fps
         :param video_format: video format
+        :param audio: path to audio which is added in the same encode, can be None
+        :param watermark: Watermark which is put in frames in the same encode, can be None
         :return:
         """
-        file_name = str(uuid.uuid4()) + '.mp4'
+        file_name = str(uuid.uuid4()) + video_format
         save_file = os.path.join(save_path, file_name)
-        frame_save_path = os.path.join(save_path, "faceswap_frames")
-        os.makedirs(frame_save_path, exist_ok=True)
-
-        # Get a list of all frame files in the target_frames_path directory
-        frame_files = sorted([os.path.join(target_frames_path, fname) for fname in os.listdir(target_frames_path) if fname.endswith('.jpg') or fname.endswith('.png')])
-
-        # Read the first frame to get the dimensions
-        first_frame = cv2.imread(frame_files[0])
-        frame_h, frame_w = first_frame.shape[:-1]
-
-        if video_format == '.mp4':
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        elif video_format == '.avi':
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        else:
-            raise ValueError("Unsupported video format: {}".format(video_format))
 
-        out = cv2.VideoWriter(save_file, fourcc, fps, (frame_w, frame_h))
-
-        # Adjust the way we get face detection results
-        if multiface:
-            print("Getting all face...")
-            face_det_results = self.face_detect_with_alignment_all(frame_files)
-        else:
-            print("Getting target face...")
-            face_det_results = self.face_detect_with_alignment_crop(frame_files, target_face_fields)
+        reader = FFmpegVideoReader(target_video)
+        face_det_results = self.detect_video_faces(reader, target_face_fields, multiface)
 
         print("Starting face swap...")
 
-        progress_bar = tqdm(total=len(frame_files), unit='it', unit_scale=True)
-
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            processed_frame_files = list(executor.map(self.process_frame, [
-                (cv2.imread(frame_files[i]), face_det_results[i], source_face, progress_bar, frame_save_path, i) for i
-                in range(len(frame_files))
-            ]))
+        progress_bar = tqdm(total=len(face_det_results), unit='it', unit_scale=True)
+        max_workers = 4
+        chunk_size = max_workers * 4  # limit frames which wait swap in memory
+
+        with FFmpegVideoWriter(save_file, fps, (reader.width, reader.height), audio=audio, watermark=watermark) as out:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                chunk = []
+                for frame, dets in zip(reader, face_det_results):
+                    chunk.append((frame, dets, source_face, progress_bar))
+                    if len(chunk) >= chunk_size:
+                        for tmp_frame in executor.map(self.process_frame, chunk):
+                            out.write(tmp_frame)
+                        chunk = []
+                for tmp_frame in executor.map(self.process_frame, chunk):
+                    out.write(tmp_frame)
 
         progress_bar.close()
-
-        processed_frame_files.sort()  # Ensure files are in the correct order
-
-        for frame_file in processed_frame_files:
-            frame = cv2.imread(frame_file)
-            out.write(frame)
-
-        out.release()
         print("Face swap processing finished...")
         return file_name
 
-    def swap_video_cuda(self, target_frames_path, source_face, target_face_fields, save_path: str, multiface=False, fps=30, video_format=".mp4"):
+    def swap_video_cuda(self, target_video, source_face, target_face_fields, save_path: str, multiface=False, fps=30,
+                        video_format=".mp4", audio=None, watermark=None):
         """Face swap video without Threads"""
-        file_name = str(uuid.uuid4()) + '.mp4'
+        file_name = str(uuid.uuid4()) + video_format
         save_file = os.path.join(save_path, file_name)
 
-        # Get a list of all frame files in the target_frames_path directory
-        frame_files = sorted([os.path.join(target_frames_path, fname) for fname in os.listdir(target_frames_path) if fname.endswith('.png')])
-        # Read the first frame to get the dimensions
-        first_frame = cv2.imread(frame_files[0])
-        frame_h, frame_w = first_frame.shape[:-1]
-
-        if video_format == '.mp4':
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        elif video_format == '.avi':
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        else:
-            raise ValueError("Unsupported video format: {}".format(video_format))
-
-        out = cv2.VideoWriter(save_file, fourcc, fps, (frame_w, frame_h))
-
-        # Adjust the way we get face detection results
-        if multiface:
-            print("Getting all face...")
-            face_det_results = self.face_detect_with_alignment_all(frame_files)
-        else:
-            print("Getting target face...")
-            face_det_results = self.face_detect_with_alignment_crop(frame_files, target_face_fields)
+        reader = FFmpegVideoReader(target_video)
+        face_det_results = self.detect_video_faces(reader, target_face_fields, multiface)
 
         print("Starting face swap...")
         progress_bar = tqdm(total=len(face_det_results), unit='it', unit_scale=True)
-        for i, dets in enumerate(face_det_results):
-            tmp_frame = cv2.imread(frame_files[i])
-            for face in dets:
-                if face is None:
-                    break
-                else:
-                    tmp_frame = self.face_swap_model.get(tmp_frame, face, source_face, paste_back=True)
-            out.write(tmp_frame)
-            progress_bar.update(1)
-        else:
-            out.release()
-            print("Face swap processing finished...")
+        with FFmpegVideoWriter(save_file, fps, (reader.width, reader.height), audio=audio, watermark=watermark) as out:
+            for tmp_frame, dets in zip(reader, face_det_results):
+                for face in dets:
+                    if face is None:
+                        break
+                    else:
+                        tmp_frame = self.face_swap_model.get(tmp_frame, face, source_face, paste_back=True)
+                out.write(tmp_frame)
+                progress_bar.update(1)
+        print("Face swap processing finished...")
         progress_bar.close()
 
         return file_name
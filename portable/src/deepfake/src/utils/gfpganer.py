@@ -149,3 +149,66 @@ class GFPGANer():
             return self.face_helper.cropped_faces, self.face_helper.restored_faces, restored_img
         else:
             return self.face_helper.cropped_faces, self.face_helper.restored_faces, None
+
+    @torch.no_grad()
+    def enhance_batch(self, imgs, only_center_face=False, weight=0.5, face_batch_size=8):
+        """
+        Enhance several frames, faces from all frames are restored together in batches
+        :param imgs: list of BGR frames
+        :param only_center_face: restore only center face
+        :param weight: weight of GFPGAN
+        :param face_batch_size: number of faces in one GFPGAN forward pass
+        :return: list of restored frames
+        """
+        # detect and align faces of each frame, keep state of face helper for paste back
+        states = []
+        cropped_faces = []
+        for img in imgs:
+            self.face_helper.clean_all()
+            self.face_helper.read_image(img)
+            self.face_helper.get_face_landmarks_5(only_center_face=only_center_face, eye_dist_threshold=5)
+            self.face_helper.align_warp_face()
+            states.append({
+                "input_img": self.face_helper.input_img,
+                "all_landmarks_5": list(self.face_helper.all_landmarks_5),
+                "det_faces": list(self.face_helper.det_faces),
+                "affine_matrices": list(self.face_helper.affine_matrices),
+                "cropped_faces": list(self.face_helper.cropped_faces),
+                "pad_input_imgs": list(self.face_helper.pad_input_imgs),
+            })
+            cropped_faces += self.face_helper.cropped_faces
+
+        # face restoration in batches
+        restored_faces = []
+        for i in range(0, len(cropped_faces), face_batch_size):
+            faces = cropped_faces[i:i + face_batch_size]
+            faces_t = []
+            for cropped_face in faces:
+                cropped_face_t = img2tensor(cropped_face / 255., bgr2rgb=True, float32=True)
+                normalize(cropped_face_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+                faces_t.append(cropped_face_t)
+            try:
+                output = self.gfpgan(torch.stack(faces_t).to(self.device), return_rgb=False, weight=weight)[0]
+                # convert to image
+                restored_faces += [tensor2img(out, rgb2bgr=True, min_max=(-1, 1)).astype('uint8') for out in output]
+            except RuntimeError as error:
+                print(f'\tFailed inference for GFPGAN: {error}.')
+                restored_faces += [face.astype('uint8') for face in faces]
+
+        # paste restored faces back to each frame
+        results = []
+        restored_faces = iter(restored_faces)
+        for img, state in zip(imgs, states):
+            self.face_helper.clean_all()
+            for key, value in state.items():
+                setattr(self.face_helper, key, value)
+            for _ in state["cropped_faces"]:
+                self.face_helper.add_restored_face(next(restored_faces))
+            if self.bg_upsampler is not None:
+                # Now only support RealESRGAN for upsampling background
+                bg_img = self.bg_upsampler.enhance(img, outscale=self.upscale)[0]
+            else:
+                bg_img = None
+            self.face_helper.get_inverse_affine(None)
+            results.append(self.face_helper.paste_faces_to_input_image(upsample_img=bg_img))
+        return results
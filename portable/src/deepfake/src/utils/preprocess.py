@@ -57,7 +57,9 @@ class CropAndExtract():
         self.device = device
         self.face_fields = face_fields
     
-    def generate(self, input_path, save_dir, crop_or_resize='crop', source_image_flag=False, pic_path_type="static"):
+    def generate(self, input_path, save_dir, crop_or_resize='crop', source_image_flag=False, pic_path_type="static", face_fields=None):
+        # face fields of request are passed here, because model is shared between requests
+        face_fields = face_fields if face_fields is not None else self.face_fields
 
         pic_size = 256
         pic_name = os.path.splitext(os.path.split(input_path)[-1])[0]  
@@ -89,7 +91,7 @@ class CropAndExtract():
 
         x_full_frames= [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  for frame in full_frames] 
 
-        x_full_frames, crop, quad = self.croper.crop(x_full_frames, still=True, xsize=512, face_fields=self.face_fields)
+        x_full_frames, crop, quad = self.croper.crop(x_full_frames, still=True, xsize=512, face_fields=face_fields)
         clx, cly, crx, cry = crop
         lx, ly, rx, ry = quad
         lx, ly, rx, ry = int(lx), int(ly), int(rx), int(ry)
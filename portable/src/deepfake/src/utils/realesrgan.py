@@ -24,6 +24,7 @@ class RealESRGANer():
         tile_pad (int): The pad size for each tile, to remove border artifacts. Default: 10.
         pre_pad (int): Pad the input images to avoid border artifacts. Default: 10.
         half (float): Whether to use half precision during inference. Default: False.
+        tile_batch (int): Number of tiles with the same size in one forward pass. Default: 4.
     """
 
     def __init__(self,
@@ -37,9 +38,11 @@ class RealESRGANer():
                  pre_pad=10,
                  half=False,
                  device=None,
-                 gpu_id=None):
+                 gpu_id=None,
+                 tile_batch=4):
         self.scale = scale
         self.tile_size = tile
+        self.tile_batch = tile_batch
         self.tile_pad = tile_pad
         self.pre_pad = pre_pad
         self.mod_scale = None
@@ -105,27 +108,7 @@ class RealESRGANer():
     def pre_process(self, img):
         """Pre-process, such as pre-pad and mod pad, so that the images can be divisible
         """
-        img = torch.from_numpy(np.transpose(img, (2, 0, 1))).float()
-        self.img = img.unsqueeze(0).to(self.device)
-        if self.half:
-            self.img = self.img.half()
-
-        # pre_pad
-        if self.pre_pad != 0:
-            self.img = F.pad(self.img, (0, self.pre_pad, 0, self.pre_pad), 'reflect')
-        # mod pad for divisible borders
-        if self.scale == 2:
-            self.mod_scale = 2
-        elif self.scale == 1:
-            self.mod_scale = 4
-        if self.mod_scale is not None:
-            self.mod_pad_h, self.mod_pad_w = 0, 0
-            _, _, h, w = self.img.size()
-            if (h % self.mod_scale != 0):
-                self.mod_pad_h = (self.mod_scale - h % self.mod_scale)
-            if (w % self.mod_scale != 0):
-                self.mod_pad_w = (self.mod_scale - w % self.mod_scale)
-            self.img = F.pad(self.img, (0, self.mod_pad_w, 0, self.mod_pad_h), 'reflect')
+        self.pre_process_batch(img[None])
 
     def process(self):
         # model inference
@@ -147,7 +130,8 @@ class RealESRGANer():
         tiles_x = math.ceil(width / self.tile_size)
         tiles_y = math.ceil(height / self.tile_size)
 
-        # loop over all tiles
+        # collect all tiles, tiles with the same size are upscaled in one forward pass
+        tiles = []
         for y in range(tiles_y):
             for x in range(tiles_x):
                 # extract tile from input image
@@ -165,36 +149,52 @@ class RealESRGANer():
                 input_start_y_pad = max(input_start_y - self.tile_pad, 0)
                 input_end_y_pad = min(input_end_y + self.tile_pad, height)
 
-                # input tile dimensions
-                input_tile_width = input_end_x - input_start_x
-                input_tile_height = input_end_y - input_start_y
-                tile_idx = y * tiles_x + x + 1
-                input_tile = self.img[:, :, input_start_y_pad:input_end_y_pad, input_start_x_pad:input_end_x_pad]
+                tiles.append({
+                    "input": (input_start_y_pad, input_end_y_pad, input_start_x_pad, input_end_x_pad),
+                    "area": (input_start_y, input_end_y, input_start_x, input_end_x),
+                })
+
+        groups = {}
+        for tile in tiles:
+            y1, y2, x1, x2 = tile["input"]
+            groups.setdefault((y2 - y1, x2 - x1), []).append(tile)
 
-                # upscale tile
+        for group in groups.values():
+            for i in range(0, len(group), self.tile_batch):
+                group_tiles = group[i:i + self.tile_batch]
+                input_tiles = torch.cat([
+                    self.img[:, :, y1:y2, x1:x2] for y1, y2, x1, x2 in (tile["input"] for tile in group_tiles)
+                ], dim=0)
+
+                # upscale tiles
                 try:
                     with torch.no_grad():
-                        output_tile = self.model(input_tile)
+                        output_tiles = self.model(input_tiles)
                 except RuntimeError as error:
                     print('Error', error)
-                print(f'\tTile {tile_idx}/{tiles_x * tiles_y}')
-
-                # output tile area on total image
-                output_start_x = input_start_x * self.scale
-                output_end_x = input_end_x * self.scale
-                output_start_y = input_start_y * self.scale
-                output_end_y = input_end_y * self.scale
-
-                # output tile area without padding
-                output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
-                output_end_x_tile = output_start_x_tile + input_tile_width * self.scale
-                output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
-                output_end_y_tile = output_start_y_tile + input_tile_height * self.scale
-
-                # put tile into output image
-                self.output[:, :, output_start_y:output_end_y,
-                            output_start_x:output_end_x] = output_tile[:, :, output_start_y_tile:output_end_y_tile,
-                                                                       output_start_x_tile:output_end_x_tile]
+                    raise
+
+                for j, tile in enumerate(group_tiles):
+                    output_tile = output_tiles[j * batch:(j + 1) * batch]
+                    input_start_y_pad, _, input_start_x_pad, _ = tile["input"]
+                    input_start_y, input_end_y, input_start_x, input_end_x = tile["area"]
+
+                    # output tile area on total image
+                    output_start_x = input_start_x * self.scale
+                    output_end_x = input_end_x * self.scale
+                    output_start_y = input_start_y * self.scale
+                    output_end_y = input_end_y * self.scale
+
+                    # output tile area without padding
+                    output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
+                    output_end_x_tile = output_start_x_tile + (input_end_x - input_start_x) * self.scale
+                    output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
+                    output_end_y_tile = output_start_y_tile + (input_end_y - input_start_y) * self.scale
+
+                    # put tile into output image
+                    self.output[:, :, output_start_y:output_end_y,
+                                output_start_x:output_end_x] = output_tile[:, :, output_start_y_tile:output_end_y_tile,
+                                                                           output_start_x_tile:output_end_x_tile]
 
     def post_process(self):
         # remove extra pad
@@ -280,6 +280,58 @@ class RealESRGANer():
         return output, img_mode
 
 
+    @torch.no_grad()
+    def enhance_batch(self, imgs, outscale=None):
+        """
+        Enhance several BGR 8-bit frames with the same size in one pass, each tile of all frames is one forward
+        :param imgs: list of frames
+        :param outscale: final scale
+        :return: list of enhanced frames
+        """
+        h_input, w_input = imgs[0].shape[0:2]
+        batch = np.stack([cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in imgs]).astype(np.float32) / 255
+        self.pre_process_batch(batch)
+        if self.tile_size > 0:
+            self.tile_process()
+        else:
+            self.process()
+        output_batch = self.post_process()
+        output_batch = output_batch.data.float().cpu().clamp_(0, 1).numpy()
+        output_batch = np.transpose(output_batch[:, [2, 1, 0], :, :], (0, 2, 3, 1))
+        output_batch = (output_batch * 255.0).round().astype(np.uint8)
+
+        outputs = []
+        for output in output_batch:
+            if outscale is not None and outscale != float(self.scale):
+                output = cv2.resize(output, (int(w_input * outscale), int(h_input * outscale)), interpolation=cv2.INTER_LANCZOS4)
+            outputs.append(output)
+        return outputs
+
+    def pre_process_batch(self, imgs):
+        """Pre-process batch of RGB float images (B, H, W, C) the same as pre_process"""
+        img = torch.from_numpy(np.transpose(imgs, (0, 3, 1, 2))).float()
+        self.img = img.to(self.device)
+        if self.half:
+            self.img = self.img.half()
+
+        # pre_pad
+        if self.pre_pad != 0:
+            self.img = F.pad(self.img, (0, self.pre_pad, 0, self.pre_pad), 'reflect')
+        # mod pad for divisible borders
+        if self.scale == 2:
+            self.mod_scale = 2
+        elif self.scale == 1:
+            self.mod_scale = 4
+        if self.mod_scale is not None:
+            self.mod_pad_h, self.mod_pad_w = 0, 0
+            _, _, h, w = self.img.size()
+            if (h % self.mod_scale != 0):
+                self.mod_pad_h = (self.mod_scale - h % self.mod_scale)
+            if (w % self.mod_scale != 0):
+                self.mod_pad_w = (self.mod_scale - w % self.mod_scale)
+            self.img = F.pad(self.img, (0, self.mod_pad_w, 0, self.mod_pad_h), 'reflect')
+
+
 class PrefetchReader(threading.Thread):
     """Prefetch images.
 
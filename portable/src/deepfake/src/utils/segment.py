@@ -2,6 +2,7 @@ import os
 import sys
 import cv2
 import random
+import torch
 import numpy as np
 import onnxruntime
 from PIL import Image
@@ -22,6 +23,7 @@ class SegmentAnything:
         self.lower_limit_area = 1 - segment_percentage  # 25% lower
         self.upper_limit_area = 1 + segment_percentage  # 25% upper
         self.generate_num_positive_points = 4
+        self.batch_decoder = None  # onnx decoder supports batch of objects, None if not checked yet
 
     def load_models(self, predictor, session):
         self.predictor = predictor
@@ -44,18 +46,44 @@ class SegmentAnything:
 
     @staticmethod
     def get_embedding(predictor, img: np.ndarray):
-        predictor.set_image(img)
-        return predictor.get_image_embedding().cpu().numpy()
+        # predictor.set_image keeps image in shared predictor, embedding is computed without state of predictor
+        return SegmentAnything.get_embeddings(predictor, [img])[0]
+
+    @staticmethod
+    def get_embeddings(predictor, frames: list) -> list:
+        """
+        Compute image embeddings for window of frames in one image encoder pass
+        :param predictor: SamPredictor
+        :param frames: list of frames with the same size
+        :return: list of embeddings with shape (1, 256, 64, 64)
+        """
+        if len(frames) == 0:
+            return []
+        input_images = []
+        for frame in frames:
+            input_image = predictor.transform.apply_image(frame)
+            input_images.append(torch.as_tensor(input_image, device=predictor.device).permute(2, 0, 1).contiguous())
+        with torch.no_grad():
+            input_images = predictor.model.preprocess(torch.stack(input_images))
+            embeddings = predictor.model.image_encoder(input_images).cpu().numpy()
+        return [embeddings[i:i + 1] for i in range(len(frames))]
 
     @staticmethod
     def read_image(img_path: str):
         image = cv2.imread(img_path)
         return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-
     @staticmethod
-    def draw_mask(predictor, session, point_list, frame, box=None):
-        originalHeight, originalWidth, _ = frame.shape
+    def get_prompt(predictor, point_list, frame_shape, box=None):
+        """
+        Convert points from canvas and box to onnx decoder prompt
+        :param predictor: SamPredictor, used to transform coords
+        :param point_list: points from frontend
+        :param frame_shape: shape of frame
+        :param box: box of object [x1, y1, x2, y2] or None
+        :return: onnx coords and labels
+        """
+        originalHeight, originalWidth = frame_shape[:2]
 
         input_point = []
         input_label = []
@@ -96,41 +124,100 @@ class SegmentAnything:
             onnx_coord = np.concatenate([input_point, np.array([[0.0, 0.0]])], axis=0)[None, :, :]
             onnx_label = np.concatenate([input_label, np.array([-1])], axis=0)[None, :].astype(np.float32)
 
-        onnx_coord = predictor.transform.apply_coords(onnx_coord, frame.shape[:2]).astype(np.float32)
-
-        predictor.set_image(frame)
-        frame_embedding = predictor.get_image_embedding().cpu().numpy()
-
-        onnx_mask_input = np.zeros((1, 1, 256, 256), dtype=np.float32)
-        onnx_has_mask_input = np.zeros(1, dtype=np.float32)
+        onnx_coord = predictor.transform.apply_coords(onnx_coord, frame_shape[:2]).astype(np.float32)
+        return onnx_coord, onnx_label
 
+    @staticmethod
+    def run_decoder(predictor, session, embedding, onnx_coord, onnx_label, frame_shape):
+        """
+        Run onnx mask decoder
+        :param predictor: SamPredictor, used for mask threshold
+        :param session: onnx session
+        :param embedding: image embedding of frame
+        :param onnx_coord: coords with shape (B, N, 2)
+        :param onnx_label: labels with shape (B, N)
+        :param frame_shape: shape of frame
+        :return: masks with shape (B, 1, H, W)
+        """
         ort_inputs = {
-            "image_embeddings": frame_embedding,
+            "image_embeddings": embedding,
             "point_coords": onnx_coord,
             "point_labels": onnx_label,
-            "mask_input": onnx_mask_input,
-            "has_mask_input": onnx_has_mask_input,
-            "orig_im_size": np.array(frame.shape[:2], dtype=np.float32)
+            "mask_input": np.zeros((len(onnx_coord), 1, 256, 256), dtype=np.float32),
+            "has_mask_input": np.zeros(len(onnx_coord), dtype=np.float32),
+            "orig_im_size": np.array(frame_shape[:2], dtype=np.float32)
         }
-
         masks, _, _ = session.run(None, ort_inputs)
-        masks = masks > predictor.model.mask_threshold
-        # TODO if it will be very slow, I can optimize by keeping low_res_logits in self for each frame to nor repeat load
-        return masks
+        return masks > predictor.model.mask_threshold
+
+    def decode_masks(self, prompts: list, embedding, frame_shape) -> list:
+        """
+        Decode masks for several objects on the same frame. Objects are decoded in one call if onnx model
+        was exported with dynamic batch, else one by one
+        :param prompts: list of (onnx_coord, onnx_label)
+        :param embedding: image embedding of frame
+        :param frame_shape: shape of frame
+        :return: list of masks with shape (1, 1, H, W)
+        """
+        if len(prompts) > 1 and self.batch_decoder is not False:
+            # pad points of objects by not a point with label -1
+            max_points = max(coord.shape[1] for coord, _ in prompts)
+            onnx_coord = np.zeros((len(prompts), max_points, 2), dtype=np.float32)
+            onnx_label = -np.ones((len(prompts), max_points), dtype=np.float32)
+            for i, (coord, label) in enumerate(prompts):
+                onnx_coord[i, :coord.shape[1]] = coord[0]
+                onnx_label[i, :label.shape[1]] = label[0]
+            try:
+                masks = self.run_decoder(self.predictor, self.session, embedding, onnx_coord, onnx_label, frame_shape)
+                self.batch_decoder = True
+                return [masks[i:i + 1] for i in range(len(prompts))]
+            except Exception as err:
+                print(f"Onnx decoder does not support batch of objects, decode one by one: {err}")
+                self.batch_decoder = False
+        return [self.run_decoder(self.predictor, self.session, embedding, coord, label, frame_shape) for coord, label in prompts]
+
+    @staticmethod
+    def draw_mask(predictor, session, point_list, frame, box=None, embedding=None):
+        onnx_coord, onnx_label = SegmentAnything.get_prompt(predictor, point_list, frame.shape, box)
+        if embedding is None:
+            embedding = SegmentAnything.get_embedding(predictor, frame)
+        return SegmentAnything.run_decoder(predictor, session, embedding, onnx_coord, onnx_label, frame.shape)
+
+    def get_obj_prompt(self, frame_shape, point_list=None):
+        """
+        Prompt of object for decoder
+        :param frame_shape: shape of frame
+        :param point_list: points if this is first frame of object, else points and box of tracked object are used
+        :return: onnx coords and labels
+        """
+        if point_list is not None:
+            return self.get_prompt(self.predictor, point_list, frame_shape)
+        return self.get_prompt(self.predictor, self.draw_obj["point_list"], frame_shape, self.draw_obj["box"])
 
-    def draw_mask_frames(self, frame):
+    def draw_mask_frames(self, frame, embedding=None):
         """
         Predict mask and move draw_obj for objid
         :param frame: frame
+        :param embedding: image embedding of frame if already computed
         :return: list mask in format false true
         """
-        originalHeight, originalWidth, _ = frame.shape
+        point_list = self.draw_obj["point_list"]
+        prev_box = self.draw_obj["box"]
+        mask = self.draw_mask(predictor=self.predictor, session=self.session, point_list=point_list, frame=frame, box=prev_box, embedding=embedding)
+        return self.update_obj(mask, frame.shape)
+
+    def update_obj(self, mask, frame_shape):
+        """
+        Move draw_obj by new mask of object
+        :param mask: predicted mask
+        :param frame_shape: shape of frame
+        :return: mask or None if object lost
+        """
+        originalHeight, originalWidth = frame_shape[:2]
         point_list = self.draw_obj["point_list"]
         cX_prev = self.draw_obj["cX"]
         cY_prev = self.draw_obj["cY"]
         prev_area = self.draw_obj["area"]
-        prev_box = self.draw_obj["box"]
-        mask = self.draw_mask(predictor=self.predictor, session=self.session, point_list=point_list, frame=frame, box=prev_box)
         centroid = self.compute_centroid(mask)
         if centroid is None:
             cX = cX_prev
@@ -218,8 +305,17 @@ class SegmentAnything:
                 max_bbox = [x, y, x + w, y + h]
         return np.array(max_bbox)
 
-    def set_obj(self, point_list, frame):
-        mask = self.draw_mask(predictor=self.predictor, session=self.session, point_list=point_list, frame=frame)
+    def set_obj(self, point_list, frame, embedding=None):
+        mask = self.draw_mask(predictor=self.predictor, session=self.session, point_list=point_list, frame=frame, embedding=embedding)
+        return self.init_obj(point_list, mask)
+
+    def init_obj(self, point_list, mask):
+        """
+        Set draw_obj by first mask of object
+        :param point_list: points from frontend
+        :param mask: predicted mask
+        :return: mask
+        """
         centroid = self.compute_centroid(mask)
         if centroid is None:
             cX = 0
@@ -10,6 +10,7 @@ root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, os.path.join(root_path, "deepfake"))
 from src.video2fake import Wav2Lip, Emo2Lip
 from src.face3d.recognition import FaceRecognition
+from src.utils.videoio import BackgroundVideoWriter
 sys.path.pop(0)
 
 
@@ -19,6 +20,20 @@ class GenerateFakeVideo2Lip:
         self.face_fields = None
         self.emotion, self.use_emotion = (self.to_emotion_categorical(emotion_label), True) if emotion_label else (None, False)
         self.similar_coeff = 0.95  # Similarity coefficient for face
+        self.model = None  # loaded Wav2Lip model keep between requests
+        self.model_key = None
+
+    def set_params(self, face_fields=None, emotion_label=None, similar_coeff=0.95):
+        """
+        Set params of request, because object can be reused between requests
+        :param face_fields: user crop face in frontend
+        :param emotion_label: emotion label or None
+        :param similar_coeff: similarity coefficient for face
+        :return: None
+        """
+        self.face_fields = face_fields
+        self.emotion, self.use_emotion = (self.to_emotion_categorical(emotion_label), True) if emotion_label else (None, False)
+        self.similar_coeff = similar_coeff
 
     def get_smoothened_boxes(self, boxes: np.ndarray, T: int = 5):
         """
@@ -67,13 +82,24 @@ class GenerateFakeVideo2Lip:
             return int(center_x), int(center_y)
         return None, None
 
-    def face_detect_with_alignment(self, images, pads, nosmooth):
+    def face_detect_boxes(self, images, pads, nosmooth):
+        """
+        Detect face boxes, images can be list or generator of frames, only boxes are kept in memory
+        :param images: frames
+        :param pads: padding for the face bounding box
+        :param nosmooth: whether to apply a smoothing function to detected bounding boxes
+        :return: array of boxes [x1, y1, x2, y2]
+        """
         predictions = []
+        shapes = []
         face_embedding_list = []
         face_gender = None
-        x_center, y_center = self.get_real_crop_box(images[0])
+        x_center, y_center = None, None
 
-        for image in tqdm(images):
+        for i, image in enumerate(tqdm(images)):
+            if i == 0:
+                x_center, y_center = self.get_real_crop_box(image)
+            shapes.append(image.shape)
             dets = self.face_recognition.get_faces(image)
             if not dets:
                 predictions.append(None)
@@ -132,20 +158,23 @@ class GenerateFakeVideo2Lip:
         smooth_windows_size = 5
         results = []
         pady1, pady2, padx1, padx2 = pads
-        for rect, image in zip(predictions, images):
+        for rect, shape in zip(predictions, shapes):
             if rect is None:
                 results.append([0, 0, 1, 1])
             else:
                 y1 = max(0, rect[1] - pady1)
-                y2 = min(image.shape[0], rect[3] + pady2)
+                y2 = min(shape[0], rect[3] + pady2)
                 x1 = max(0, rect[0] - padx1)
-                x2 = min(image.shape[1], rect[2] + padx2)
+                x2 = min(shape[1], rect[2] + padx2)
                 results.append([x1, y1, x2, y2])
 
         boxes = np.array(results)
         if not nosmooth:
             boxes = self.get_smoothened_boxes(boxes, T=smooth_windows_size)
+        return boxes
 
+    def face_detect_with_alignment(self, images, pads, nosmooth):
+        boxes = self.face_detect_boxes(images, pads, nosmooth)
         results = [[image[int(y1): int(y2), int(x1):int(x2)], (int(y1), int(y2), int(x1), int(x2))] for image, (x1, y1, x2, y2) in zip(images, boxes)]
         return results
 
@@ -191,26 +220,110 @@ class GenerateFakeVideo2Lip:
             coords_batch.append(coords)
 
             if len(img_batch) >= wav2lip_batch_size:
-                img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
-
-                img_masked = img_batch.copy()
-                img_masked[:, img_size // 2:] = 0
-
-                img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
-                mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
-
+                img_batch, mel_batch = self.prepare_batch(img_batch, mel_batch, img_size)
                 yield img_batch, mel_batch, frame_batch, coords_batch
                 img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
 
         if len(img_batch) > 0:
-            img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+            img_batch, mel_batch = self.prepare_batch(img_batch, mel_batch, img_size)
+            yield img_batch, mel_batch, frame_batch, coords_batch
+
+    @staticmethod
+    def prepare_batch(img_batch: list, mel_batch: list, img_size: int):
+        """
+        Prepare batch of faces and mels for Wav2Lip model
+        :param img_batch: list of resized faces
+        :param mel_batch: list of mel spectrogram chunks
+        :param img_size: size of face
+        :return: batch of masked and reference faces, batch of mels
+        """
+        img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+
+        img_masked = img_batch.copy()
+        img_masked[:, img_size // 2:] = 0
 
-            img_masked = img_batch.copy()
-            img_masked[:, img_size // 2:] = 0
+        img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
+        mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
+        return img_batch, mel_batch
 
-            img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
-            mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
+    def datagen_stream(self, read_frames, mels: list, box: list, static: bool, img_size: int, wav2lip_batch_size: int,
+                       pads: list = [0, 10, 0, 0], nosmooth: bool = False):
+        """
+        Generator the same as datagen, but frames are not kept in memory. Video is read twice: first time only face
+        boxes are detected and kept, second time frames are cropped by boxes and batched. If audio longer than video,
+        video is read again from start.
+        :param read_frames: function with argument max_frames which returns new generator of frames from start of video
+        :param mels: List of mel spectrogram chunks corresponding to each frame.
+        :param box: A bounding box [y1, y2, x1, x2] or [-1] for automatic face detection.
+        :param static: Whether to use only the first frame for all mels.
+        :param img_size: The target size to which detected faces will be resized.
+        :param wav2lip_batch_size: Batch size for the Wav2Lip model.
+        :param pads: Padding for the face bounding box.
+        :param nosmooth: Whether to apply a smoothing function to detected bounding boxes.
+        :yield: Batches of processed images, mel spectrograms, original frames, and face coordinates.
+        """
+        num_frames = 1 if static else len(mels)
 
+        if box[0] == -1:
+            boxes = self.face_detect_boxes(read_frames(num_frames), pads, nosmooth)
+            coords_list = [(int(y1), int(y2), int(x1), int(x2)) for (x1, y1, x2, y2) in boxes]
+        else:
+            print('Using the specified bounding box instead of face detection...')
+            coords_list = None
+
+        def close_reader(reader):
+            # reader is BackgroundIterator, its thread waits for consumer until it is closed
+            if hasattr(reader, "close"):
+                reader.close()
+
+        def cycle_frames():
+            if static:
+                reader = read_frames(1)
+                try:
+                    first_frame = next(iter(reader))
+                finally:
+                    close_reader(reader)
+                while True:
+                    yield first_frame.copy()
+            while True:
+                is_empty = True
+                reader = read_frames(num_frames)
+                try:
+                    for frame in reader:
+                        is_empty = False
+                        yield frame
+                finally:
+                    close_reader(reader)
+                if is_empty:
+                    return
+
+        img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+
+        frames = cycle_frames()
+        try:
+            for i, (m, frame) in enumerate(zip(mels, frames)):
+                if coords_list is not None:
+                    coords = coords_list[0 if static else i % len(coords_list)]
+                else:
+                    coords = tuple(box)
+                y1, y2, x1, x2 = coords
+                face = cv2.resize(frame[y1: y2, x1:x2], (img_size, img_size))
+
+                img_batch.append(face)
+                mel_batch.append(m)
+                frame_batch.append(frame)
+                coords_batch.append(coords)
+
+                if len(img_batch) >= wav2lip_batch_size:
+                    img_batch, mel_batch = self.prepare_batch(img_batch, mel_batch, img_size)
+                    yield img_batch, mel_batch, frame_batch, coords_batch
+                    img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+        finally:
+            # mels can end before frames, reader of frames is stopped here and not left waiting
+            frames.close()
+
+        if len(img_batch) > 0:
+            img_batch, mel_batch = self.prepare_batch(img_batch, mel_batch, img_size)
             yield img_batch, mel_batch, frame_batch, coords_batch
 
     def _load(self, checkpoint_path, device):
@@ -223,7 +336,10 @@ class GenerateFakeVideo2Lip:
 
 
     def load_model(self, path, device):
-        """Load model Wav2Lip"""
+        """Load model Wav2Lip or return already loaded"""
+        model_key = (path, device, self.use_emotion)
+        if self.model is not None and self.model_key == model_key:
+            return self.model
         wav2lip = Emo2Lip() if self.use_emotion else Wav2Lip()
         print("Load checkpoint from: {}".format(path))
         checkpoint = self._load(path, device)
@@ -233,7 +349,8 @@ class GenerateFakeVideo2Lip:
             new_s[k.replace('module.', '')] = v
         wav2lip.load_state_dict(new_s)
         model = wav2lip.to(device)
-        return model.eval()
+        self.model, self.model_key = model.eval(), model_key
+        return self.model
 
 
     def generate_video_from_chunks(self, gen, mel_chunks, batch_size, wav2lip_checkpoint, device, save_dir, fps=30,
@@ -274,7 +391,8 @@ class GenerateFakeVideo2Lip:
                     raise ValueError("Unsupported video format: {}".format(video_format))
 
                 video_path = os.path.join(save_dir, video_name_without_format + video_format)
-                out = cv2.VideoWriter(video_path, fourcc, fps, (frame_w, frame_h))
+                # frames are encoded in background thread while next batch is predicted
+                out = BackgroundVideoWriter(video_path, fourcc, fps, (frame_w, frame_h))
 
             # Prepare the batches for the model
             img_batch = torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(device)
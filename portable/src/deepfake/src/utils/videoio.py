@@ -1,6 +1,9 @@
 import shutil
 import uuid
 import time
+import queue
+import threading
+import subprocess
 
 import os
 
@@ -154,50 +157,355 @@ def get_first_frame(file_path, source_current_time: float = 0):
     return None
 
 
-def get_frames(video: str, rotate: int, crop: list, resize_factor: int):
+def process_frame(frame, rotate: int, crop: list, resize_factor: int):
     """
-    Extract frames from a video, apply resizing, rotation, and cropping.
+    Apply resizing, rotation, and cropping to one frame.
 
-    :param video: path to the video file
+    :param frame: frame from video
     :param rotate: number of 90-degree rotations
     :param crop: list with cropping coordinates [y1, y2, x1, x2]
     :param resize_factor: factor by which the frame should be resized
-    :return: list of processed frames, fps of the video
+    :return: processed frame
     """
-    print("Start reading video")
+    if resize_factor > 1:
+        frame = cv2.resize(frame, (int(frame.shape[1] // resize_factor), int(frame.shape[0] // resize_factor)))
+
+    for _ in range(rotate):
+        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+
+    y1, y2, x1, x2 = crop
+    x2 = x2 if x2 != -1 else frame.shape[1]
+    y2 = y2 if y2 != -1 else frame.shape[0]
+
+    return frame[y1:y2, x1:x2]
+
 
+def get_video_fps(video: str) -> float:
+    """
+    Get fps of the video without reading frames.
+
+    :param video: path to the video file
+    :return: fps of the video
+    """
     video_stream = cv2.VideoCapture(video)
     fps = video_stream.get(cv2.CAP_PROP_FPS)
-    full_frames = []
+    video_stream.release()
+    return fps
+
+
+def iter_frames(video: str, rotate: int, crop: list, resize_factor: int, max_frames: int = None):
+    """
+    Generator of frames from a video, apply resizing, rotation, and cropping.
+    Only one decoded frame is kept in memory.
+
+    :param video: path to the video file
+    :param rotate: number of 90-degree rotations
+    :param crop: list with cropping coordinates [y1, y2, x1, x2]
+    :param resize_factor: factor by which the frame should be resized
+    :param max_frames: stop after this number of frames, None is all frames
+    :yield: processed frame
+    """
+    video_stream = cv2.VideoCapture(video)
+    num_frames = 0
 
     try:
-        while True:
+        while max_frames is None or num_frames < max_frames:
             still_reading, frame = video_stream.read()
 
             if not still_reading:
                 break
 
-            if resize_factor > 1:
-                frame = cv2.resize(frame, (int(frame.shape[1] // resize_factor), int(frame.shape[0] // resize_factor)))
+            num_frames += 1
+            yield process_frame(frame, rotate, crop, resize_factor)
 
-            for _ in range(rotate):
-                frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+    finally:
+        video_stream.release()
 
-            y1, y2, x1, x2 = crop
-            x2 = x2 if x2 != -1 else frame.shape[1]
-            y2 = y2 if y2 != -1 else frame.shape[0]
 
-            frame = frame[y1:y2, x1:x2]
-            full_frames.append(frame)
+def get_frames(video: str, rotate: int, crop: list, resize_factor: int):
+    """
+    Extract frames from a video, apply resizing, rotation, and cropping.
 
-    finally:
-        video_stream.release()
+    :param video: path to the video file
+    :param rotate: number of 90-degree rotations
+    :param crop: list with cropping coordinates [y1, y2, x1, x2]
+    :param resize_factor: factor by which the frame should be resized
+    :return: list of processed frames, fps of the video
+    """
+    print("Start reading video")
+
+    fps = get_video_fps(video)
+    full_frames = list(iter_frames(video, rotate, crop, resize_factor))
 
     print(f"Number of frames available for inference: {len(full_frames)}")
 
     return full_frames, fps
 
 
+class BackgroundIterator(threading.Thread):
+    """
+    Run iterator in background thread and pass items through fixed-size queue,
+    so producer can not be ahead of consumer more than max_size items
+    """
+    _end = object()
+
+    def __init__(self, iterable, max_size: int = 8):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue(max_size)
+        self.iterable = iterable
+        self.error = None
+        self.stopped = threading.Event()
+        self.start()
+
+    def run(self):
+        try:
+            for item in self.iterable:
+                if not self._put(item):
+                    return
+        except Exception as err:
+            self.error = err
+        self._put(self._end)
+
+    def _put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.queue.get()
+        if item is self._end:
+            if self.error is not None:
+                raise self.error
+            raise StopIteration
+        return item
+
+    def close(self):
+        """Stop producer if consumer does not need items anymore"""
+        self.stopped.set()
+
+
+class BackgroundVideoWriter(threading.Thread):
+    """
+    cv2.VideoWriter which encodes frames in background thread, frames are passed through fixed-size queue.
+    Other writer with write and release methods can be passed as writer
+    """
+    _end = object()
+
+    def __init__(self, video_path: str = None, fourcc=None, fps: float = None, size: tuple = None, max_size: int = 32, writer=None):
+        super().__init__(daemon=True)
+        self.writer = writer if writer is not None else cv2.VideoWriter(video_path, fourcc, fps, size)
+        self.queue = queue.Queue(max_size)
+        self.error = None
+        self.start()
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is self._end:
+                break
+            if self.error is None:
+                try:
+                    self.writer.write(frame)
+                except Exception as err:
+                    self.error = err
+        self.writer.release()
+
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+
+    def release(self):
+        self.queue.put(self._end)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+# Codec for ffmpeg pipe writer, can be hardware encoder as h264_nvenc, h264_qsv, h264_amf, h264_videotoolbox
+FFMPEG_CODEC_ENV = "WUNJO_FFMPEG_CODEC"
+FFMPEG_DEFAULT_CODEC = "libx264"
+
+
+def get_ffmpeg_codec_args(codec: str = None, quality: int = 23, preset: str = None, lossless: bool = False) -> list:
+    """
+    Get ffmpeg arguments for codec, quality is set by option which the codec understands.
+
+    :param codec: name of ffmpeg codec, if None read from env or use libx264
+    :param quality: quality in crf scale, less is better
+    :param preset: preset of encoder, if None default for codec
+    :param lossless: lossless rgb encoding, used if frames have to keep every bit as watermark
+    :return: list of arguments
+    """
+    if lossless:
+        return ["-c:v", "libx264rgb", "-crf", "0", "-preset", preset or "ultrafast"]
+
+    codec = codec or os.environ.get(FFMPEG_CODEC_ENV, FFMPEG_DEFAULT_CODEC)
+    args = ["-c:v", codec]
+    if codec in ("libx264", "libx265"):
+        args += ["-crf", str(quality), "-preset", preset or "medium"]
+    elif codec.endswith("_nvenc"):
+        args += ["-rc", "vbr", "-cq", str(quality), "-preset", preset or "p4"]
+    elif codec.endswith("_qsv"):
+        args += ["-global_quality", str(quality)]
+        if preset:
+            args += ["-preset", preset]
+    elif codec.endswith("_amf"):
+        args += ["-rc", "cqp", "-qp_i", str(quality), "-qp_p", str(quality)]
+    elif codec.endswith("_videotoolbox"):
+        args += ["-q:v", str(max(1, 100 - quality * 2))]
+    return args + ["-pix_fmt", "yuv420p"]
+
+
+class FFmpegVideoReader:
+    """
+    Read raw BGR frames from ffmpeg over stdout pipe, frames are not saved on disk
+    """
+    def __init__(self, video_path: str, max_frames: int = None, start_frame: int = 0):
+        """
+        Initialization
+        :param video_path: path to video
+        :param max_frames: stop after this number of frames, None is all frames
+        :param start_frame: index of first frame to read
+        """
+        cap = cv2.VideoCapture(video_path)
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        self.frame_count = max(0, self.frame_count - start_frame)
+        if max_frames is not None:
+            self.frame_count = min(self.frame_count, max_frames)
+        self.video_path = video_path
+        self.max_frames = max_frames
+        self.start_frame = start_frame
+        self.process = None
+
+    def __len__(self):
+        return self.frame_count
+
+    def __iter__(self):
+        cmd = [
+            "ffmpeg", "-loglevel", "error", "-i", self.video_path,
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{self.width}x{self.height}", "-"
+        ]
+        if self.start_frame > 0 and self.fps > 0:
+            # input seek jumps to keyframe before start and decodes only from there, output is accurate from start
+            cmd[3:3] = ["-ss", f"{self.start_frame / self.fps:.6f}"]
+        elif self.start_frame > 0:
+            # fps is unknown, frames before start are decoded but not piped
+            cmd[-1:-1] = ["-vf", f"select=gte(n\\,{self.start_frame})", "-vsync", "0"]
+        if self.max_frames is not None:
+            cmd[-1:-1] = ["-frames:v", str(self.max_frames)]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, bufsize=10 ** 7)
+        frame_size = self.width * self.height * 3
+        try:
+            while True:
+                buffer = bytearray(frame_size)
+                if self.process.stdout.readinto(buffer) < frame_size:
+                    break
+                yield np.frombuffer(buffer, dtype=np.uint8).reshape((self.height, self.width, 3))
+        finally:
+            self.close()
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdout.close()
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FFmpegVideoWriter:
+    """
+    Write raw BGR frames to ffmpeg over stdin pipe, frames are encoded without saving on disk
+    """
+    def __init__(self, video_path: str, fps: float, size: tuple, codec: str = None, quality: int = 23,
+                 preset: str = None, lossless: bool = False, audio: str = None, watermark=None, batch_size: int = 16):
+        """
+        Initialization
+        :param video_path: path to save video
+        :param fps: fps of video
+        :param size: (width, height) of frames
+        :param codec: ffmpeg codec, if None read from env or use libx264
+        :param quality: quality in crf scale
+        :param preset: encoder preset
+        :param lossless: lossless rgb encoding
+        :param audio: path to audio which will be added to video, can be None
+        :param watermark: Watermark which is put in frames before encode, can be None
+        :param batch_size: number of frames which get watermark at once
+        """
+        self.watermark = watermark
+        self.batch_size = batch_size
+        self.batch = []
+        width, height = size
+        self.size = (int(width), int(height))
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{self.size[0]}x{self.size[1]}", "-r", str(fps), "-i", "-"
+        ]
+        if audio is not None and os.path.exists(audio):
+            cmd += ["-i", audio, "-map", "0:v:0", "-map", "1:a:0?", "-c:a", "aac", "-shortest"]
+        if not lossless:
+            # yuv420p needs even size
+            cmd += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+        cmd += get_ffmpeg_codec_args(codec, quality, preset, lossless)
+        if video_path.endswith((".mp4", ".mov")):
+            cmd += ["-movflags", "+faststart"]
+        cmd += [video_path]
+        self.video_path = video_path
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, bufsize=10 ** 7)
+
+    def write(self, frame):
+        if frame.shape[1] != self.size[0] or frame.shape[0] != self.size[1]:
+            frame = cv2.resize(frame, self.size)
+        if self.watermark is None:
+            self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+            return
+        self.batch.append(frame)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Put watermark in collected frames and write them"""
+        if not self.batch:
+            return
+        batch = self.watermark.apply(self.batch)
+        self.batch = []
+        self.process.stdin.write(np.ascontiguousarray(batch).tobytes())
+
+    def release(self):
+        if self.process is None:
+            return
+        self.flush()
+        self.process.stdin.close()
+        return_code = self.process.wait()
+        self.process = None
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg finished with code {return_code} for {self.video_path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
 def save_frames(video: str, output_dir: str, rotate: int, crop: list, resize_factor: int):
     """
     Extract frames from a video, apply resizing, rotation, and cropping, and save them to an output directory.
@@ -252,153 +560,55 @@ def save_frames(video: str, output_dir: str, rotate: int, crop: list, resize_fac
 
 
 
-def encrypted(video_path: str, save_dir: str, fn: int = 0):
-
-    name = str(os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
-    media_type = check_media_type(video_path)
-
-    if media_type == "animated":
-        # Video objects for src
-        src = cv2.VideoCapture(video_path)
-        src_w = int(src.get(3))
-        src_h = int(src.get(4))
-        src_fps = src.get(cv2.CAP_PROP_FPS)
-        src_frame_cnt = src.get(cv2.CAP_PROP_FRAME_COUNT)
-
-        # Load a dummy image to get the shape attributes
-        sec_frame_original = np.zeros((src_h, src_w, 3), dtype=np.uint8)
-
-        if not os.path.exists(os.path.join(save_dir, 'enc')):
-            os.mkdir(os.path.join(save_dir, 'enc'))
-
-        # Create a progress bar
-        pbar = tqdm(total=int(src_frame_cnt), unit='frames')
-
-        while True:
-            ret, src_frame = src.read()
-
-            if ret == False:
-                break
+# Text of watermark, name of folder of package
+WATERMARK_NAME = str(os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
 
-            # Create a copy of the dummy frame
-            sec_frame = sec_frame_original.copy()
 
-            # Put the text onto the dummy frame
-            font_scale = int(max(src_w, src_h) // 600)
-            font_thickness = int(font_scale // 0.5)
-
-            # Define text position
-            text_x = src_w // 4
-            text_y = src_h // 2
-
-            # Get the region where the text will be placed
-            text_size = cv2.getTextSize(name, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)[0]
-            region = src_frame[text_y - text_size[1]:text_y, text_x:text_x + text_size[0]]
-
-            # Compute the mean color of the region
-            mean_color = cv2.mean(region)[:3]
-
-            # Compute the contrasting color
-            contrast_color = tuple([255 - int(x) for x in mean_color])
-
-            # Adjusting the coordinates to correctly position the text
-            height, width = src_frame.shape[:2]
-
-            # Get the size of the text
-            (text_width, text_height), baseline = cv2.getTextSize(name, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
-
-            # Center positions
-            center_x = width // 2
-            center_y = height // 2
-
-            # Define potential positions with padding along the edges (adjust as necessary)
-            positions = [
-                (0, text_height),
-                (0, center_y + text_height // 2),
-                (center_x - text_width // 2, text_height),
-                (width - text_width, text_height),
-                (0, height - baseline),
-                (width - text_width, height - baseline),
-                (center_x - text_width // 2, height - baseline),
-                (width - text_width, center_y + text_height // 2),
-                (int(width * 0.25) - text_width // 2, text_height),
-                (int(width * 0.75) - text_width // 2, text_height),
-                (int(width * 0.25) - text_width // 2, height - baseline),
-                (int(width * 0.75) - text_width // 2, height - baseline),
-                None, None, None
-            ]
-
-            # In each call to the method, select one random positions from the list
-            selected_positions = random.sample(positions, 1)
-
-            # Put text at the selected positions
-            for pos in selected_positions:
-                if pos is not None:
-                    cv2.putText(sec_frame, name, pos, cv2.FONT_HERSHEY_SIMPLEX, font_scale, contrast_color, font_thickness, cv2.LINE_AA)
-
-            # Encryption for LSB 3 bits
-            encrypted_img = (src_frame & 0b11111000) | (sec_frame >> 6 & 0b00000111)
-
-            fn = fn + 1
-            cv2.imwrite(os.path.join(save_dir, "enc", "{}.png".format(fn)), encrypted_img)
-
-            pbar.update(1)
-
-        pbar.close()
-        src.release()
-
-        # Delete encrypted video if already exists
-        file_name = str(uuid.uuid4())+'.mp4'
-        file_path = os.path.join(save_dir, file_name)
-
-        # Save the video using ffmpeg as a lossless video; frame rate is kept the same
-        cmd = f"ffmpeg -framerate {src_fps} -i {os.path.join(save_dir, 'enc', '%d.png')} -c:v copy {file_path}"
-        os.system(cmd)
-
-        # Delete the temporary image sequence folder
-        shutil.rmtree(os.path.join(save_dir, 'enc'))
-
-    else:
-        # If the media is an image
-        src_frame = cv2.imread(video_path)
-        src_h, src_w = src_frame.shape[:2]
-
-        # Load a dummy image to get the shape attributes
-        sec_frame_original = np.zeros((src_h, src_w, 3), dtype=np.uint8)
-
-        # Create a copy of the dummy frame
-        sec_frame = sec_frame_original.copy()
-
-        # Put the text onto the dummy frame
-        font_scale = int(max(src_w, src_h) // 500)
+class Watermark:
+    """
+    Hidden watermark in 3 least significant bits. Glyph masks and positions are computed once per resolution,
+    watermark is applied to batch of frames at once
+    """
+    def __init__(self, name: str = WATERMARK_NAME, scale_divider: int = 600, allow_empty: bool = True):
+        """
+        Initialization
+        :param name: text of watermark
+        :param scale_divider: font scale is max side of frame divided by this value
+        :param allow_empty: some frames can be without text
+        """
+        self.name = name
+        self.scale_divider = scale_divider
+        self.allow_empty = allow_empty
+        self.params = {}  # (width, height): precomputed region and glyph masks
+        self.elapsed = 0  # time spent on watermark in seconds
+
+    def get_params(self, width: int, height: int) -> dict:
+        """
+        Get precomputed params for resolution
+        :param width: frame width
+        :param height: frame height
+        :return: dict with region for contrast color and glyph masks
+        """
+        if (width, height) in self.params:
+            return self.params[(width, height)]
+
+        font_scale = int(max(width, height) // self.scale_divider)
         font_thickness = int(font_scale // 0.5)
 
-        # Define text position
-        text_x = src_w // 4
-        text_y = src_h // 2
-
-        # Get the region where the text will be placed
-        text_size = cv2.getTextSize(name, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)[0]
-        region = src_frame[text_y - text_size[1]:text_y, text_x:text_x + text_size[0]]
-
-        # Compute the mean color of the region
-        mean_color = cv2.mean(region)[:3]
-
-        # Compute the contrasting color
-        contrast_color = tuple([255 - int(x) for x in mean_color])
-
-        # Adjusting the coordinates to correctly position the text
-        height, width = src_frame.shape[:2]
+        # Get the region where the text will be placed, mean color of this region used for contrast
+        text_x = width // 4
+        text_y = height // 2
+        text_size = cv2.getTextSize(self.name, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)[0]
+        region = (max(0, text_y - text_size[1]), text_y, text_x, text_x + text_size[0])
 
         # Get the size of the text
-        (text_width, text_height), baseline = cv2.getTextSize(name, cv2.FONT_HERSHEY_SIMPLEX, font_scale,
-                                                              font_thickness)
+        (text_width, text_height), baseline = cv2.getTextSize(self.name, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
 
         # Center positions
         center_x = width // 2
         center_y = height // 2
 
-        # Define potential positions with padding along the edges (adjust as necessary)
+        # Define potential positions with padding along the edges
         positions = [
             (0, text_height),
             (0, center_y + text_height // 2),
@@ -414,15 +624,92 @@ def encrypted(video_path: str, save_dir: str, fn: int = 0):
             (int(width * 0.75) - text_width // 2, height - baseline),
         ]
 
-        # In each call to the method, select one random positions from the list
-        selected_positions = random.sample(positions, 1)
+        masks = []
+        for pos in positions:
+            if font_scale == 0:
+                masks.append(None)  # text is too small for frame
+                continue
+            # Draw text once as alpha mask and keep only its bounding box
+            alpha = np.zeros((height, width), dtype=np.uint8)
+            cv2.putText(alpha, self.name, pos, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 255, font_thickness, cv2.LINE_AA)
+            ys, xs = np.nonzero(alpha)
+            if len(ys) == 0:
+                masks.append(None)
+                continue
+            y1, y2, x1, x2 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+            masks.append(((y1, y2, x1, x2), alpha[y1:y2, x1:x2, None].astype(np.float32) / 255))
+        if self.allow_empty:
+            masks += [None, None, None]
+
+        self.params[(width, height)] = {"region": region, "masks": masks}
+        return self.params[(width, height)]
+
+    def apply(self, frames) -> np.ndarray:
+        """
+        Put watermark in frames
+        :param frames: batch of frames with the same size as array (N, H, W, 3) or list
+        :return: batch of encrypted frames
+        """
+        start_time = time.time()
+        batch = np.array(frames, dtype=np.uint8, copy=True) if isinstance(frames, list) else frames
+        if batch.ndim == 3:
+            batch = batch[None]
+        height, width = batch.shape[1:3]
+        params = self.get_params(width, height)
+
+        # Compute the contrasting color to mean color of the region for each frame
+        y1, y2, x1, x2 = params["region"]
+        region = batch[:, y1:y2, x1:x2]
+        if region.size > 0:
+            mean_color = region.reshape(len(batch), -1, 3).mean(axis=1)
+        else:
+            mean_color = np.zeros((len(batch), 3))
+        contrast_color = (255 - mean_color.astype(np.int32)).astype(np.float32)
+
+        # Encryption for LSB 3 bits, clear bits in all frames at once
+        batch &= 0b11111000
+
+        # In each frame select one random position, frames with the same position are processed together
+        selected = np.array([random.randrange(len(params["masks"])) for _ in range(len(batch))])
+        for idx in np.unique(selected):
+            mask = params["masks"][idx]
+            if mask is None:
+                continue
+            (y1, y2, x1, x2), alpha = mask
+            frame_ids = np.nonzero(selected == idx)[0]
+            text = (alpha[None] * contrast_color[frame_ids, None, None, :]).astype(np.uint8)
+            batch[frame_ids, y1:y2, x1:x2] |= text >> 6 & 0b00000111
+
+        self.elapsed += time.time() - start_time
+        return batch
+
+
+def encrypted(video_path: str, save_dir: str, fn: int = 0, batch_size: int = 16):
+    """
+    Put hidden watermark in video or image
+    :param video_path: path to media
+    :param save_dir: directory to save result
+    :param fn: not used, kept for compatibility
+    :param batch_size: number of frames which are encrypted at once
+    :return: file name of encrypted media
+    """
+    media_type = check_media_type(video_path)
+
+    if media_type == "animated":
+        reader = FFmpegVideoReader(video_path)
 
-        # Put text at the selected positions
-        for pos in selected_positions:
-            cv2.putText(sec_frame, name, pos, cv2.FONT_HERSHEY_SIMPLEX, font_scale, contrast_color, font_thickness, cv2.LINE_AA)
+        # Encrypted frames are piped to ffmpeg as a lossless video; frame rate is kept the same
+        file_name = str(uuid.uuid4())+'.mp4'
+        file_path = os.path.join(save_dir, file_name)
+        watermark = Watermark()
+        with FFmpegVideoWriter(file_path, reader.fps, (reader.width, reader.height), lossless=True, watermark=watermark, batch_size=batch_size) as writer:
+            for src_frame in tqdm(reader, total=len(reader), unit='frames'):
+                writer.write(src_frame)
 
-        # Encryption for LSB 3 bits
-        encrypted_img = (src_frame & 0b11111000) | (sec_frame >> 6 & 0b00000111)
+    else:
+        # If the media is an image
+        src_frame = cv2.imread(video_path)
+        encrypted_img = Watermark(scale_divider=500, allow_empty=False).apply(src_frame)[0]
 
         # Save the encrypted image
         file_name = str(uuid.uuid4()) + '.png'
@@ -21,6 +21,8 @@ sys.path.pop(0)
 from cog import Input
 from backend.folders import TMP_FOLDER, DEEPFAKE_MODEL_FOLDER
 from backend.download import download_model, unzip, check_download_size, get_nested_url, is_connected
+from backend.model_registry import model_registry
+from backend.jobs import set_job_progress
 from deepfake.src.utils.segment import SegmentAnything
 from deepfake.src.utils.videoio import (
     cut_start_video, get_frames, check_media_type, save_video_from_frames, extract_audio_from_video, save_video_with_audio
@@ -230,9 +232,9 @@ class Video2Video:
         segment_percentage = segment_percentage / 100
         segmentation = SegmentAnything(segment_percentage)
         if session is None:
-            session = segmentation.init_onnx(onnx_vit_checkpoint, "cuda")  # TODO or small for CPU?
+            session = model_registry.get("SamOnnx", onnx_vit_checkpoint, "cuda", lambda: segmentation.init_onnx(onnx_vit_checkpoint, "cuda"))  # TODO or small for CPU?
         if predictor is None:
-            predictor = segmentation.init_vit(sam_vit_checkpoint, vit_model_type, "cuda")  # TODO or small for CPU?
+            predictor = model_registry.get("SamPredictor", sam_vit_checkpoint, "cuda", lambda: segmentation.init_vit(sam_vit_checkpoint, vit_model_type, "cuda"))  # TODO or small for CPU?
 
         # cut video
         if source_type == "video":
@@ -298,6 +300,7 @@ class Video2Video:
         # get segmentation frames as maks and save
         segmentation.load_models(predictor=predictor, session=session)
 
+        set_job_progress(5, "Segmentation")
         for key in masks.keys():
             print(f"Processing ID: {key}")
             mask_key_save_path = os.path.join(mask_save_path, f"mask_{key}")
@@ -371,10 +374,12 @@ class Video2Video:
         # generate diffusion images by prompt
         frame_files_with_interval = sorted(list(set(frame_files_with_interval)))
         # diffusion frames
+        set_job_progress(20, "Diffusion keyframes")
         render(
             cfg=cfg, args=args, masks=masks, frame_files_with_interval=frame_files_with_interval, sd_model_path=sd_model_path,
             controlnet_model_path=controlnet_model_path, vae_model_path=vae_model_path, gmflow_model_path=gmflow_model_path,
-            frame_path=frame_save_path, mask_path=mask_save_path
+            frame_path=frame_save_path, mask_path=mask_save_path,
+            cache_dir=os.path.join(DEEPFAKE_MODEL_FOLDER, "keyframe_cache")  # skip keyframes which were rendered before
         )
 
         if source_media_type == "static":
@@ -439,6 +444,7 @@ class Video2Video:
                 shutil.copy(frame_path, key_path)
 
         # processing ebsynth
+        set_job_progress(60, "Ebsynth")
         ebsynth = Ebsynth(gmflow_model_path=gmflow_model_path, ebsynth_path=ebsynth_path)
         output_frame_folder_path, output_names = ebsynth.processing_ebsynth(
             frames_path=cfg.key_subdir, frames=frame_files_with_interval,
@@ -1,9 +1,18 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
 
-from diffusers.src.flow.flow_utils import read_flow, read_mask
+
+# Threads to read and write guide images, cv2 releases GIL during encoding and decoding
+GUIDE_IO_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def map_images(func, items) -> list:
+    """Apply func to items in pool of threads, used for read, filter and write images of whole sequence"""
+    with ThreadPoolExecutor(max_workers=GUIDE_IO_WORKERS) as executor:
+        return list(executor.map(func, items))
 
 
 class BaseGuide:
@@ -13,7 +22,10 @@ class BaseGuide:
         ...
 
     def get_cmd(self, i, weight) -> str:
-        return f'-guide {os.path.abspath(self.imgs[0])} {os.path.abspath(self.imgs[i])} -weight {weight}'
+        return ' '.join(self.get_args(i, weight))
+
+    def get_args(self, i, weight) -> list:
+        return ['-guide', os.path.abspath(self.imgs[0]), os.path.abspath(self.imgs[i]), '-weight', str(weight)]
 
 
 class ColorGuide(BaseGuide):
@@ -27,24 +39,20 @@ class PositionalGuide(BaseGuide):
 
     def __init__(self, flow_paths, save_paths, flow_calc):
         super().__init__(flow_calc)
-        flows = [read_flow(f) for f in flow_paths]
-        masks = [read_mask(f) for f in flow_paths]
+        flows = [flow_calc.read_flow(f) for f in flow_paths]
+        masks = [flow_calc.read_mask(f) for f in flow_paths]
         # TODO: modify the format of flow to numpy
         H, W = flows[0].shape[2:]
         first_img = PositionalGuide.__generate_first_img(H, W)
         prev_img = first_img
         imgs = [first_img]
-        cid = 0
         for flow, mask in zip(flows, masks):
             cur_img = flow_calc.warp(prev_img, flow, 'nearest').astype(np.uint8)
             cur_img = cv2.inpaint(cur_img, mask, 30, cv2.INPAINT_TELEA)
             prev_img = cur_img
             imgs.append(cur_img)
-            cid += 1
-            cv2.imwrite(f'guide/{cid}.jpg', mask)
 
-        for path, img in zip(save_paths, imgs):
-            cv2.imwrite(path, img)
+        map_images(lambda item: cv2.imwrite(*item), zip(save_paths, imgs))
         self.imgs = save_paths
 
     @staticmethod
@@ -63,11 +71,15 @@ class EdgeGuide(BaseGuide):
 
     def __init__(self, imgs, save_paths, flow_calc):
         super().__init__(flow_calc)
-        edges = [EdgeGuide.__generate_edge(cv2.imread(img)) for img in imgs]
-        for path, img in zip(save_paths, edges):
-            cv2.imwrite(path, img)
+        # edge depends only on frame, frames which were already written by pass in other direction are skipped
+        items = [(img, path) for img, path in zip(imgs, save_paths) if not EdgeGuide.__is_written(img, path)]
+        map_images(lambda item: cv2.imwrite(item[1], EdgeGuide.__generate_edge(cv2.imread(item[0]))), items)
         self.imgs = save_paths
 
+    @staticmethod
+    def __is_written(img_path, save_path):
+        return os.path.exists(save_path) and os.path.getmtime(save_path) >= os.path.getmtime(img_path)
+
     @staticmethod
     def __generate_edge(img):
         filter = np.array([[0, -1, 0], [-1, 4, -1], [0, -1, 0]])
@@ -79,8 +91,8 @@ class TemporalGuide(BaseGuide):
 
     def __init__(self, key_img, stylized_imgs, flow_paths, save_paths, flow_calc):
         super().__init__(flow_calc)
-        self.flows = [read_flow(f) for f in flow_paths]
-        self.masks = [read_mask(f) for f in flow_paths]
+        # flows are read when frame is warped, flows of all passes are not kept in memory while passes wait in pool
+        self.flow_paths = flow_paths
         self.stylized_imgs = stylized_imgs
         self.imgs = save_paths
         self.flow_calc = flow_calc
@@ -88,12 +100,14 @@ class TemporalGuide(BaseGuide):
         first_img = cv2.imread(key_img)
         cv2.imwrite(self.imgs[0], first_img)
 
-    def get_cmd(self, i, weight) -> str:
+    def get_args(self, i, weight) -> list:
         if i == 0:
             warped_img = self.stylized_imgs[0]
         else:
             prev_img = cv2.imread(self.stylized_imgs[i - 1])
-            warped_img = self.flow_calc.warp(prev_img, self.flows[i - 1], 'nearest').astype(np.uint8)
-            warped_img = cv2.inpaint(warped_img, self.masks[i - 1], 30, cv2.INPAINT_TELEA)
+            flow = self.flow_calc.read_flow(self.flow_paths[i - 1])
+            mask = self.flow_calc.read_mask(self.flow_paths[i - 1])
+            warped_img = self.flow_calc.warp(prev_img, flow, 'nearest').astype(np.uint8)
+            warped_img = cv2.inpaint(warped_img, mask, 30, cv2.INPAINT_TELEA)
             cv2.imwrite(self.imgs[i], warped_img)
-        return super().get_cmd(i, weight)
+        return super().get_args(i, weight)
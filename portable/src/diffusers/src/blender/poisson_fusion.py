@@ -1,43 +1,50 @@
+import threading
+from collections import OrderedDict
+
 import cv2
 import numpy as np
 import scipy
+import scipy.fft
+import scipy.sparse
+import scipy.sparse.linalg
+
+# operators and spectral denominators keyed by (h, w, grad_weight), video frames have the same shape
+CACHE_SIZE = 4
+_operator_cache = OrderedDict()
+_denominator_cache = OrderedDict()
+_cache_lock = threading.Lock()
 
-As = None
-prev_states = None
+
+def _get_cached(cache, key, builder):
+    with _cache_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = builder(*key)
+    with _cache_lock:
+        cache[key] = value
+        while len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+    return value
 
 
 def construct_A(h, w, grad_weight):
-    indgx_x = []
-    indgx_y = []
-    indgy_x = []
-    indgy_y = []
-    vdx = []
-    vdy = []
-    for i in range(h):
-        for j in range(w):
-            if i < h - 1:
-                indgx_x += [i * w + j]
-                indgx_y += [i * w + j]
-                vdx += [1]
-                indgx_x += [i * w + j]
-                indgx_y += [(i + 1) * w + j]
-                vdx += [-1]
-            if j < w - 1:
-                indgy_x += [i * w + j]
-                indgy_y += [i * w + j]
-                vdy += [1]
-                indgy_x += [i * w + j]
-                indgy_y += [i * w + j + 1]
-                vdy += [-1]
+    n = h * w
+    idx = np.arange(n).reshape(h, w)
+    # vertical gradient x[i, j] - x[i + 1, j] and horizontal gradient x[i, j] - x[i, j + 1]
+    rows_x = idx[:-1, :].ravel()
+    rows_y = idx[:, :-1].ravel()
     Ix = scipy.sparse.coo_array(
-        (np.ones(h * w), (np.arange(h * w), np.arange(h * w))),
-        shape=(h * w, h * w)).tocsc()
+        (np.ones(n), (np.arange(n), np.arange(n))),
+        shape=(n, n)).tocsc()
     Gx = scipy.sparse.coo_array(
-        (np.array(vdx), (np.array(indgx_x), np.array(indgx_y))),
-        shape=(h * w, h * w)).tocsc()
+        (np.concatenate([np.ones(len(rows_x)), -np.ones(len(rows_x))]),
+         (np.concatenate([rows_x, rows_x]), np.concatenate([rows_x, rows_x + w]))),
+        shape=(n, n)).tocsc()
     Gy = scipy.sparse.coo_array(
-        (np.array(vdy), (np.array(indgy_x), np.array(indgy_y))),
-        shape=(h * w, h * w)).tocsc()
+        (np.concatenate([np.ones(len(rows_y)), -np.ones(len(rows_y))]),
+         (np.concatenate([rows_y, rows_y]), np.concatenate([rows_y, rows_y + 1]))),
+        shape=(n, n)).tocsc()
     As = []
     for i in range(3):
         As += [
@@ -46,35 +53,47 @@ def construct_A(h, w, grad_weight):
     return As
 
 
-def poisson_fusion(blendI, I1, I2, mask, grad_weight=[2.5, 0.5, 0.5]):
-    global As
-    global prev_states
+def construct_denominator(h, w, grad_weight):
+    """
+    Eigenvalues of normal equations A^T A = weight^2 * L + I, where L is grid laplacian with Neumann border,
+    L is diagonalized by DCT-II
+    """
+    lx = 2 - 2 * np.cos(np.pi * np.arange(h) / h)
+    ly = 2 - 2 * np.cos(np.pi * np.arange(w) / w)
+    laplacian = lx[:, np.newaxis] + ly[np.newaxis, :]
+    weights = np.asarray(grad_weight, dtype=float) ** 2
+    return laplacian[:, :, np.newaxis] * weights[np.newaxis, np.newaxis, :] + 1
 
-    Iab = cv2.cvtColor(blendI, cv2.COLOR_BGR2LAB).astype(float)
-    Ia = cv2.cvtColor(I1, cv2.COLOR_BGR2LAB).astype(float)
-    Ib = cv2.cvtColor(I2, cv2.COLOR_BGR2LAB).astype(float)
-    m = (mask > 0).astype(float)[:, :, np.newaxis]
+
+def solve_dct(Iab, gx, gy, grad_weight, workers=-1):
+    """
+    Exact least squares solution of [w*Gx; w*Gy; I] x = [w*gx; w*gy; im] for all channels at once
+    """
     h, w, c = Iab.shape
+    im_mean = Iab.mean(axis=(0, 1))
+    weights = np.asarray(grad_weight, dtype=float) ** 2
+    # A^T b, transpose of forward difference is backward difference
+    div = gx.copy()
+    div[1:, :, :] -= gx[:-1, :, :]
+    div[:, 1:, :] += gy[:, 1:, :] - gy[:, :-1, :]
+    div[:, 0, :] += gy[:, 0, :]
+    rhs = div * weights + (Iab - im_mean)
+
+    denominator = _get_cached(_denominator_cache, (h, w, tuple(grad_weight)), construct_denominator)
+    spectrum = scipy.fft.dctn(rhs, type=2, axes=(0, 1), norm="ortho", workers=workers)
+    out = scipy.fft.idctn(spectrum / denominator, type=2, axes=(0, 1), norm="ortho", workers=workers)
+    return out + im_mean
 
-    # fuse the gradient of I1 and I2 with mask
-    gx = np.zeros_like(Ia)
-    gy = np.zeros_like(Ia)
-    gx[:-1, :, :] = (Ia[:-1, :, :] - Ia[1:, :, :]) * (1 - m[:-1, :, :]) + (
-        Ib[:-1, :, :] - Ib[1:, :, :]) * m[:-1, :, :]
-    gy[:, :-1, :] = (Ia[:, :-1, :] - Ia[:, 1:, :]) * (1 - m[:, :-1, :]) + (
-        Ib[:, :-1, :] - Ib[:, 1:, :]) * m[:, :-1, :]
 
-    # construct A for solving Ax=b
-    crt_states = (h, w, grad_weight)
-    if As is None or crt_states != prev_states:
-        As = construct_A(*crt_states)
-        prev_states = crt_states
+def solve_lsqr(Iab, gx, gy, grad_weight):
+    h, w, c = Iab.shape
+    As = _get_cached(_operator_cache, (h, w, tuple(grad_weight)), construct_A)
 
     final = []
     for i in range(3):
         weight = grad_weight[i]
-        im_dx = np.clip(gx[:, :, i].reshape(h * w, 1), -100, 100)
-        im_dy = np.clip(gy[:, :, i].reshape(h * w, 1), -100, 100)
+        im_dx = gx[:, :, i].reshape(h * w, 1)
+        im_dy = gy[:, :, i].reshape(h * w, 1)
         im = Iab[:, :, i].reshape(h * w, 1)
         im_mean = im.mean()
         im = im - im_mean
@@ -83,6 +102,30 @@ def poisson_fusion(blendI, I1, I2, mask, grad_weight=[2.5, 0.5, 0.5]):
         out = scipy.sparse.linalg.lsqr(A, b)
         out_im = (out[0] + im_mean).reshape(h, w, 1)
         final += [out_im]
+    return np.concatenate(final, axis=2)
+
+
+def poisson_fusion(blendI, I1, I2, mask, grad_weight=[2.5, 0.5, 0.5], method="dct"):
+    Iab = cv2.cvtColor(blendI, cv2.COLOR_BGR2LAB).astype(float)
+    Ia = cv2.cvtColor(I1, cv2.COLOR_BGR2LAB).astype(float)
+    Ib = cv2.cvtColor(I2, cv2.COLOR_BGR2LAB).astype(float)
+    m = (mask > 0).astype(float)[:, :, np.newaxis]
+
+    # fuse the gradient of I1 and I2 with mask
+    gx = np.zeros_like(Ia)
+    gy = np.zeros_like(Ia)
+    gx[:-1, :, :] = (Ia[:-1, :, :] - Ia[1:, :, :]) * (1 - m[:-1, :, :]) + (
+        Ib[:-1, :, :] - Ib[1:, :, :]) * m[:-1, :, :]
+    gy[:, :-1, :] = (Ia[:, :-1, :] - Ia[:, 1:, :]) * (1 - m[:, :-1, :]) + (
+        Ib[:, :-1, :] - Ib[:, 1:, :]) * m[:, :-1, :]
+    gx = np.clip(gx, -100, 100)
+    gy = np.clip(gy, -100, 100)
+
+    # solve Ax=b, dct solves all channels at once in multiple threads, lsqr is iterative solver of sparse A
+    if method == "lsqr":
+        final = solve_lsqr(Iab, gx, gy, grad_weight)
+    else:
+        final = solve_dct(Iab, gx, gy, grad_weight)
 
-    final = np.clip(np.concatenate(final, axis=2), 0, 255)
+    final = np.clip(final, 0, 255)
     return cv2.cvtColor(final.astype(np.uint8), cv2.COLOR_LAB2BGR)
@@ -146,6 +146,24 @@ class VideoSequence:
 
         return path_dir
 
+    def get_flow_pairs(self):
+        """
+        Frames of video and flow paths of adjacent frames for forward and backward sequences
+        :return: frame paths, paths of flow from frame k + 1 to frame k, paths of flow from frame k to frame k + 1
+        """
+        frame_paths = [os.path.join(self.__input_dir, frame) for frame in self.__input_frames]
+        frame_ids = [int(frame.split(".")[0]) for frame in self.__input_frames]
+        fwd_paths = []
+        bwd_paths = []
+        for k in range(len(frame_ids) - 1):
+            if frame_ids[k + 1] != frame_ids[k] + 1:
+                fwd_paths.append(None)
+                bwd_paths.append(None)
+                continue
+            fwd_paths.append(os.path.join(self.__tmp_dir, 'flow_f_%04d.npy' % frame_ids[k]))
+            bwd_paths.append(os.path.join(self.__tmp_dir, 'flow_b_%04d.npy' % frame_ids[k + 1]))
+        return frame_paths, fwd_paths, bwd_paths
+
     def get_edge_sequence(self, i, is_forward=True):
         if i + 1 > len(self.__frame_files_with_interval) - 1:
             # check what file will exist
@@ -191,7 +209,9 @@ class VideoSequence:
             i += 1
             id_list = list(range(end_id, beg_id, -1))
         tmp_dir = self.__get_tmp_out_subdir(interval_frame_name)
-        path_dir = [os.path.join(tmp_dir, 'temporal_' + self.__output_format % id) for id in id_list if self.__input_format % id in self.__input_frames]
+        # forward and backward passes of sequence share tmp folder and run concurrently, guides depend on direction
+        prefix = 'temporal_f_' if is_forward else 'temporal_b_'
+        path_dir = [os.path.join(tmp_dir, prefix + self.__output_format % id) for id in id_list if self.__input_format % id in self.__input_frames]
         return path_dir
 
     def get_pos_sequence(self, i, is_forward=True):
@@ -215,7 +235,9 @@ class VideoSequence:
             i += 1
             id_list = list(range(end_id, beg_id, -1))
         tmp_dir = self.__get_tmp_out_subdir(interval_frame_name)
-        path_dir = [os.path.join(tmp_dir, 'pos_' + self.__output_format % id) for id in id_list if self.__input_format % id in self.__input_frames]
+        # forward and backward passes of sequence share tmp folder and run concurrently, guides depend on direction
+        prefix = 'pos_f_' if is_forward else 'pos_b_'
+        path_dir = [os.path.join(tmp_dir, prefix + self.__output_format % id) for id in id_list if self.__input_format % id in self.__input_frames]
         return path_dir
 
     def get_sequence_beg_id(self, i):
@@ -1,4 +1,6 @@
 import os
+import threading
+from collections import OrderedDict
 
 import cv2
 import numpy as np
@@ -8,6 +10,19 @@ import torch.nn.functional as F
 from diffusers.src.gmflow.gmflow import GMFlow  # noqa: E702 E402 F401
 
 
+# Number of frame pairs in one GMFlow forward, can be changed by env before start application
+FLOW_BATCH_ENV = "WUNJO_FLOW_BATCH"
+DEFAULT_FLOW_BATCH = 4
+
+
+def get_flow_batch_size() -> int:
+    try:
+        return max(1, int(os.environ.get(FLOW_BATCH_ENV, DEFAULT_FLOW_BATCH)))
+    except ValueError:
+        print(f"Error... {FLOW_BATCH_ENV} has to be integer, used default {DEFAULT_FLOW_BATCH}")
+        return DEFAULT_FLOW_BATCH
+
+
 class InputPadder:
     """ Pads images such that dimensions are divisible by 8 """
 
@@ -29,7 +44,21 @@ class InputPadder:
         return x[..., c[0]:c[1], c[2]:c[3]]
 
 
+_grid_cache = {}  # (h, w, homogeneous, device): grid [1, 2, H, W], frames of video have the same size
+
+
 def coords_grid(b, h, w, homogeneous=False, device=None):
+    key = (h, w, homogeneous, str(device))
+    grid = _grid_cache.get(key)
+    if grid is None:
+        grid = _coords_grid(h, w, homogeneous, device)
+        if len(_grid_cache) >= 8:
+            _grid_cache.clear()
+        _grid_cache[key] = grid
+    return grid.expand(b, -1, -1, -1)  # [B, 2, H, W] or [B, 3, H, W]
+
+
+def _coords_grid(h, w, homogeneous=False, device=None):
     y, x = torch.meshgrid(torch.arange(h), torch.arange(w), indexing='ij')  # [H, W]
 
     stacks = [x, y]
@@ -40,7 +69,7 @@ def coords_grid(b, h, w, homogeneous=False, device=None):
 
     grid = torch.stack(stacks, dim=0).float()  # [2, H, W] or [3, H, W]
 
-    grid = grid[None].repeat(b, 1, 1, 1)  # [B, 2, H, W] or [B, 3, H, W]
+    grid = grid[None]  # [1, 2, H, W] or [1, 3, H, W]
 
     if device is not None:
         grid = grid.to(device)
@@ -81,7 +110,7 @@ def flow_warp(feature,flow, mask=False,mode='bilinear',padding_mode='zeros'):
     b, c, h, w = feature.size()
     assert flow.size(1) == 2
 
-    grid = coords_grid(b, h, w).to(flow.device) + flow  # [B, 2, H, W]
+    grid = coords_grid(b, h, w, device=flow.device) + flow  # [B, 2, H, W]
 
     return bilinear_sample(feature,
                            grid,
@@ -135,6 +164,67 @@ def get_warped_and_mask(flow_model, image1, image2, image3=None, pixel_consisten
     return warped_results, bwd_occ, bwd_flow
 
 
+class FlowStore:
+    """
+    Flows and occlusion masks keyed by save path. Flows are saved as .npy and read by memory map, masks are saved as
+    .png. Only a few last used maps and masks are kept, so long videos do not hold open file for each flow and all
+    masks in memory
+    """
+    def __init__(self, cache_size=8):
+        self.cache_size = cache_size
+        self.flows = OrderedDict()  # save path: memory map
+        self.masks = OrderedDict()  # save path: mask
+        self.lock = threading.Lock()
+
+    def __contains__(self, save_path):
+        return os.path.exists(save_path)
+
+    def put(self, save_path, flow, occ):
+        """
+        Save flow and mask
+        :param save_path: path of .npy flow, mask is saved near as .png
+        :param flow: flow [1, 2, H, W]
+        :param occ: occlusion [1, H, W] float
+        :return: None
+        """
+        with self.lock:
+            # cached map of old file has not to be read after file is rewritten
+            self.flows.pop(save_path, None)
+            self.masks.pop(save_path, None)
+        np.save(save_path, flow.cpu().numpy())
+        mask = (occ[0].cpu().numpy() * 255).astype(np.uint8)
+        cv2.imwrite(os.path.splitext(save_path)[0] + '.png', mask)
+
+    def _get_cached(self, cache, save_path, reader):
+        with self.lock:
+            if save_path in cache:
+                cache.move_to_end(save_path)
+                return cache[save_path]
+        value = reader(save_path)
+        with self.lock:
+            cache[save_path] = value
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return value
+
+    def get_flow(self, save_path):
+        """
+        Flow as tensor over memory map without copy, flow is only read by warp, so tensor must not be changed in place.
+        Copy on write map is used because torch warns on every wrap of read only array. Map evicted from cache is
+        closed when last tensor over it is released
+        """
+        flow = self._get_cached(self.flows, save_path, lambda path: np.load(path, mmap_mode='c'))
+        return torch.from_numpy(flow)
+
+    def get_mask(self, save_path):
+        return self._get_cached(self.masks, save_path, read_mask)
+
+    def clear(self):
+        with self.lock:
+            self.flows.clear()
+            self.masks.clear()
+
+
 class FlowCalc():
     def __init__(self, model_path):
         flow_model = GMFlow(
@@ -152,12 +242,88 @@ class FlowCalc():
         flow_model.load_state_dict(weights, strict=False)
         flow_model.eval()
         self.model = flow_model
+        self.store = FlowStore()
+
+    def has_flow(self, save_path):
+        return save_path in self.store
+
+    def read_flow(self, save_path):
+        return self.store.get_flow(save_path)
+
+    def read_mask(self, save_path):
+        return self.store.get_mask(save_path)
+
+    @torch.no_grad()
+    def get_flow_batch(self, images):
+        """
+        Bidirectional flow of adjacent frames by one GMFlow forward
+        :param images: frames [N, 3, H, W] float on cuda, padded
+        :return: fwd_flow, bwd_flow [N - 1, 2, H, W] and fwd_occ, bwd_occ [N - 1, H, W] of pairs (images[k], images[k + 1])
+        """
+        results_dict = self.model(images[:-1], images[1:], attn_splits_list=[2], corr_radius_list=[-1], prop_radius_list=[-1], pred_bidir_flow=True)
+        flow_pr = results_dict['flow_preds'][-1]  # [2 * B, 2, H, W], forward flows and after backward flows
+        n = images.shape[0] - 1
+        fwd_flow, bwd_flow = flow_pr[:n], flow_pr[n:]
+        fwd_occ, bwd_occ = forward_backward_consistency_check(fwd_flow, bwd_flow)
+        return fwd_flow, bwd_flow, fwd_occ, bwd_occ
+
+    @torch.no_grad()
+    def compute_flows(self, frame_paths, fwd_save_paths, bwd_save_paths, batch_size=None):
+        """
+        Calculate flows of all adjacent frames in batches. Each frame is read and padded once, one pass gives flow
+        for both directions: flow of pair (k, k + 1) for forward sequence and flow of pair (k + 1, k) for backward sequence
+        :param frame_paths: frames in order
+        :param fwd_save_paths: save path of flow from frame k + 1 to frame k, None if pair is not needed
+        :param bwd_save_paths: save path of flow from frame k to frame k + 1, None if pair is not needed
+        :param batch_size: number of pairs in one forward, if None read from env
+        :return: None
+        """
+        batch_size = batch_size or get_flow_batch_size()
+        pairs = [k for k in range(len(frame_paths) - 1)
+                 if (fwd_save_paths[k] is not None and not self.has_flow(fwd_save_paths[k])) or
+                 (bwd_save_paths[k] is not None and not self.has_flow(bwd_save_paths[k]))]
+        if not pairs:
+            return
+
+        def read_frame(k):
+            return torch.from_numpy(cv2.imread(frame_paths[k])).permute(2, 0, 1).float()
+
+        # group neighbour pairs to read every frame one time
+        groups = []
+        for k in pairs:
+            if groups and groups[-1][-1] == k - 1 and len(groups[-1]) < batch_size:
+                groups[-1].append(k)
+            else:
+                groups.append([k])
+
+        padder = None
+        cached_frame = None  # last frame of previous group which is first frame of next group
+        for group in groups:
+            frames = []
+            for k in range(group[0], group[-1] + 2):
+                if cached_frame is not None and cached_frame[0] == k:
+                    frames.append(cached_frame[1])
+                    continue
+                frame = read_frame(k)
+                if padder is None:
+                    padder = InputPadder(frame.shape, padding_factor=8)
+                frames.append(padder.pad(frame[None].cuda())[0][0])
+            cached_frame = (group[-1] + 1, frames[-1])
+
+            fwd_flow, bwd_flow, fwd_occ, bwd_occ = self.get_flow_batch(torch.stack(frames))
+            fwd_flow, bwd_flow = padder.unpad(fwd_flow), padder.unpad(bwd_flow)
+            fwd_occ, bwd_occ = padder.unpad(fwd_occ), padder.unpad(bwd_occ)
+            for n, k in enumerate(group):
+                if fwd_save_paths[k] is not None:
+                    self.store.put(fwd_save_paths[k], bwd_flow[n:n + 1], bwd_occ[n:n + 1])
+                if bwd_save_paths[k] is not None:
+                    self.store.put(bwd_save_paths[k], fwd_flow[n:n + 1], fwd_occ[n:n + 1])
 
     @torch.no_grad()
     def get_flow(self, image1, image2, save_path=None):
 
-        if save_path is not None and os.path.exists(save_path):
-            bwd_flow = read_flow(save_path)
+        if save_path is not None and self.has_flow(save_path):
+            bwd_flow = self.read_flow(save_path)
             return bwd_flow
 
         image1 = torch.from_numpy(image1).permute(2, 0, 1).float()
@@ -171,12 +337,7 @@ class FlowCalc():
         fwd_occ, bwd_occ = forward_backward_consistency_check(
             fwd_flow, bwd_flow)  # [1, H, W] float
         if save_path is not None:
-            flow_np = bwd_flow.cpu().numpy()
-            np.save(save_path, flow_np)
-            mask_path = os.path.splitext(save_path)[0] + '.png'
-            bwd_occ = bwd_occ.cpu().permute(1, 2, 0).to(
-                torch.long).numpy() * 255
-            cv2.imwrite(mask_path, bwd_occ)
+            self.store.put(save_path, bwd_flow, bwd_occ)
 
         return bwd_flow
 
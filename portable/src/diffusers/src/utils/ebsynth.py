@@ -1,11 +1,12 @@
 import os
 import cv2
 import struct
+import subprocess
 import numpy as np
 from time import time
 from typing import List
 from tqdm import tqdm
-from numba import njit
+from concurrent.futures import ThreadPoolExecutor
 
 from diffusers.src.flow.flow_utils import FlowCalc
 from diffusers.src.blender.video_sequence import VideoSequence
@@ -14,8 +15,21 @@ import diffusers.src.blender.histogram_blend as histogram_blend
 from diffusers.src.blender.guide import BaseGuide, ColorGuide, EdgeGuide, PositionalGuide, TemporalGuide
 
 
-@njit
+# Number of parallel ebsynth processes, can be changed by env before start application
+EBSYNTH_WORKERS_ENV = "WUNJO_EBSYNTH_WORKERS"
+
+
+def get_ebsynth_workers() -> int:
+    default = os.cpu_count() or 1
+    try:
+        return max(1, int(os.environ.get(EBSYNTH_WORKERS_ENV, default)))
+    except ValueError:
+        print(f"Error... {EBSYNTH_WORKERS_ENV} has to be integer, used default {default}")
+        return default
+
+
 def g_error_mask_loop(H, W, dist1, dist2, output, weight1, weight2):
+    """Per pixel reference of g_error_mask, used by benchmark with numba"""
     for i in range(H):
         for j in range(W):
             if weight1 * dist1[i, j] < weight2 * dist2[i, j]:
@@ -29,14 +43,15 @@ def g_error_mask_loop(H, W, dist1, dist2, output, weight1, weight2):
 
 
 def g_error_mask(dist1, dist2, weight1=1, weight2=1):
-    H, W = dist1.shape
-    output = np.empty_like(dist1, dtype=np.byte)
-    g_error_mask_loop(H, W, dist1, dist2, output, weight1, weight2)
-    return output
+    if weight1 == 0:
+        return np.zeros(dist1.shape, dtype=np.byte)
+    if weight2 == 0:
+        return np.ones(dist1.shape, dtype=np.byte)
+    return (weight1 * dist1 >= weight2 * dist2).astype(np.byte)
 
 
-@njit
 def assemble_min_error_img_loop(H, W, a, b, error_mask, out):
+    """Per pixel reference of assemble_min_error_img, used by benchmark with numba"""
     for i in range(H):
         for j in range(W):
             if error_mask[i, j] == 0:
@@ -46,10 +61,10 @@ def assemble_min_error_img_loop(H, W, a, b, error_mask, out):
 
 
 def assemble_min_error_img(a, b, error_mask):
-    H, W = a.shape[0:2]
-    out = np.empty_like(a)
-    assemble_min_error_img_loop(H, W, a, b, error_mask, out)
-    return out
+    mask = error_mask == 0
+    if a.ndim == 3:
+        mask = mask[:, :, np.newaxis]
+    return np.where(mask, a, b)
 
 
 class Ebsynth:
@@ -150,8 +165,7 @@ class Ebsynth:
             bytes = fp.read()
         read_size = struct.unpack('q', bytes[:8])
         assert read_size[0] == img_size
-        float_res = struct.unpack('f' * img_size, bytes[8:])
-        res = np.array(float_res, dtype=np.float32).reshape(img_shape[0], img_shape[1])
+        res = np.frombuffer(bytes, dtype=np.float32, count=img_size, offset=8).reshape(img_shape[0], img_shape[1])
         return res
 
     def create_sequence(self, base_folder, input_subdir, frames_path, frame_files_with_interval):
@@ -162,18 +176,57 @@ class Ebsynth:
         return sequence
 
     def run_ebsynth(self, video_sequence: VideoSequence):
-        """Run ebsynth in one process"""
+        """Run ebsynth for key sequences in pool of processes"""
         beg = time()
         i_arr = list(range(0, len(video_sequence.frame_files)))
         self.process_sequences(i_arr, video_sequence)
         end = time()
         print(f'Ebsynth process: {round(end - beg)} sec')
 
-    def process_sequences(self, i_arr, video_sequence: VideoSequence):
-        [self.process_one_sequence(i, video_sequence) for i in i_arr]
+    def process_sequences(self, i_arr, video_sequence: VideoSequence, max_workers: int = None):
+        """
+        Prepare flows and guides of all key sequences, after that run ebsynth passes concurrently. Forward and backward
+        passes of sequences are independent, frames inside one pass are run in order because temporal guide uses
+        previous stylized frame
+        :param i_arr: ids of sequences
+        :param video_sequence: video sequence
+        :param max_workers: number of parallel ebsynth processes, if None read from env or use number of cpu
+        :return: None
+        """
+        # flows are calculated on GPU in batches for both directions and guides are prepared in main thread
+        beg = time()
+        try:
+            self.flow_calc.compute_flows(*video_sequence.get_flow_pairs())
+            print(f'Flow process: {round(time() - beg)} sec')
+            passes = [p for i in i_arr for p in self.prepare_one_sequence(i, video_sequence)]
+            if not passes:
+                return
+            max_workers = min(max_workers or get_ebsynth_workers(), len(passes))
+            print(f"Run ebsynth on style for {len(passes)} passes by {max_workers} processes")
+            progress_bar = tqdm(total=sum(len(p["input_seq"]) for p in passes), unit='it', unit_scale=True)
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ebsynth") as executor:
+                # each thread waits own ebsynth subprocess, so number of threads bounds number of processes
+                list(executor.map(lambda p: self.run_pass(p, progress_bar), passes))
+            progress_bar.close()
+        finally:
+            # release cached maps and masks of this video
+            self.flow_calc.store.clear()
 
     def process_one_sequence(self, i, video_sequence: VideoSequence):
+        for ebsynth_pass in self.prepare_one_sequence(i, video_sequence):
+            progress_bar = tqdm(total=len(ebsynth_pass["input_seq"]), unit='it', unit_scale=True)
+            self.run_pass(ebsynth_pass, progress_bar)
+            progress_bar.close()
+
+    def prepare_one_sequence(self, i, video_sequence: VideoSequence) -> list:
+        """
+        Calculate flows and guides of forward and backward passes of key sequence
+        :param i: id of sequence
+        :param video_sequence: video sequence
+        :return: list of passes
+        """
         frame_files = video_sequence.frame_files
+        passes = []
         for is_forward in [True, False]:
             input_seq = video_sequence.get_input_sequence(i, is_forward)
             if not input_seq:
@@ -189,6 +242,8 @@ class Ebsynth:
                 continue
             key_img = os.path.join(video_sequence.key_dir, frame_files[key_img_id])
             for j in range(len(input_seq) - 1):
+                if self.flow_calc.has_flow(flow_seq[j]):
+                    continue
                 i1 = cv2.imread(input_seq[j])
                 i2 = cv2.imread(input_seq[j + 1])
                 self.flow_calc.get_flow(i1, i2, flow_seq[j])
@@ -201,21 +256,86 @@ class Ebsynth:
                 PositionalGuide(flow_seq, video_sequence.get_pos_sequence(i, is_forward), self.flow_calc)
             ]
             weights = [6, 0.5, 0.5, 2]
+            passes.append({"key_img": key_img, "input_seq": input_seq, "output_seq": output_seq, "guides": guides, "weights": weights})
+        return passes
 
-            print("Run ebsynth on style")
-            progress_bar = tqdm(total=len(input_seq), unit='it', unit_scale=True)
-            for j in range(len(input_seq)):
-                # key frame
-                if j == 0:
-                    img = cv2.imread(key_img)
-                    cv2.imwrite(output_seq[0], img)
-                else:
-                    cmd = f'{self.ebsynth_bin} -style {os.path.abspath(key_img)}'
-                    for g, w in zip(guides, weights):
-                        cmd += ' ' + g.get_cmd(j, w)
-                    cmd += f' -output {os.path.abspath(output_seq[j])} -searchvoteiters 12 -patchmatchiters 6'
-                    os.system(cmd)
-                # update progress bar
+    def run_pass(self, ebsynth_pass: dict, progress_bar=None):
+        """
+        Run ebsynth frame by frame for one pass
+        :param ebsynth_pass: pass from prepare_one_sequence
+        :param progress_bar: tqdm progress bar
+        :return: None
+        """
+        key_img = ebsynth_pass["key_img"]
+        output_seq = ebsynth_pass["output_seq"]
+        for j in range(len(ebsynth_pass["input_seq"])):
+            # key frame
+            if j == 0:
+                img = cv2.imread(key_img)
+                cv2.imwrite(output_seq[0], img)
+            else:
+                args = [self.ebsynth_bin, '-style', os.path.abspath(key_img)]
+                for g, w in zip(ebsynth_pass["guides"], ebsynth_pass["weights"]):
+                    args += g.get_args(j, w)
+                args += ['-output', os.path.abspath(output_seq[j]), '-searchvoteiters', '12', '-patchmatchiters', '6']
+                result = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                if result.returncode != 0:
+                    print(f"Error... ebsynth failed on {output_seq[j]}: {result.stderr.decode(errors='ignore').strip()}")
+            # update progress bar
+            if progress_bar is not None:
                 progress_bar.update(1)
-            # close progress bar for key
-            progress_bar.close()
+
+
+def benchmark(height=720, width=1280, repeats=20):
+    """
+    Time of vectorised blending kernels and per pixel numba kernels, cold start includes numba compilation
+    :param height: frame height
+    :param width: frame width
+    :param repeats: number of calls after first call
+    :return: dict with time in seconds for each kernel
+    """
+    from numba import njit
+
+    dist1 = np.random.rand(height, width).astype(np.float32)
+    dist2 = np.random.rand(height, width).astype(np.float32)
+    a = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    b = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    weight1, weight2 = 0.3, 0.7
+
+    mask_loop = njit(g_error_mask_loop)
+    assemble_loop = njit(assemble_min_error_img_loop)
+
+    def numba_kernels():
+        mask = np.empty_like(dist1, dtype=np.byte)
+        mask_loop(height, width, dist1, dist2, mask, weight1, weight2)
+        out = np.empty_like(a)
+        assemble_loop(height, width, a, b, mask, out)
+        return out
+
+    def vectorised_kernels():
+        return assemble_min_error_img(a, b, g_error_mask(dist1, dist2, weight1, weight2))
+
+    results = {}
+    for name, kernels in (("numba", numba_kernels), ("vectorised", vectorised_kernels)):
+        start = time()
+        out = kernels()
+        results[f"{name}_cold"] = time() - start
+        start = time()
+        for _ in range(repeats):
+            kernels()
+        results[f"{name}_warm"] = (time() - start) / repeats
+        print(f"Blending kernels {name}: cold start {results[f'{name}_cold']:.4f} s, warm {results[f'{name}_warm'] * 1000:.2f} ms per frame")
+        results[f"{name}_out"] = out
+    assert np.array_equal(results.pop("numba_out"), results.pop("vectorised_out"))
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark of ebsynth blending kernels against numba kernels")
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    benchmark(args.height, args.width, args.repeats)
@@ -0,0 +1,103 @@
+import os
+import json
+import shutil
+import hashlib
+
+
+# Max size of cached keyframes in Mb, can be changed by env before start application
+KEYFRAME_CACHE_LIMIT_ENV = "WUNJO_KEYFRAME_CACHE_LIMIT"
+DEFAULT_KEYFRAME_CACHE_LIMIT = 2048  # Mb
+
+
+def _get_cache_limit() -> int:
+    try:
+        return int(float(os.environ.get(KEYFRAME_CACHE_LIMIT_ENV, DEFAULT_KEYFRAME_CACHE_LIMIT)) * 1024 ** 2)
+    except ValueError:
+        print(f"Error... {KEYFRAME_CACHE_LIMIT_ENV} has to be number in Mb, used default {DEFAULT_KEYFRAME_CACHE_LIMIT} Mb")
+        return DEFAULT_KEYFRAME_CACHE_LIMIT * 1024 ** 2
+
+
+def file_hash(file_path: str) -> str:
+    sha = hashlib.sha1()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class KeyframeCache:
+    """
+    Content addressed cache of stylized keyframes. Keyframes of one mask are rendered as chain, each keyframe uses
+    previous result and style of first keyframe, so cache entry is the whole chain of mask keyed by render params
+    and content of every keyframe and mask frame
+    """
+    def __init__(self, cache_dir: str, limit: int = None):
+        """
+        Initialization
+        :param cache_dir: cache folder
+        :param limit: max size of cache in bytes, if None read from env
+        """
+        self.cache_dir = cache_dir
+        self.limit = limit if limit is not None else _get_cache_limit()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(params: dict, frame_files: list, frame_path: str, mask_path: str) -> str:
+        """
+        Create key of keyframe chain
+        :param params: render params: prompts, seed, models, control, strengths, ddim steps
+        :param frame_files: keyframe names in render order
+        :param frame_path: folder of frames which are input of render
+        :param mask_path: folder of mask frames
+        :return: key
+        """
+        sha = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode())
+        for frame_file in frame_files:
+            sha.update(frame_file.encode())
+            sha.update(file_hash(os.path.join(frame_path, frame_file)).encode())
+            sha.update(file_hash(os.path.join(mask_path, frame_file)).encode())
+        return sha.hexdigest()
+
+    def restore(self, key: str, frame_files: list, output_folders: list) -> bool:
+        """
+        Copy cached keyframes to output folders
+        :param key: key of chain
+        :param frame_files: keyframe names
+        :param output_folders: folders where render saves keyframes
+        :return: True if all keyframes are in cache and copied
+        """
+        key_dir = os.path.join(self.cache_dir, key)
+        if not all(os.path.isfile(os.path.join(key_dir, frame_file)) for frame_file in frame_files):
+            return False
+        for frame_file in frame_files:
+            for output_folder in output_folders:
+                shutil.copyfile(os.path.join(key_dir, frame_file), os.path.join(output_folder, frame_file))
+        os.utime(key_dir)  # recently used
+        return True
+
+    def put(self, key: str, frame_file: str, image) -> None:
+        """
+        Save keyframe, chain is used only when all its keyframes are saved
+        :param key: key of chain
+        :param frame_file: keyframe name
+        :param image: PIL image of stylized keyframe
+        :return: None
+        """
+        key_dir = os.path.join(self.cache_dir, key)
+        os.makedirs(key_dir, exist_ok=True)
+        image.save(os.path.join(key_dir, frame_file))
+
+    def evict(self) -> None:
+        """Remove least recently used chains while cache is larger than limit"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            key_dir = os.path.join(self.cache_dir, name)
+            if os.path.isdir(key_dir):
+                size = sum(os.path.getsize(os.path.join(key_dir, f)) for f in os.listdir(key_dir))
+                entries.append((os.path.getmtime(key_dir), size, key_dir))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key_dir in sorted(entries):
+            if total <= self.limit:
+                break
+            shutil.rmtree(key_dir, ignore_errors=True)
+            total -= size
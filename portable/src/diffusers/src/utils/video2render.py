@@ -16,6 +16,7 @@ from .config import RenderConfig
 from .ddim_v_hacked import DDIMVSampler
 from .freeu import freeu_forward
 from .controller import AttentionControl
+from .keyframe_cache import KeyframeCache
 
 from diffusers.src.controlnet.annotator.canny import CannyDetector
 from diffusers.src.controlnet.annotator.hed import HEDdetector
@@ -55,8 +56,7 @@ def numpy2tensor(img):
     return einops.rearrange(x0, 'b h w c -> b c h w').clone()
 
 
-def render(cfg: RenderConfig, args, masks, frame_files_with_interval, sd_model_path, controlnet_model_path, vae_model_path,
-           gmflow_model_path, frame_path, mask_path):
+def load_render_models(cfg: RenderConfig, sd_model_path, controlnet_model_path, vae_model_path, gmflow_model_path):
     # Load models
     if cfg.control_type == 'hed':
         detector = HEDdetector()
@@ -115,6 +115,30 @@ def render(cfg: RenderConfig, args, masks, frame_files_with_interval, sd_model_p
     weights = checkpoint['model'] if 'model' in checkpoint else checkpoint
     flow_model.load_state_dict(weights, strict=False)
     flow_model.eval()
+    return detector, model, ddim_v_sampler, flow_model
+
+
+def get_keyframe_params(cfg: RenderConfig, sd_model_path, controlnet_model_path, vae_model_path, prompt, n_prompt,
+                        seed, x0_strength, scale, ddim_steps, eta) -> dict:
+    """Params which change stylized keyframes, used as part of keyframe cache key"""
+    return {
+        "prompt": prompt, "n_prompt": n_prompt, "seed": seed, "x0_strength": x0_strength, "scale": scale,
+        "ddim_steps": ddim_steps, "eta": eta, "sd_model": os.path.basename(str(sd_model_path)),
+        "controlnet_model": os.path.basename(str(controlnet_model_path)), "vae_model": os.path.basename(str(vae_model_path)),
+        "control_type": cfg.control_type, "control_strength": cfg.control_strength, "canny_low": cfg.canny_low,
+        "canny_high": cfg.canny_high, "loose_cfattn": cfg.loose_cfattn, "freeu_args": cfg.freeu_args,
+        "style_update_freq": cfg.style_update_freq, "mask_strength": cfg.mask_strength, "color_preserve": cfg.color_preserve,
+        "mask_period": cfg.mask_period, "inner_strength": cfg.inner_strength, "cross_period": cfg.cross_period,
+        "ada_period": cfg.ada_period, "warp_period": cfg.warp_period
+    }
+
+
+def render(cfg: RenderConfig, args, masks, frame_files_with_interval, sd_model_path, controlnet_model_path, vae_model_path,
+           gmflow_model_path, frame_path, mask_path, cache_dir=None):
+    # models are loaded only if some keyframes are not in cache
+    models = None
+    detector = model = ddim_v_sampler = flow_model = None
+    keyframe_cache = KeyframeCache(cache_dir) if cache_dir is not None else None
 
     num_samples = 1
     ddim_steps = 20
@@ -144,9 +168,21 @@ def render(cfg: RenderConfig, args, masks, frame_files_with_interval, sd_model_p
         scale = float(masks[mask_id]["input_scale"])
 
         seed = int(masks[mask_id]["input_seed"])
+        cache_key = None
+        if keyframe_cache is not None and seed != -1 and prompt != "pass" and common_mask_files:
+            params = get_keyframe_params(cfg, sd_model_path, controlnet_model_path, vae_model_path, prompt, n_prompt,
+                                         seed, x0_strength, scale, ddim_steps, eta)
+            cache_key = keyframe_cache.make_key(params, common_mask_files, frame_path, os.path.join(mask_path, f"mask_{mask_id}"))
+            if keyframe_cache.restore(cache_key, common_mask_files, [cfg.key_subdir, frame_path]):
+                print(f"Keyframes of {mask_id} are not changed and restored from cache")
+                continue
         if seed == -1:
             seed = random.randint(0, 65535)
 
+        if models is None:
+            models = load_render_models(cfg, sd_model_path, controlnet_model_path, vae_model_path, gmflow_model_path)
+        detector, model, ddim_v_sampler, flow_model = models
+
         with torch.no_grad():
             first_frame_file = os.path.join(frame_path, common_mask_files[0])
             frame = cv2.imread(first_frame_file)
@@ -330,7 +366,12 @@ def render(cfg: RenderConfig, args, masks, frame_files_with_interval, sd_model_p
 
             pil_created_image.save(os.path.join(cfg.key_subdir, common_frame_name))
             pil_created_image.save(os.path.join(frame_path, common_frame_name))
+            if cache_key is not None:
+                keyframe_cache.put(cache_key, common_frame_name, pil_created_image)
+
+    if keyframe_cache is not None:
+        keyframe_cache.evict()
 
     # empty cache
-    del model, ddim_v_sampler, flow_model, checkpoint, weights, controller
+    del models, detector, model, ddim_v_sampler, flow_model, controller
     torch.cuda.empty_cache()
\ No newline at end of file
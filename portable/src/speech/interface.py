@@ -1,4 +1,5 @@
 import os
+import io
 import sys
 import uuid
 from time import time
@@ -62,6 +63,31 @@ class TextToSpeech:
         return results
 
 
+class TextToSpeechStream:
+    """
+    Text to speech with stream of audio chunks
+    """
+    @staticmethod
+    def get_stream_audio(text, model, audio_format="wav", **options):
+        """
+        Generator of encoded audio, first chunk is ready after first sentence is vocoded
+        :param text: text
+        :param model: synthesizer
+        :param audio_format: wav or pcm
+        :param options: rate, pitch and volume
+        :return: generator of bytes
+        """
+        download_ntlk()  # inspect what ntlk downloaded
+
+        start = time()
+        first_audio = 1 if audio_format == "wav" else 0  # wav stream starts by header
+        for n, chunk in enumerate(model.stream(text, audio_format=audio_format, **options)):
+            yield chunk
+            if n == first_audio:
+                print(f"Time to first audio {round(time() - start, 3)} s")
+        print(f"Stream synthesis time {round(time() - start, 3)} s")
+
+
 class VoiceCloneTranslate:
     """
     Real time voice clone and translate
@@ -95,35 +121,41 @@ class VoiceCloneTranslate:
 
     @staticmethod
     def get_models_results(audio_file, text, encoder, synthesizer, signature, vocoder, save_folder, tts_model_name, **options):
-        from speech.rtvc_models import clone_voice_rtvc
+        import soundfile
+        from speech.rtvc_models import clone_voice_rtvc_audio
 
         if not os.path.exists(save_folder):
             os.makedirs(save_folder)
 
         start = time()
 
-        clone_voice_rtvc(audio_file, text, encoder, synthesizer, vocoder, save_folder)
-
-        output_name = str(uuid.uuid4()) + ".wav"
-        output_file = VoiceCloneTranslate.merge_audio_parts(save_folder, "rtvc_output_part", output_name)
+        # audio parts are trimmed, merged and signed in memory, result is written once
+        audio_parts = clone_voice_rtvc_audio(audio_file, text, encoder, synthesizer, vocoder)
+        if not audio_parts:
+            raise ValueError("Voice clone did not generate audio")
+        sample_rate = synthesizer.sample_rate
+        audio = VoiceCloneTranslate.merge_audio(audio_parts)
 
         end = time()
 
-        with open(output_file, "rb") as f:
-            audio_bytes = f.read()
-
         try:
-            output_file_signature = signature.set_encrypted(output_file, save_folder)
-            if output_file_signature is not None:
-                os.remove(output_file)
-                output_file = output_file_signature
+            audio_signature = signature.encrypted_signal(audio, sample_rate, show_progress=True)
+            if audio_signature is not None:
+                audio, sample_rate = audio_signature, signature.sample_rate
         except Exception as err:
             print(f"Error...during set signature {err}")
 
+        output_file = os.path.join(save_folder, str(uuid.uuid4()) + ".wav")
+        buffer = io.BytesIO()
+        soundfile.write(buffer, audio, sample_rate, format="WAV")
+        audio_bytes = buffer.getvalue()
+        with open(output_file, "wb") as f:
+            f.write(audio_bytes)
+
         result = {
             "voice": tts_model_name,
-            "sample_rate": 0,
-            "duration_s": 0,
+            "sample_rate": sample_rate,
+            "duration_s": round(len(audio) / sample_rate, 3),
             "synthesis_time": round(end - start, 3),
             "filename": output_file,
             "response_audio": audio_bytes
@@ -131,6 +163,22 @@ class VoiceCloneTranslate:
 
         return result
 
+    @staticmethod
+    def merge_audio(audio_parts: list):
+        """
+        Trim silence of voice clone parts and concatenate them
+        :param audio_parts: list of audio with the same sample rate
+        :return: merged audio
+        """
+        import librosa
+        import numpy as np
+
+        trimmed_parts = []
+        for audio in audio_parts:
+            audio_trim, _ = librosa.effects.trim(np.asarray(audio, dtype=np.float32))  # Default top_db=60 as for files
+            trimmed_parts.append(audio_trim)
+        return np.concatenate(trimmed_parts)
+
     @staticmethod
     def merge_audio_parts(audio_folder: str, audio_part_name: str, output_file_name: str):
         """
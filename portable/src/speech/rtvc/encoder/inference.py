@@ -35,6 +35,7 @@ class VoiceCloneEncoder:
         If None, will default to your GPU if it"s available, otherwise your CPU.
         """
         self._device = torch.device(device)
+        self.weights_fpath = weights_fpath
         self._model = SpeakerEncoder(self._device, torch.device("cpu"))
         checkpoint = torch.load(weights_fpath, self._device)
         self._model.load_state_dict(checkpoint["model_state"])
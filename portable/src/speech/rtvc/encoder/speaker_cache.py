@@ -0,0 +1,160 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Number of speaker embeddings kept in memory and saving of embeddings on disk,
+# can be changed by env before start application
+SPEAKER_CACHE_SIZE_ENV = "WUNJO_SPEAKER_CACHE_SIZE"
+SPEAKER_CACHE_DISK_ENV = "WUNJO_SPEAKER_CACHE_DISK"
+DEFAULT_SPEAKER_CACHE_SIZE = 64
+
+
+def _get_cache_size() -> int:
+    try:
+        return max(1, int(os.environ.get(SPEAKER_CACHE_SIZE_ENV, DEFAULT_SPEAKER_CACHE_SIZE)))
+    except ValueError:
+        print(f"Error... {SPEAKER_CACHE_SIZE_ENV} has to be integer, used default {DEFAULT_SPEAKER_CACHE_SIZE}")
+        return DEFAULT_SPEAKER_CACHE_SIZE
+
+
+def get_audio_hash(audio) -> str:
+    """
+    Content hash of reference audio, file is hashed by bytes without decoding
+    :param audio: path to audio file or numpy array of preprocessed audio
+    :return: hash
+    """
+    sha = hashlib.sha1()
+    if isinstance(audio, np.ndarray):
+        sha.update(str(audio.dtype).encode())
+        sha.update(np.ascontiguousarray(audio).tobytes())
+    else:
+        with open(str(audio), "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+class SpeakerEmbeddingCache:
+    """
+    Speaker embeddings of reference audio keyed by encoder and content hash of audio. Embeddings keep in memory
+    with LRU eviction and can be saved on disk as .npy, named speakers can be registered to use them by name
+    """
+    def __init__(self, max_size: int = None, folder: str = None, persist: bool = None):
+        """
+        Initialization
+        :param max_size: max number of embeddings in memory, if None read from env
+        :param folder: folder for .npy embeddings and named speakers
+        :param persist: save embeddings of audio on disk, if None read from env, named speakers are saved always
+        """
+        self.max_size = max_size or _get_cache_size()
+        self.folder = folder
+        self.persist = persist if persist is not None else os.environ.get(SPEAKER_CACHE_DISK_ENV, "0") in ("1", "true", "True")
+        self.embeddings = OrderedDict()  # key: embedding
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(encoder_id: str, audio_hash: str) -> str:
+        return f"{encoder_id}_{audio_hash}"
+
+    @staticmethod
+    def get_encoder_id(encoder) -> str:
+        """
+        Id of encoder weights, embeddings of different encoders are not compatible
+        :param encoder: VoiceCloneEncoder
+        :return: short id
+        """
+        weights = os.path.abspath(str(getattr(encoder, "weights_fpath", "")))
+        return hashlib.sha1(weights.encode()).hexdigest()[:12]
+
+    def _path(self, name: str):
+        if self.folder is None:
+            return None
+        return os.path.join(self.folder, re.sub(r"[^\w\-]", "_", name) + ".npy")
+
+    def get(self, key: str):
+        """
+        Get embedding from memory or disk
+        :param key: key
+        :return: embedding or None
+        """
+        with self.lock:
+            if key in self.embeddings:
+                self.embeddings.move_to_end(key)
+                return self.embeddings[key]
+        path = self._path(key)
+        if path is not None and os.path.exists(path):
+            embedding = np.load(path)
+            self.put(key, embedding, save=False)
+            return embedding
+        return None
+
+    def put(self, key: str, embedding, save: bool = None) -> None:
+        """
+        Keep embedding in memory and on disk if persist is set
+        :param key: key
+        :param embedding: embedding
+        :param save: save on disk, if None use persist
+        :return: None
+        """
+        with self.lock:
+            self.embeddings[key] = embedding
+            self.embeddings.move_to_end(key)
+            while len(self.embeddings) > self.max_size:
+                self.embeddings.popitem(last=False)
+        save = self.persist if save is None else save
+        path = self._path(key)
+        if save and path is not None:
+            os.makedirs(self.folder, exist_ok=True)
+            np.save(path, embedding)
+
+    def get_embedding(self, audio, encoder, synthesizer):
+        """
+        Get speaker embedding of reference audio, audio is decoded and encoded only if embedding is not cached
+        :param audio: path to audio file, numpy array of preprocessed audio or name of registered speaker
+        :param encoder: VoiceCloneEncoder
+        :param synthesizer: rtvc Synthesizer to preprocess audio
+        :return: embedding
+        """
+        encoder_id = self.get_encoder_id(encoder)
+        if isinstance(audio, str) and not os.path.isfile(audio):
+            embedding = self.get(self.make_key(encoder_id, "speaker_" + audio))
+            if embedding is None:
+                raise FileNotFoundError(f"Reference audio or registered speaker {audio} not found")
+            print(f"Use registered speaker {audio}")
+            return embedding
+
+        key = self.make_key(encoder_id, get_audio_hash(audio))
+        embedding = self.get(key)
+        if embedding is not None:
+            print("Use cached speaker embedding")
+            return embedding
+
+        wav = audio if isinstance(audio, np.ndarray) else synthesizer.load_preprocess_wav(str(audio))
+        print("Loaded audio successfully")
+        embedding = encoder.embed_utterance(wav, using_partials=False)
+        self.put(key, embedding)
+        return embedding
+
+    def register(self, name: str, audio, encoder, synthesizer):
+        """
+        Register named speaker, embedding is saved on disk and can be used by name instead of audio
+        :param name: speaker name
+        :param audio: path to audio file or numpy array of preprocessed audio
+        :param encoder: VoiceCloneEncoder
+        :param synthesizer: rtvc Synthesizer to preprocess audio
+        :return: embedding
+        """
+        embedding = self.get_embedding(audio, encoder, synthesizer)
+        self.put(self.make_key(self.get_encoder_id(encoder), "speaker_" + name), embedding, save=True)
+        print(f"Speaker {name} is registered")
+        return embedding
+
+    def clear(self) -> None:
+        """Remove embeddings from memory, files on disk are kept"""
+        with self.lock:
+            self.embeddings.clear()
@@ -85,49 +85,88 @@ class Synthesizer:
         # Mappings from symbol to numeric ID and vice versa:
         _symbol_to_id = {s: i for i, s in enumerate(self.text_handler.voice_clone_symbols)}
 
-        spectrograms = []
+        # gather phrases of all units to synthesize them in padded batches
+        texts = []
         for unit in sequence_generator:
             if isinstance(unit, ssml.Pause):
                 continue
-            else:
-                unit_value = self.text_handler.check_eos(unit.value)
-                phrases = self.split_into_phrases(unit_value)
-                for phrase in phrases:
-                    print(phrase)
-                    phrase = [text_to_sequence(phrase.replace("~", ""), hparams.tts_cleaner_names, _symbol_to_id)]
-                    batched_inputs = [phrase[i:i + hparams.synthesis_batch_size] for i in range(0, len(phrase), hparams.synthesis_batch_size)]
-                    batched_embeds = [embeddings[i:i + hparams.synthesis_batch_size] for i in range(0, len(embeddings), hparams.synthesis_batch_size)]
-                    for i, batch in enumerate(batched_inputs, 1):
-                        if self.verbose:
-                            print(f"\n| Generating {i}/{len(batched_inputs)}")
-
-                        # Pad texts so they are all the same length
-                        text_lens = [len(text) for text in batch]
-                        max_text_len = max(text_lens)
-                        chars = [self.pad1d(text, max_text_len) for text in batch]
-                        chars = np.stack(chars)
-
-                        # Stack speaker embeddings into 2D array for batch processing
-                        speaker_embeds = np.stack(batched_embeds[i - 1])
-
-                        # Convert to tensor
-                        chars = torch.tensor(chars).long().to(self.device)
-                        speaker_embeddings = torch.tensor(speaker_embeds).float().to(self.device)
-
-                        # Inference
-                        _, mels, alignments = self._model.generate(chars, speaker_embeddings)
-                        mels = mels.detach().cpu().numpy()
-                        for m in mels:
-                            # Trim silence from end of each spectrogram
-                            while np.max(m[:, -1]) < hparams.tts_stop_threshold:
-                                m = m[:, :-1]
-                            spectrograms.append(m)
+            unit_value = self.text_handler.check_eos(unit.value)
+            for phrase in self.split_into_phrases(unit_value):
+                print(phrase)
+                texts.append(text_to_sequence(phrase.replace("~", ""), hparams.tts_cleaner_names, _symbol_to_id))
+
+        if not texts:
+            return []
+
+        # the same speaker embedding for all phrases if one embedding (256,) or list of one embedding is given
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim == 1:
+            embeddings = embeddings[np.newaxis]
+        if len(embeddings) == 1:
+            embeddings = np.repeat(embeddings, len(texts), axis=0)
+
+        # phrases of similar length in one batch to decrease padding, order is restored after
+        order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]), reverse=True)
+        batch_size = hparams.synthesis_batch_size
+        batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+        spectrograms = [None] * len(texts)
+        for i, batch in enumerate(batches, 1):
+            if self.verbose:
+                print(f"\n| Generating {i}/{len(batches)} with {len(batch)} phrases")
+
+            # Pad texts so they are all the same length
+            max_text_len = max(len(texts[idx]) for idx in batch)
+            chars = np.stack([self.pad1d(texts[idx], max_text_len) for idx in batch])
+
+            # Stack speaker embeddings into 2D array for batch processing
+            speaker_embeds = np.stack([embeddings[idx] for idx in batch])
+
+            # Convert to tensor
+            chars = torch.tensor(chars).long().to(self.device)
+            speaker_embeddings = torch.tensor(speaker_embeds).float().to(self.device)
+
+            # Inference
+            _, mels, alignments, stops = self._model.generate(chars, speaker_embeddings)
+            mels = mels.detach().cpu().numpy()
+            stops = stops.detach().cpu().numpy()
+            for idx, m, stop in zip(batch, mels, stops):
+                # batch is decoded until all items stop, frames of item after own stop are not speech
+                spectrograms[idx] = self.trim_spectrogram(self.cut_at_stop(m, stop))
         return spectrograms
 
+    @staticmethod
+    def cut_at_stop(mel, stop):
+        """
+        Cut spectrogram at first frame where stop token exceeds threshold
+        :param mel: spectrogram (num_mels, frames)
+        :param stop: stop tokens (frames,)
+        :return: spectrogram
+        """
+        stop_frames = np.flatnonzero(stop[:mel.shape[1]] > 0.5)
+        if len(stop_frames) == 0:
+            return mel
+        return mel[:, :stop_frames[0] + 1]
+
+    @staticmethod
+    def trim_spectrogram(mel):
+        """
+        Trim silence from end of spectrogram, batch items which stopped before longest item end by silence
+        :param mel: spectrogram (num_mels, frames)
+        :return: spectrogram
+        """
+        frames = mel.shape[1]
+        while frames > 1 and np.max(mel[:, frames - 1]) < hparams.tts_stop_threshold:
+            frames -= 1
+        return mel[:, :frames]
+
     def synthesize(self,vocoder, text: str, embeddings: Union[np.ndarray, List[np.ndarray]], return_alignments=False):
         audio_list = self.synthesize_spectrograms(text=text, embeddings=embeddings)
-        for audio in audio_list:
-            yield vocoder.infer_waveform(audio)
+        if not audio_list:
+            return
+        # all phrases are vocoded in one batched loop
+        for wav in vocoder.infer_waveforms(audio_list):
+            yield wav
 
 
     def save(self, audio, path, name, prefix=None):
@@ -473,7 +473,7 @@ class Tacotron(nn.Module):
 
         self.train()
 
-        return mel_outputs, linear, attn_scores
+        return mel_outputs, linear, attn_scores, stop_outputs
 
     def init_model(self):
         for p in self.parameters():
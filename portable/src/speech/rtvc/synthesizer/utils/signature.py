@@ -1,5 +1,6 @@
 import os
 import uuid
+from time import time
 from tqdm import tqdm
 import torch
 import torch.nn as nn
@@ -9,6 +10,24 @@ import soundfile
 import librosa
 
 
+# Number of audio chunks encoded in one forward, can be changed by env before start application
+SIGNATURE_BATCH_ENV = "WUNJO_SIGNATURE_BATCH"
+
+
+def get_signature_batch_size(device) -> int:
+    """
+    Get number of chunks in batch
+    :param device: cuda or cpu
+    :return: batch size
+    """
+    default = 32 if "cuda" in str(device) else 8
+    try:
+        return max(1, int(os.environ.get(SIGNATURE_BATCH_ENV, default)))
+    except ValueError:
+        print(f"Error... {SIGNATURE_BATCH_ENV} has to be integer, used default {default}")
+        return default
+
+
 class ResidualDenseBlock_out(nn.Module):
     def __init__(self, in_channel, out_channel, bias=True):
         super(ResidualDenseBlock_out, self).__init__()
@@ -206,6 +225,86 @@ class DigitalSignature:
         ratio = max(1e-10, ratio)
         return 10 * np.log10(ratio)
 
+    @staticmethod
+    def signal_noise_ratios(original, signal_digital_signature):
+        """
+        Compute the Signal to Noise Ratio (SNR) for each row of chunks
+        :param original: original chunks (N, length)
+        :param signal_digital_signature: digital chunks (N, length)
+        :return: SNR for each chunk
+        """
+        noise_strength = np.sum((original - signal_digital_signature) ** 2, axis=1)
+        signal_strength = np.sum(original ** 2, axis=1)
+        with np.errstate(divide="ignore"):
+            ratio = np.maximum(1e-10, signal_strength / np.maximum(noise_strength, 1e-30))
+            snr = 10 * np.log10(ratio)
+        snr[noise_strength == 0] = np.inf
+        return snr
+
+    def encode_truncks(self, truncks, wm, device, batch_size):
+        """
+        Encode several trunks of the same length with digital information.
+        :param truncks: The audio signal trunks (N, length).
+        :param wm: Digital signature.
+        :param device: The computing device (cpu or gpu).
+        :param batch_size: Number of trunks in one forward.
+        :return: The digital signal trunks (N, length).
+        """
+        length = truncks.shape[1]
+        signal_wmd = np.empty_like(truncks)
+        with torch.no_grad():
+            message = torch.FloatTensor(np.array(wm)).to(device)[None]
+            for start in range(0, len(truncks), batch_size):
+                signal = torch.from_numpy(np.ascontiguousarray(truncks[start:start + batch_size], dtype=np.float32)).to(device)
+                wmd = self.model.encode(signal, message.expand(len(signal), -1)).cpu().numpy()
+                if wmd.shape[1] != length:
+                    print("Warning: length not equal:", length, wmd.shape[1])
+                    wmd = np.pad(wmd[:, :length], ((0, 0), (0, max(0, length - wmd.shape[1]))))
+                signal_wmd[start:start + batch_size] = wmd
+        return signal_wmd
+
+    def encode_truncks_with_snr_check(self, truncks, wm, device, min_snr, max_snr, batch_size, progress=None):
+        """
+        Batched version of encode_trunck_with_snr_check. All trunks are encoded together,
+        only trunks which SNR is still too high are encoded again in the next pass.
+        :param truncks: The original audio signal trunks (N, length).
+        :param wm: Digital signature.
+        :param device: The computing device (cpu or gpu).
+        :param min_snr: Minimum acceptable SNR value.
+        :param max_snr: Maximum acceptable SNR value.
+        :param batch_size: Number of trunks in one forward.
+        :param progress: tqdm progress bar or None
+        :return: The digital signal trunks, original trunks are kept if encoding was skipped.
+        """
+        output = truncks.copy()
+        signal_for_encode = truncks
+        active = np.arange(len(truncks))
+        encode_times = 0
+        while len(active) > 0:
+            encode_times += 1
+            signal_wmd = self.encode_truncks(signal_for_encode, wm, device, batch_size)
+            snr = self.signal_noise_ratios(truncks[active], signal_wmd)
+
+            keep = np.ones(len(active), dtype=bool)
+            if encode_times == 1:
+                skip = snr < min_snr
+                for idx in active[skip]:
+                    print("skip section:%d, snr too low:%.1f" % (idx, min_snr))
+                keep &= ~skip
+
+            output[active[keep]] = signal_wmd[keep]
+            # snr is too high, encode again
+            keep &= snr >= max_snr
+            if progress is not None:
+                progress.update(len(active) if encode_times > 10 else len(active) - int(np.sum(keep)))
+
+            if encode_times > 10:
+                break
+            active = active[keep]
+            signal_for_encode = signal_wmd[keep]
+
+        return output
+
     def encode_trunck_with_snr_check(self, idx_trunck, signal, wm, device, min_snr, max_snr):
         """
         Encode the signal trunk and check the signal to noise ratio (SNR) to ensure quality.
@@ -250,7 +349,8 @@ class DigitalSignature:
             signal_wmd = signal_wmd_tensor.detach().cpu().numpy().squeeze()
             return signal_wmd
 
-    def set_digital_signature(self, bit_arr, data, num_point, shift_range, device, min_snr, max_snr, show_progress):
+    def set_digital_signature(self, bit_arr, data, num_point, shift_range, device, min_snr, max_snr, show_progress,
+                              batch_size=None):
         """
         Embeds the digital signature into the audio data.
         :param bit_arr: The digital signature bits.
@@ -261,6 +361,36 @@ class DigitalSignature:
         :param min_snr: Minimum acceptable SNR value.
         :param max_snr: Maximum acceptable SNR value.
         :param show_progress: Whether to show progress while processing.
+        :param batch_size: Number of chunks encoded in one forward, if None read from env.
+        :return: The digital signature audio data.
+        """
+        chunk_size = num_point + int(num_point * shift_range)
+        num_segments = int(len(data) / chunk_size)
+        assert num_segments > 0
+        batch_size = batch_size or get_signature_batch_size(device)
+
+        start = time()
+        output = np.array(data, copy=True)
+        # cover areas of all chunks, shift areas are kept as is
+        chunks = output[:num_segments * chunk_size].reshape(num_segments, chunk_size)
+        cover_areas = np.ascontiguousarray(chunks[:, :num_point])
+
+        progress = tqdm(total=num_segments, desc="Processing") if show_progress else None
+        chunks[:, :num_point] = self.encode_truncks_with_snr_check(
+            cover_areas, bit_arr, device, min_snr, max_snr, batch_size, progress
+        )
+        if progress is not None:
+            progress.close()
+
+        elapsed = time() - start
+        print(f"Digital signature: {num_segments} chunks, {num_segments / max(elapsed, 1e-6):.1f} chunks/s")
+        return output
+
+    def set_digital_signature_sequential(self, bit_arr, data, num_point, shift_range, device, min_snr, max_snr,
+                                         show_progress):
+        """
+        Embeds the digital signature chunk by chunk, used to compare speed with batched version.
+        Arguments are the same as in set_digital_signature.
         :return: The digital signature audio data.
         """
         chunk_size = num_point + int(num_point * shift_range)
@@ -342,6 +472,21 @@ class DigitalSignature:
             wave = librosa.resample(y=wave, orig_sr=sr, target_sr=aim_sr)
         return wave
 
+    def encrypted_signal(self, signal, sr, show_progress=False):
+        """
+        Set digital signature on audio in memory
+        :param signal: mono audio
+        :param sr: sample rate of audio
+        :param show_progress: Whether to show progress while processing.
+        :return: digital signature audio with sample rate of signature or None if audio is too short
+        """
+        if len(signal) / sr <= 1.0:
+            print(f"The audio length is less than or equal to 1 second.")
+            return None
+        if sr != self.sample_rate:
+            signal = librosa.resample(y=signal, orig_sr=sr, target_sr=self.sample_rate)
+        return self.encrypted_audio(signal=signal, show_progress=show_progress)
+
     def set_encrypted(self, audio_path, save_path):
         """Set encrypted"""
         file_name = str(uuid.uuid4()) + '.wav'
@@ -352,3 +497,44 @@ class DigitalSignature:
         digital_signal = self.encrypted_audio(signal=signal, show_progress=True)
         soundfile.write(save_file, digital_signal, self.sample_rate)
         return save_file
+
+
+def benchmark(model_path, audio_path, device="cpu", batch_size=None):
+    """
+    Chunks per second of sequential and batched digital signature
+    :param model_path: path to signature model
+    :param audio_path: path to audio
+    :param device: cuda or cpu
+    :param batch_size: batch size of batched mode
+    :return: dict with chunks per second for each mode
+    """
+    signature = DigitalSignature(model_path, device=device)
+    signal = signature.read_as_single_channel(audio_path, aim_sr=signature.sample_rate)
+    if signal is None:
+        return {}
+    num_point = signature.sample_rate
+    num_segments = int(len(signal) / (num_point + int(num_point * 0.1)))
+    bit_arr = np.random.randint(0, 2, 32)
+    results = {}
+    for mode in ("sequential", "batched"):
+        start = time()
+        if mode == "batched":
+            signature.set_digital_signature(bit_arr, signal, num_point, 0.1, device, 20, 38, False, batch_size)
+        else:
+            signature.set_digital_signature_sequential(bit_arr, signal, num_point, 0.1, device, 20, 38, False)
+        results[mode] = num_segments / (time() - start)
+        print(f"Digital signature {mode}: {results[mode]:.2f} chunks/s")
+    print(f"Speedup of batched mode: {results['batched'] / results['sequential']:.2f}x")
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Chunks per second benchmark of audio digital signature")
+    parser.add_argument("model", help="path to signature model")
+    parser.add_argument("audio", help="path to audio longer than 1 second")
+    parser.add_argument("--device", default="cuda" if os.environ.get('WUNJO_TORCH_DEVICE', 'cpu') != 'cpu' else "cpu")
+    parser.add_argument("--batch_size", type=int, default=None)
+    args = parser.parse_args()
+    benchmark(args.model, args.audio, args.device, args.batch_size)
@@ -10,6 +10,7 @@ from speech.rtvc.vocoder import hparams as hp
 sys.path.pop(0)
 
 import torch
+import numpy as np
 
 
 class VoiceCloneVocoder:
@@ -71,3 +72,80 @@ class VoiceCloneVocoder:
         mel = torch.from_numpy(mel[None, ...])
         wav = self._model.generate(mel, batched, target, overlap, hp.mu_law, progress_callback)
         return wav
+
+    def infer_waveforms(self, mels, normalize=True, target=8000, overlap=800, progress_callback=None):
+        """
+        Infers waveforms of several mel spectrograms in one batched loop. Spectrograms are concatenated
+        and folded together, so time depends on total length divided by target, not on number of spectrograms
+
+        :param mels: list of spectrograms (num_mels, frames)
+        :param normalize:
+        :param target:
+        :param overlap:
+        :return: list of waveforms in order of spectrograms
+        """
+        lengths = [mel.shape[1] for mel in mels]
+        wav = self.infer_waveform(np.concatenate(mels, axis=1), normalize, True, target, overlap, progress_callback)
+
+        hop_length = hp.hop_length
+        fade_length = 20 * hop_length
+        wavs = []
+        start = 0
+        for i, length in enumerate(lengths):
+            end = min(start + length * hop_length, len(wav))
+            part = np.array(wav[start:end])
+            # Fade-out at the end of each part as for separate inference, generate already fades out the last part
+            fade = min(fade_length, len(part)) if i < len(lengths) - 1 else 0
+            if fade > 0:
+                part[-fade:] *= np.linspace(1, 0, fade)
+            wavs.append(part)
+            start = end
+        return wavs
+
+
+def benchmark(weights_fpath=None, seconds=5, device="cpu", target=8000, overlap=800):
+    """
+    Samples per second of WaveRNN generation in batched and unbatched modes
+    :param weights_fpath: path to weights, if None random weights are used, speed does not depend on weights
+    :param seconds: duration of generated audio
+    :param device: cuda or cpu
+    :param target: target of batched mode
+    :param overlap: overlap of batched mode
+    :return: dict with samples per second for each mode
+    """
+    import time
+
+    vocoder = VoiceCloneVocoder()
+    if weights_fpath is not None:
+        vocoder.load_model(weights_fpath, verbose=False, device=device)
+    else:
+        vocoder._model = WaveRNN(
+            rnn_dims=hp.voc_rnn_dims, fc_dims=hp.voc_fc_dims, bits=hp.bits, pad=hp.voc_pad,
+            upsample_factors=hp.voc_upsample_factors, feat_dims=hp.num_mels, compute_dims=hp.voc_compute_dims,
+            res_out_dims=hp.voc_res_out_dims, res_blocks=hp.voc_res_blocks, hop_length=hp.hop_length,
+            sample_rate=hp.sample_rate, mode=hp.voc_mode
+        ).to(device).eval()
+
+    frames = int(seconds * hp.sample_rate / hp.hop_length)
+    mel = np.random.rand(hp.num_mels, frames).astype(np.float32) * hp.mel_max_abs_value
+    results = {}
+    for batched in (True, False):
+        start = time.time()
+        wav = vocoder.infer_waveform(mel, batched=batched, target=target, overlap=overlap,
+                                     progress_callback=lambda *args: None)
+        elapsed = time.time() - start
+        mode = "batched" if batched else "unbatched"
+        results[mode] = len(wav) / elapsed
+        print(f"WaveRNN {mode}: {len(wav)} samples in {elapsed:.2f} s, {results[mode]:.0f} samples/s")
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Samples per second benchmark of WaveRNN vocoder")
+    parser.add_argument("--weights", default=None, help="path to vocoder weights")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--device", default="cuda" if os.environ.get('WUNJO_TORCH_DEVICE', 'cpu') != 'cpu' else "cpu")
+    args = parser.parse_args()
+    benchmark(args.weights, args.seconds, args.device)
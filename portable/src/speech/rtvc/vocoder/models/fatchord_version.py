@@ -14,6 +14,54 @@ from speech.rtvc.vocoder.audio import *
 sys.path.pop(0)
 
 
+# Use TorchScript for step of generation, can be changed by env before start application
+WAVERNN_JIT_ENV = "WUNJO_WAVERNN_JIT"
+_wavernn_step_jit = None
+
+
+def _gru_step(gi, gh, h):
+    i_r, i_z, i_n = gi.chunk(3, 1)
+    h_r, h_z, h_n = gh.chunk(3, 1)
+    r = torch.sigmoid(i_r + h_r)
+    z = torch.sigmoid(i_z + h_z)
+    n = torch.tanh(i_n + r * h_n)
+    return (1. - z) * n + z * h
+
+
+def wavernn_step(x, h1, h2, cond_i, cond_gi1, cond_gi2, cond_fc1, cond_fc2,
+                 w_sample, w_sample_gi1, w_hh1, b_hh1, w_ih2, w_hh2, b_hh2, w_fc1, w_fc2, w_fc3, b_fc3):
+    """
+    One sample of WaveRNN, parts of layers which depend on conditioning only are precomputed
+    :param x: previous sample (batch, 1)
+    :return: logits, hidden states of rnn1 and rnn2
+    """
+    x_i = cond_i + x * w_sample
+    h1 = _gru_step(cond_gi1 + x * w_sample_gi1, F.linear(h1, w_hh1, b_hh1), h1)
+    x = x_i + h1
+    h2 = _gru_step(cond_gi2 + F.linear(x, w_ih2), F.linear(h2, w_hh2, b_hh2), h2)
+    x = x + h2
+    x = F.relu(cond_fc1 + F.linear(x, w_fc1))
+    x = F.relu(cond_fc2 + F.linear(x, w_fc2))
+    return F.linear(x, w_fc3, b_fc3), h1, h2
+
+
+def get_wavernn_step():
+    """
+    Step function of generation, TorchScript version if it is enabled by env and can be compiled
+    :return: function
+    """
+    global _wavernn_step_jit
+    if os.environ.get(WAVERNN_JIT_ENV, "0") not in ("1", "true", "True"):
+        return wavernn_step
+    if _wavernn_step_jit is None:
+        try:
+            _wavernn_step_jit = torch.jit.script(wavernn_step)
+        except Exception as err:
+            print(f"Error... TorchScript step of WaveRNN is not compiled, used python version: {err}")
+            _wavernn_step_jit = wavernn_step
+    return _wavernn_step_jit
+
+
 class ResBlock(nn.Module):
     def __init__(self, dims):
         super().__init__()
@@ -121,6 +169,7 @@ class WaveRNN(nn.Module):
         self.fc3 = nn.Linear(fc_dims, self.n_classes)
 
         self.step = nn.Parameter(torch.zeros(1).long(), requires_grad=False)
+        self.gen_chunk_size = 256  # timesteps of conditioning projections computed at once in generate
         self.num_params()
 
     def forward(self, x, mels):
@@ -163,16 +212,12 @@ class WaveRNN(nn.Module):
         progress_callback = progress_callback or self.gen_display
 
         self.eval()
-        output = []
         start = time.time()
-        rnn1 = self.get_gru_cell(self.rnn1)
-        rnn2 = self.get_gru_cell(self.rnn2)
+        device = next(self.parameters()).device  # device is chosen once when model is loaded
+        step_fn = get_wavernn_step()
 
         with torch.no_grad():
-            if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu'):
-                mels = mels.cuda()
-            else:
-                mels = mels.cpu()
+            mels = mels.to(device)
             wave_len = (mels.size(-1) - 1) * self.hop_length
             mels = self.pad_tensor(mels.transpose(1, 2), pad=self.pad, side='both')
             mels, aux = self.upsample(mels.transpose(1, 2))
@@ -183,68 +228,49 @@ class WaveRNN(nn.Module):
 
             b_size, seq_len, _ = mels.size()
 
-            if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu'):
-                h1 = torch.zeros(b_size, self.rnn_dims).cuda()
-                h2 = torch.zeros(b_size, self.rnn_dims).cuda()
-                x = torch.zeros(b_size, 1).cuda()
-            else:
-                h1 = torch.zeros(b_size, self.rnn_dims).cpu()
-                h2 = torch.zeros(b_size, self.rnn_dims).cpu()
-                x = torch.zeros(b_size, 1).cpu()
+            h1 = torch.zeros(b_size, self.rnn_dims, device=device)
+            h2 = torch.zeros(b_size, self.rnn_dims, device=device)
+            x = torch.zeros(b_size, 1, device=device)
+            output = torch.empty(b_size, seq_len, device=device)
 
             d = self.aux_dims
-            aux_split = [aux[:, :, d * i:d * (i + 1)] for i in range(4)]
-
-            for i in range(seq_len):
-
-                m_t = mels[:, i, :]
-
-                a1_t, a2_t, a3_t, a4_t = (a[:, i, :] for a in aux_split)
-
-                x = torch.cat([x, m_t, a1_t], dim=1)
-                x = self.I(x)
-                h1 = rnn1(x, h1)
-
-                x = x + h1
-                inp = torch.cat([x, a2_t], dim=1)
-                h2 = rnn2(inp, h2)
-
-                x = x + h2
-                x = torch.cat([x, a3_t], dim=1)
-                x = F.relu(self.fc1(x))
-
-                x = torch.cat([x, a4_t], dim=1)
-                x = F.relu(self.fc2(x))
-
-                logits = self.fc3(x)
-
-                if self.mode == 'MOL':
-                    sample = sample_from_discretized_mix_logistic(logits.unsqueeze(0).transpose(1, 2))
-                    output.append(sample.view(-1))
-                    if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu'):
-                        # x = torch.FloatTensor([[sample]]).cuda()
-                        x = sample.transpose(0, 1).cuda()
-                    else:
+            a1, a2, a3, a4 = (aux[:, :, d * i:d * (i + 1)] for i in range(4))
+            weights = self.get_step_weights()
+
+            for chunk_start in range(0, seq_len, self.gen_chunk_size):
+                chunk_end = min(chunk_start + self.gen_chunk_size, seq_len)
+                # part of layers which does not depend on samples is computed for chunk of timesteps at once
+                cond_i, cond_gi1, cond_gi2, cond_fc1, cond_fc2 = self.get_step_conditions(
+                    mels[:, chunk_start:chunk_end], a1[:, chunk_start:chunk_end], a2[:, chunk_start:chunk_end],
+                    a3[:, chunk_start:chunk_end], a4[:, chunk_start:chunk_end]
+                )
+
+                for j in range(chunk_end - chunk_start):
+                    i = chunk_start + j
+                    logits, h1, h2 = step_fn(
+                        x, h1, h2, cond_i[:, j], cond_gi1[:, j], cond_gi2[:, j], cond_fc1[:, j], cond_fc2[:, j],
+                        *weights
+                    )
+
+                    if self.mode == 'MOL':
+                        sample = sample_from_discretized_mix_logistic(logits.unsqueeze(0).transpose(1, 2))
+                        output[:, i] = sample.view(-1)
                         x = sample.transpose(0, 1)
+                    elif self.mode == 'RAW':
+                        posterior = F.softmax(logits, dim=1)
+                        sample = 2 * torch.multinomial(posterior, 1).float() / (self.n_classes - 1.) - 1.
+                        output[:, i] = sample.view(-1)
+                        x = sample
+                    else:
+                        raise RuntimeError("Unknown model mode value - ", self.mode)
 
-                elif self.mode == 'RAW' :
-                    posterior = F.softmax(logits, dim=1)
-                    distrib = torch.distributions.Categorical(posterior)
-
-                    sample = 2 * distrib.sample().float() / (self.n_classes - 1.) - 1.
-                    output.append(sample)
-                    x = sample.unsqueeze(-1)
-                else:
-                    raise RuntimeError("Unknown model mode value - ", self.mode)
-
-                if i % 100 == 0:
-                    gen_rate = (i + 1) / (time.time() - start) * b_size / 1000
-                    progress_callback(i, seq_len, b_size, gen_rate)
+                    if i % 100 == 0:
+                        gen_rate = (i + 1) / (time.time() - start) * b_size / 1000
+                        progress_callback(i, seq_len, b_size, gen_rate)
 
-        output = torch.stack(output).transpose(0, 1)
         output = output.cpu().numpy()
         output = output.astype(np.float64)
-        
+
         if batched:
             output = self.xfade_and_unfold(output, target, overlap)
         else:
@@ -259,11 +285,40 @@ class WaveRNN(nn.Module):
         fade_out = np.linspace(1, 0, 20 * self.hop_length)
         output = output[:wave_len]
         output[-20 * self.hop_length:] *= fade_out
-        
+
         self.train()
 
         return output
 
+    def get_step_weights(self):
+        """
+        Weights of recurrent part of step, inputs are split on sample and conditioning parts
+        :return: tuple of tensors in order of wavernn_step arguments
+        """
+        rnn_dims = self.rnn_dims
+        w_sample = self.I.weight[:, 0]
+        return (
+            w_sample,
+            torch.mv(self.rnn1.weight_ih_l0, w_sample),
+            self.rnn1.weight_hh_l0, self.rnn1.bias_hh_l0,
+            self.rnn2.weight_ih_l0[:, :rnn_dims].contiguous(), self.rnn2.weight_hh_l0, self.rnn2.bias_hh_l0,
+            self.fc1.weight[:, :rnn_dims].contiguous(),
+            self.fc2.weight[:, :self.fc2.in_features - self.aux_dims].contiguous(),
+            self.fc3.weight, self.fc3.bias
+        )
+
+    def get_step_conditions(self, mels, a1, a2, a3, a4):
+        """
+        Projections of conditioning features for chunk of timesteps
+        :return: input of rnn1 without sample, gates of rnn1 and rnn2 inputs, fc1 and fc2 parts of aux
+        """
+        rnn_dims = self.rnn_dims
+        cond_i = F.linear(torch.cat([mels, a1], dim=2), self.I.weight[:, 1:], self.I.bias)
+        cond_gi1 = F.linear(cond_i, self.rnn1.weight_ih_l0, self.rnn1.bias_ih_l0)
+        cond_gi2 = F.linear(a2, self.rnn2.weight_ih_l0[:, rnn_dims:], self.rnn2.bias_ih_l0)
+        cond_fc1 = F.linear(a3, self.fc1.weight[:, rnn_dims:], self.fc1.bias)
+        cond_fc2 = F.linear(a4, self.fc2.weight[:, self.fc2.in_features - self.aux_dims:], self.fc2.bias)
+        return cond_i, cond_gi1, cond_gi2, cond_fc1, cond_fc2
 
     def gen_display(self, i, seq_len, b_size, gen_rate):
         pbar = progbar(i, seq_len)
@@ -281,17 +336,9 @@ class WaveRNN(nn.Module):
     def pad_tensor(self, x, pad, side='both'):
         # NB - this is just a quick method i need right now
         # i.e., it won't generalise to other shapes/dims
-        b, t, c = x.size()
-        total = t + 2 * pad if side == 'both' else t + pad
-        if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu'):
-            padded = torch.zeros(b, total, c).cuda()
-        else:
-            padded = torch.zeros(b, total, c).cpu()
-        if side == 'before' or side == 'both':
-            padded[:, pad:pad + t, :] = x
-        elif side == 'after':
-            padded[:, :t, :] = x
-        return padded
+        before = pad if side in ('before', 'both') else 0
+        after = pad if side in ('after', 'both') else 0
+        return F.pad(x, (0, 0, before, after))
 
     def fold_with_overlap(self, x, target, overlap):
 
@@ -332,16 +379,8 @@ class WaveRNN(nn.Module):
             padding = target + 2 * overlap - remaining
             x = self.pad_tensor(x, padding, side='after')
 
-        if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu'):
-            folded = torch.zeros(num_folds, target + 2 * overlap, features).cuda()
-        else:
-            folded = torch.zeros(num_folds, target + 2 * overlap, features).cpu()
-
-        # Get the values for the folded tensor
-        for i in range(num_folds):
-            start = i * (target + overlap)
-            end = start + target + 2 * overlap
-            folded[i] = x[:, start:end, :]
+        # Strided windows of the padded tensor, (1, num_folds, features, size) -> (num_folds, size, features)
+        folded = x.unfold(1, target + 2 * overlap, target + overlap)[0].transpose(1, 2).contiguous()
 
         return folded
 
@@ -401,11 +440,12 @@ class WaveRNN(nn.Module):
 
         unfolded = np.zeros((total_len), dtype=np.float64)
 
-        # Loop to add up all the samples
-        for i in range(num_folds):
-            start = i * (target + overlap)
-            end = start + target + 2 * overlap
-            unfolded[start:end] += y[i]
+        # Add up all the samples, heads of folds are contiguous and tails are added on heads of the next folds
+        step = target + overlap
+        unfolded[:num_folds * step] += y[:, :step].reshape(-1)
+        tails = np.zeros((num_folds, step), dtype=np.float64)
+        tails[:, :overlap] = y[:, step:]
+        unfolded[step:] += tails.reshape(-1)[:total_len - step]
 
         return unfolded
 
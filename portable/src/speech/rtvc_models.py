@@ -3,22 +3,26 @@ import sys
 import json
 import requests
 import numpy as np
-import torch
 
 root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, os.path.join(root_path, "backend"))
 
 from speech.rtvc.encoder.inference import VoiceCloneEncoder
+from speech.rtvc.encoder.speaker_cache import SpeakerEmbeddingCache
 from speech.rtvc.encoder.audio import preprocess_wav   # We want to expose this function from here
 from speech.rtvc.synthesizer.inference import Synthesizer
 from speech.rtvc.synthesizer.utils.signature import DigitalSignature
 from speech.rtvc.vocoder.inference import VoiceCloneVocoder
 from backend.folders import MEDIA_FOLDER, RTVC_VOICE_FOLDER
 from backend.download import download_model, check_download_size, get_nested_url, is_connected
+from backend.model_registry import model_registry, get_torch_device
 
 sys.path.pop(0)
 
 
+# speaker embeddings of reference audio shared by all requests
+speaker_cache = SpeakerEmbeddingCache(folder=os.path.join(RTVC_VOICE_FOLDER, "speakers"))
+
 RTVC_MODELS_JSON_URL = "https://wladradchenko.ru/static/wunjo.wladradchenko.ru/rtvc.json"
 
 
@@ -139,30 +143,40 @@ def load_rtvc_vocoder(lang: str, device: str):
 
 def load_rtvc(lang: str):
     """
-
-    :param lang:
-    :return:
+    Load Real Time Voice Clone models or get already loaded models from registry
+    :param lang: models lang
+    :return: encoder, synthesizer, signature, vocoder
     """
-    use_cpu = False if torch.cuda.is_available() and 'cpu' not in os.environ.get('WUNJO_TORCH_DEVICE', 'cpu') else True
-    if torch.cuda.is_available() and not use_cpu:
-        print("Processing will run on GPU")
-        device = "cuda"
-    else:
-        print("Processing will run on CPU")
-        device = "cpu"
+    device = get_torch_device()
+    print(f"Processing will run on {device.upper()}")
+    if rtvc_models_config.get(lang) is None:
+        lang = "en"
+    lang_folder = os.path.join(RTVC_VOICE_FOLDER, lang)
 
     print("Load RTVC encoder")
-    encoder = load_rtvc_encoder(lang, device)
+    encoder = model_registry.get("VoiceCloneEncoder", os.path.join(lang_folder, "encoder.pt"), device, lambda: load_rtvc_encoder(lang, device))
     print("Load RTVC synthesizer")
-    synthesizer = load_rtvc_synthesizer(lang, device)
+    synthesizer = model_registry.get("Synthesizer", os.path.join(lang_folder, "synthesizer.pt"), device, lambda: load_rtvc_synthesizer(lang, device))
     print("Load RTVC signature")
-    signature = load_rtvc_digital_signature(lang, device)
+    signature = model_registry.get("DigitalSignature", os.path.join(lang_folder, "signature.pt"), device, lambda: load_rtvc_digital_signature(lang, device))
     print("Load RTVC vocoder")
-    vocoder = load_rtvc_vocoder(lang, device)
+    vocoder = model_registry.get("VoiceCloneVocoder", os.path.join(lang_folder, "vocoder.pt"), device, lambda: load_rtvc_vocoder(lang, device))
 
     return encoder, synthesizer, signature, vocoder
 
 
+def register_rtvc_speaker(name: str, audio_file: str, lang: str):
+    """
+    Register speaker to clone voice by name without reference audio
+    :param name: speaker name
+    :param audio_file: reference audio
+    :param lang: models lang
+    :return: None
+    """
+    encoder, synthesizer, _, _ = load_rtvc(lang)
+    speaker_cache.register(name, audio_file, encoder, synthesizer)
+
+
 def get_text_from_audio():
     pass
 
@@ -170,26 +184,19 @@ def translate_text_from_audio():
     pass
 
 
-def clone_voice_rtvc(audio_file, text, encoder, synthesizer, vocoder, save_folder):
+def clone_voice_rtvc_audio(audio_file, text, encoder, synthesizer, vocoder):
     """
-
-    :param audio_file: audio file
+    Generate voice clone audio parts in memory
+    :param audio_file: audio file or name of registered speaker
     :param text: text to voice
     :param encoder: encoder
     :param synthesizer: synthesizer
     :param vocoder: vocoder
-    :param save_folder: folder to save
-    :return:
+    :return: list of audio parts with sample rate of synthesizer or None if failed
     """
     try:
-        original_wav = synthesizer.load_preprocess_wav(str(audio_file))
-        print("Loaded audio successfully")
-    except Exception as e:
-        print(f"Could not load audio file: {e}")
-        return None
-
-    try:
-        embed = encoder.embed_utterance(original_wav, using_partials=False)
+        # audio is decoded and encoded only if the same reference audio was not used before
+        embed = speaker_cache.get_embedding(audio_file, encoder, synthesizer)
         print("Created the embedding for audio")
     except Exception as e:
         print(f"Could not create embedding for audio: {e}")
@@ -203,9 +210,29 @@ def clone_voice_rtvc(audio_file, text, encoder, synthesizer, vocoder, save_folde
         print(f"Could not create spectrogram or waveform: {e}\n")
         return None
 
-    for i, generated_wav in enumerate(generated_wavs):
+    audio_parts = []
+    for generated_wav in generated_wavs:
         audio = np.pad(generated_wav, (0, synthesizer.sample_rate), mode="constant")
-        audio = preprocess_wav(fpath_or_wav=audio)
+        audio_parts.append(preprocess_wav(fpath_or_wav=audio))
+    return audio_parts
+
+
+def clone_voice_rtvc(audio_file, text, encoder, synthesizer, vocoder, save_folder):
+    """
+
+    :param audio_file: audio file
+    :param text: text to voice
+    :param encoder: encoder
+    :param synthesizer: synthesizer
+    :param vocoder: vocoder
+    :param save_folder: folder to save
+    :return:
+    """
+    audio_parts = clone_voice_rtvc_audio(audio_file, text, encoder, synthesizer, vocoder)
+    if audio_parts is None:
+        return None
+
+    for i, audio in enumerate(audio_parts):
         # Save to disk
         synthesizer.save(audio=audio, path=save_folder, name="rtvc_output_part%02d.wav" % i)
         print(f"\nSaved output as tvc_output_part%02d.wav\n\n" % i)
@@ -1,6 +1,7 @@
-import os.path
+import os
 import re
-from collections import defaultdict
+import threading
+from collections import defaultdict, OrderedDict
 import typing
 from typing import Union, Callable, Iterator, Tuple, List
 
@@ -15,6 +16,18 @@ from speech.tps.tps.modules.ssml.elements import Pause
 
 _curly = re.compile("({}.+?{})".format(*smb.shields))
 
+# Number of processed sentences kept in memory, can be changed by env before start application
+CACHE_SIZE_ENV = "WUNJO_TPS_CACHE_SIZE"
+DEFAULT_CACHE_SIZE = 1024
+
+
+def _get_cache_size():
+    try:
+        return max(0, int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE)))
+    except ValueError:
+        print(f"Error... {CACHE_SIZE_ENV} has to be integer, used default {DEFAULT_CACHE_SIZE}")
+        return DEFAULT_CACHE_SIZE
+
 
 class Handler(md.Processor):
     def __init__(self, charset: str, modules: list=None, out_max_length: int=None, save_state=False, name="Handler", use_cleaner=True):
@@ -47,6 +60,12 @@ class Handler(md.Processor):
         self._out_data = defaultdict(list)
         self.save_state = save_state
 
+        # LRU cache of processed sentences and vectors, repeated phrases skip chain of modules
+        self.cache_size = _get_cache_size()
+        self._process_cache = OrderedDict()
+        self._vector_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
 
     @typing.overload
     def process(self, string: str, cleaners: str=None, user_dict: dict=None, **kwargs) -> str:
@@ -80,11 +99,27 @@ class Handler(md.Processor):
         :return: str
             Returns processed string.
         """
-        module: md.Processor
         origin_string = string
 
         cleaners = [] if cleaners is None else cleaners
         cleaners = [cleaners] if not isinstance(cleaners, (tuple, list)) else cleaners
+
+        cache_key = self._get_process_key(string, cleaners, user_dict, kwargs)
+        if cache_key is not None:
+            cached = self._cache_get(self._process_cache, cache_key)
+            if cached is not None:
+                return cached
+
+        string = self._process(string, cleaners, user_dict, origin_string, **kwargs)
+
+        if cache_key is not None:
+            self._cache_put(self._process_cache, cache_key, string)
+
+        return string
+
+
+    def _process(self, string, cleaners, user_dict, origin_string, **kwargs):
+        module: md.Processor
         for _cleaner in cleaners:
             if isinstance(_cleaner, Callable):
                 cleaner = _cleaner
@@ -284,6 +319,11 @@ class Handler(md.Processor):
         [32, 16, 36, 16, 34, 12, 32, 17, 32, 16, 34, 12, 32, 17, 22, 28, 16, 23, 12, 15, 12, 32, 16, 22, 28,
         12, 18, 24, 12, 32, 17, 22, 28, 29, 16, 23, 12, 32, 16, 32, 32, 16, 34, 35, 2]
         """
+        cached = self._cache_get(self._vector_cache, string)
+        if cached is not None:
+            return list(cached)
+
+        origin_string = string
         string = _curly.split(string)
         vector = []
         for elem in string:
@@ -294,7 +334,55 @@ class Handler(md.Processor):
 
             vector.extend(elem)
 
-        return [self.symbol_to_id[s] for s in vector if self._should_keep_symbol(s)]
+        vector = [self.symbol_to_id[s] for s in vector if self._should_keep_symbol(s)]
+        self._cache_put(self._vector_cache, origin_string, tuple(vector))
+
+        return vector
+
+
+    def clear_cache(self):
+        """
+        Clear cache of processed sentences, has to be called after user dictionary was changed.
+        """
+        with self._cache_lock:
+            self._process_cache.clear()
+            self._vector_cache.clear()
+
+
+    def _get_process_key(self, string, cleaners, user_dict, kwargs):
+        """
+        Key of processed sentence or None if result can not be cached.
+        Random masking and saving of states are not cached.
+        """
+        if self.cache_size == 0 or self.save_state:
+            return None
+        if any(value is not False and value != 0 for name, value in kwargs.items() if name.startswith("mask")):
+            return None
+        try:
+            key = (string, tuple(cleaners), id(user_dict) if user_dict is not None else None,
+                   tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+
+    def _cache_get(self, cache, key):
+        with self._cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+
+    def _cache_put(self, cache, key, value):
+        if self.cache_size == 0:
+            return
+        with self._cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
 
 
     def vec2text(self, vector: list) -> str:
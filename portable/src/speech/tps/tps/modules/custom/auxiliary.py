@@ -9,7 +9,7 @@ from speech.tps.tps.utils import cleaners
 
 root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, os.path.join(root_path, "backend"))
-from backend.translator import get_translate
+from backend.translator import get_translate_batch
 sys.path.pop(0)
 
 
@@ -32,8 +32,9 @@ class Number(md.Processor):
 
     def process(self, string: str, **kwargs) -> str:
         separated_numbers = self.separate_and_convert_numbers(string)
-        for number_val, number_word in separated_numbers.items():
-            translated_number = get_translate(number_word, self.charset)
+        # all numbers of string are translated by one request
+        translated_numbers = get_translate_batch(list(separated_numbers.values()), self.charset)
+        for number_val, translated_number in zip(separated_numbers.keys(), translated_numbers):
             string = string.replace(number_val, translated_number)
         return string
 
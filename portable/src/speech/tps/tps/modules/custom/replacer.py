@@ -27,7 +27,25 @@ class Replacer(Processor):
         if isinstance(dict_source, (tuple, list)):
             dict_source, fmt = dict_source
 
-        self.entries = load_dict(dict_source, fmt)
+        # dictionary files are loaded on first use
+        self._dict_source = dict_source
+        self._dict_fmt = fmt
+        self._entries = None
+        self._omograph_index = None
+
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            self._entries = load_dict(self._dict_source, self._dict_fmt)
+            self._dict_source = None
+        return self._entries
+
+
+    @entries.setter
+    def entries(self, value: dict):
+        self._entries = value
+        self._omograph_index = None
 
 
     def process(self, string: str, **kwargs) -> str:
@@ -64,12 +82,42 @@ class Replacer(Processor):
         return token if prob2bool(mask) else self.entries.get(token, token)
 
     def _process_omograph(self, string):
-        for k, v in self.entries.items():
-            if k in string:
-                string = string.replace(k, v)
-        return string
+        """
+        Replace entries in order of dictionary. Only entries found in string by index are checked,
+        after replacement string is searched again for entries next in order
+        """
+        entries, index, prefix_length = self._get_omograph_index()
+        position = -1
+        while True:
+            position = self._find_omograph(string, index, prefix_length, position)
+            if position is None:
+                return string
+            key, value = entries[position]
+            string = string.replace(key, value)
+
+
+    def _get_omograph_index(self):
+        if self._omograph_index is None:
+            entries = [(k, v) for k, v in self.entries.items() if k]
+            prefix_length = max(1, min((len(k) for k, _ in entries), default=1))
+            index = {}
+            for position, (key, _) in enumerate(entries):
+                index.setdefault(key[:prefix_length], []).append(position)
+            self._omograph_index = (entries, index, prefix_length)
+        return self._omograph_index
+
+
+    def _find_omograph(self, string, index, prefix_length, after):
+        """First entry after position in dictionary order which is found in string"""
+        entries = self._omograph_index[0]
+        found = None
+        for i in range(len(string) - prefix_length + 1):
+            for position in index.get(string[i:i + prefix_length], ()):
+                if after < position and (found is None or position < found) and string.startswith(entries[position][0], i):
+                    found = position
+        return found
 
 
 class BlindReplacer(Replacer):
     def _process_token(self, token, mask):
-        return token if prob2bool(mask) else self.entries.get(token.replace(accent, ""), token)
\ No newline at end of file
+        return token if prob2bool(mask) else self.entries.get(token.replace(accent, ""), token)
@@ -2,6 +2,7 @@ import os
 import re
 import json
 import yaml
+import pickle
 import numpy as np
 
 from speech.tps.tps import symbols as smb
@@ -49,9 +50,7 @@ def load_dict(dict_source, fmt=None):
             elif fmt == "yaml":
                 _dict = yaml.safe_load(stream)
             elif fmt == "plane":
-                _dict = stream.read().splitlines()
-                _dict = tuple(line.split("|") for line in _dict)
-                _dict = {elem[0]: elem[1] for elem in _dict if elem}
+                _dict = load_compiled_dict(dict_source, stream)
             else:
                 raise ValueError("File format must be specified ['json', 'yaml', 'plane']")
 
@@ -65,6 +64,47 @@ def load_dict(dict_source, fmt=None):
     return _dict
 
 
+COMPILED_DICT_EXT = ".pkl"
+
+
+def load_compiled_dict(dict_source, stream=None):
+    """
+    Load plane dictionary from compiled file next to source, compile it if source was changed
+    :param dict_source: path to plane dictionary
+    :param stream: opened source file, used if compiled file is not valid
+    :return: dict
+    """
+    compiled_path = dict_source + COMPILED_DICT_EXT
+    stat = os.stat(dict_source)
+    source_key = (stat.st_size, stat.st_mtime_ns)
+
+    if os.path.exists(compiled_path):
+        try:
+            with open(compiled_path, "rb") as compiled:
+                compiled_key, _dict = pickle.load(compiled)
+            if compiled_key == source_key:
+                return _dict
+        except Exception as err:
+            print(f"Error... Compiled dictionary {compiled_path} is broken and will be compiled again: {err}")
+
+    if stream is None:
+        with open(dict_source, "r", encoding="utf-8") as source:
+            lines = source.read().splitlines()
+    else:
+        lines = stream.read().splitlines()
+    _dict = tuple(line.split("|") for line in lines)
+    _dict = {elem[0]: elem[1] for elem in _dict if elem}
+
+    try:
+        with open(compiled_path, "wb") as compiled:
+            pickle.dump((source_key, _dict), compiled, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as err:
+        # folder of application can be read only, dictionary works without compiled file
+        print(f"Warning... Compiled dictionary is not saved: {err}")
+
+    return _dict
+
+
 def save_dict(dict_obj, filepath, fmt=None):
     _dict = {}
 
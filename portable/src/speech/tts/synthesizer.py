@@ -2,6 +2,8 @@ import os
 import sys
 import time
 import yaml
+import struct
+import threading
 
 import numpy as np
 import soundfile
@@ -31,6 +33,24 @@ def set_logger(log_level="INFO", log_file=None):
         logger.add(log_file, encoding="utf8")
 
 
+# Number of text units synthesized in one decoder loop, can be changed by env before start application
+TTS_BATCH_ENV = "WUNJO_TTS_BATCH"
+
+
+def get_tts_batch_size(device):
+    """
+    Get number of text units in batch
+    :param device: cuda or cpu
+    :return: batch size
+    """
+    default = 16 if "cuda" in str(device) else 4
+    try:
+        return max(1, int(os.environ.get(TTS_BATCH_ENV, default)))
+    except ValueError:
+        print(f"Error... {TTS_BATCH_ENV} has to be integer, used default {default}")
+        return default
+
+
 _modules_dict = {
     "tacotron2": bw.Tacotron2Wrapper,
     "waveglow": bw.WaveglowWrapper
@@ -39,7 +59,7 @@ _modules_dict = {
 
 class Synthesizer:
     def __init__(self, name, text_handler, engine, vocoder, sample_rate, device="cuda", pause_type="silence",
-                voice_control_cfg=None, user_dict=None):
+                voice_control_cfg=None, user_dict=None, batch_size=None):
         self.name = name
 
         self.text_handler = text_handler
@@ -49,6 +69,8 @@ class Synthesizer:
         self.sample_rate = sample_rate
 
         self.device = device
+        self.lock = threading.Lock()  # decoder keeps states in modules, one inference at the same time
+        self.batch_size = batch_size or get_tts_batch_size(self.engine.device)
 
         self.pause_type = pause_type
         self.voice_control_cfg = self.load_config(voice_control_cfg)
@@ -80,6 +102,25 @@ class Synthesizer:
     def generate(self, text, **kwargs):
         return BackgroundGenerator(self.text_to_audio_gen(text, **kwargs))
 
+
+    def stream(self, text, audio_format="wav", **kwargs):
+        """
+        Synthesize text and yield encoded audio as soon as each unit is vocoded
+        :param text: text or ssml
+        :param audio_format: wav to start stream by header or pcm for raw 16 bit big endian mono samples as audio/L16
+        :param kwargs: options of synthesis
+        :return: generator of bytes
+        """
+        if audio_format not in ("wav", "pcm"):
+            raise ValueError(f"Audio format {audio_format} is not supported for stream, use wav or pcm")
+        if audio_format == "wav":
+            yield wav_stream_header(self.sample_rate)
+        # first unit is synthesized alone to decrease time to first audio, next units in batches
+        kwargs["first_batch_size"] = 1
+        # iterate in the same thread to stop synthesis if client closed connection
+        for audio in self.text_to_audio_gen(text, **kwargs):
+            yield audio_to_pcm16(audio, big_endian=audio_format == "pcm")
+
     def cyrillic_to_latin_transliterate(self, text):
         return ''.join(self.cyrillic_to_latin.get(char, char) for char in text.lower())
 
@@ -125,6 +166,7 @@ class Synthesizer:
         pitch = kwargs.pop("pitch", 1.0)
         rate = kwargs.pop("rate", 1.0)
         volume = kwargs.pop("volume", 0)
+        first_batch_size = kwargs.pop("first_batch_size", None)
 
         cleaners = kwargs.pop("cleaners", tuple())
         if "light_punctuation_cleaners" not in cleaners:
@@ -144,7 +186,7 @@ class Synthesizer:
             self._sequence_to_sequence_gen(sequence, cleaners, mask_stress, mask_phonemes)
         )
 
-        return self._sequence_to_audio_gen(sequence_generator, **kwargs)
+        return self._sequence_to_audio_gen(sequence_generator, first_batch_size, **kwargs)
 
 
     def _sequence_to_sequence_gen(self, sequence, cleaners, mask_stress, mask_phonemes):
@@ -172,24 +214,47 @@ class Synthesizer:
                 yield element
 
 
-    def _sequence_to_audio_gen(self, sequence, **kwargs):
+    def _sequence_to_audio_gen(self, sequence, first_batch_size=None, **kwargs):
+        batch = []
+        batch_size = first_batch_size or self.batch_size
         for unit in sequence:
             if isinstance(unit, ssml.Pause):
-                audio = generate_pause(unit.samples(self.sample_rate), ptype=self.pause_type)
+                # pause is boundary of batch to keep order of audio
+                yield from self._units_to_audio(batch, **kwargs)
+                if batch:
+                    batch_size = self.batch_size
+                batch = []
+                yield generate_pause(unit.samples(self.sample_rate), ptype=self.pause_type)
             else:
                 logger.debug(unit)
-                unit_value = self.text_handler.check_eos(unit.value)
-                unit_value = self.text_handler.text2vec(unit_value)
+                batch.append(unit)
+                if len(batch) >= batch_size:
+                    yield from self._units_to_audio(batch, **kwargs)
+                    batch = []
+                    batch_size = self.batch_size
 
-                spectrogram = self.engine(unit_value, **kwargs)
-                audio = self.vocoder(spectrogram)
-                audio = self.vocoder.denoise(audio)
+        yield from self._units_to_audio(batch, **kwargs)
 
-                audio = self.post_process(audio, unit.pitch, unit.rate, unit.volume)
+        self.vocoder.clear_cache()
 
-            yield audio
 
-        self.vocoder.clear_cache()
+    def _units_to_audio(self, units, **kwargs):
+        if not units:
+            return
+
+        unit_values = [self.text_handler.text2vec(self.text_handler.check_eos(unit.value)) for unit in units]
+
+        with self.lock:
+            if len(units) == 1:
+                spectrograms = [self.engine(unit_values[0], **kwargs)]
+                audios = [self.vocoder(spectrograms[0])]
+            else:
+                spectrograms = self.engine.batch(unit_values, **kwargs)
+                audios = self.vocoder.batch(spectrograms)
+
+        for unit, audio in zip(units, audios):
+            audio = self.vocoder.denoise(audio)
+            yield self.post_process(audio, unit.pitch, unit.rate, unit.volume)
 
 
     def post_process(self, audio, pitch=1.0, rate=1.0, volume=0):
@@ -272,6 +337,7 @@ class Synthesizer:
     def update_user_dict(self, new_dict):
         self.user_dict.update(new_dict)
         print("User dictionary has been updated")
+        self.text_handler.clear_cache()
 
         save_dict(self.user_dict, self._dict_source)
         print("User dictionary has been saved")
@@ -280,6 +346,7 @@ class Synthesizer:
     def replace_user_dict(self, new_dict):
         self.user_dict = new_dict
         print("User dictionary has been replaced")
+        self.text_handler.clear_cache()
 
         save_dict(self.user_dict, self._dict_source)
         print("User dictionary has been saved")
@@ -346,6 +413,35 @@ def generate_pause(duration, eps=1e-4, ptype='white_noise'):
     return pause.astype(np.float32)
 
 
+def audio_to_pcm16(audio, big_endian=False):
+    """
+    Convert float audio in [-1, 1] to bytes of 16 bit samples
+    :param audio: numpy array
+    :param big_endian: big endian for audio/L16 (RFC 2586), little endian for wav
+    :return: bytes
+    """
+    audio = np.clip(np.asarray(audio, dtype=np.float32).reshape(-1), -1.0, 1.0)
+    return (audio * 32767).astype(">i2" if big_endian else "<i2").tobytes()
+
+
+def wav_stream_header(sample_rate, channels=1, bits_per_sample=16):
+    """
+    Header of wav with unknown length, players read data until end of stream
+    :param sample_rate: sample rate
+    :param channels: number of channels
+    :param bits_per_sample: bits per sample
+    :return: bytes
+    """
+    unknown_size = 0xFFFFFFFF
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (
+        b"RIFF" + struct.pack("<I", unknown_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b"data" + struct.pack("<I", unknown_size)
+    )
+
+
 def _load_text_handler(config_dict):
     print("Loading text handler")
 
@@ -24,6 +24,9 @@ class BackgroundGenerator(threading.Thread):
 
 
     def run(self):
-        for item in self.generator:
-            self.queue.put(item)
-        self.queue.put(None)
\ No newline at end of file
+        try:
+            for item in self.generator:
+                self.queue.put(item)
+        finally:
+            # stop consumer also if generator raised error
+            self.queue.put(None)
\ No newline at end of file
@@ -57,4 +57,28 @@ class Tacotron2Wrapper:
 
         mel_outputs, mel_outputs_postnet, gates, alignments = self.model.inference(sequence, **kwargs)
 
-        return mel_outputs_postnet
\ No newline at end of file
+        return mel_outputs_postnet
+
+
+    def batch(self, sequences, **kwargs):
+        """
+        Synthesize spectrograms for several sequences in one decoder loop
+        :param sequences: list of sequences of symbol ids
+        :param kwargs: kwargs of model inference
+        :return: list of spectrograms (1, n_mel_channels, frames) in order of sequences
+        """
+        lengths = torch.LongTensor([len(sequence) for sequence in sequences])
+        inputs = torch.zeros(len(sequences), int(lengths.max()), dtype=torch.long)
+        for i, sequence in enumerate(sequences):
+            inputs[i, :len(sequence)] = torch.LongTensor(sequence)
+
+        kwargs["max_decoder_steps"] = (lengths.float() * self.steps_per_symbol).long()
+
+        with torch.no_grad():
+            outputs, mel_lengths = self.model.inference_batch(
+                inputs.to(device=self.device), lengths.to(device=self.device), **kwargs
+            )
+
+        return [
+            outputs.mels_postnet[i:i + 1, :, :int(mel_length)] for i, mel_length in enumerate(mel_lengths.cpu())
+        ]
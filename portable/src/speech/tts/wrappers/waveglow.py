@@ -41,6 +41,24 @@ class WaveglowWrapper:
         return audio
 
 
+    def batch(self, spectrograms, pad_value=-11.5129):
+        """
+        Vocode several spectrograms of different length in one forward
+        :param spectrograms: list of spectrograms (1, n_mel_channels, frames)
+        :param pad_value: value of padded frames, log of silence in tacotron2 mel
+        :return: list of audio (1, samples) in order of spectrograms
+        """
+        lengths = [spectrogram.size(-1) for spectrogram in spectrograms]
+        batch = spectrograms[0].new_full((len(spectrograms), spectrograms[0].size(1), max(lengths)), pad_value)
+        for i, spectrogram in enumerate(spectrograms):
+            batch[i, :, :lengths[i]] = spectrogram[0]
+
+        audio = self(batch)
+
+        hop_length = self.model.upsample.stride[0]
+        return [audio[i:i + 1, :length * hop_length] for i, length in enumerate(lengths)]
+
+
     def denoise(self, audio):
         if type(audio) == np.ndarray:
             audio = torch.tensor(audio).to(self.device, self.dtype)
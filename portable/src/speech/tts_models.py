@@ -9,6 +9,7 @@ sys.path.insert(0, os.path.join(root_path, "backend"))
 from speech.tts.synthesizer import Synthesizer, set_logger, _load_text_handler
 from backend.folders import MEDIA_FOLDER, AVATAR_FOLDER, VOICE_FOLDER, CUSTOM_VOICE_FOLDER
 from backend.download import download_model, check_download_size
+from backend.model_registry import model_registry, get_torch_device
 
 sys.path.pop(0)
 
@@ -252,41 +253,42 @@ def inspect_model(voice_name: str):
             check_download_size(waveglow_path, waveglow_link)
 
 
-def load_voice_models(user_voice_names: list, models: dict):
+def load_voice_model(voice_name: str):
+    """
+    Load TTS model or get already loaded model from registry
+    :param voice_name: voice name
+    :return: synthesizer
+    """
     local_config = {**file_voice_config.copy(), **file_custom_voice_config.copy()}
-    prev_voice_names = list(models.keys())
-    [models.pop(voice_name) for voice_name in prev_voice_names if voice_name not in user_voice_names]
-    if sorted(user_voice_names) == sorted(list(models.keys())):
-        # if models and user request was equal or after pop the model start to equal to user request
-        # it means not need load need model
-        print("Loaded TTS models already is loaded")
-        return models
-
-    if models == {}:
-        first_voice_name = user_voice_names[0]
-        inspect_model(first_voice_name)  # inspect model to download
-        voice_synthesizer_first = Synthesizer.from_config(local_config, name=first_voice_name)
-        models[first_voice_name] = voice_synthesizer_first
-    else:
-        first_voice_name = list(models.keys())[0]
-        voice_synthesizer_first = models[first_voice_name]
-
-    for voice_name in user_voice_names:
-        if models.get(voice_name) is None:
-            inspect_model(voice_name)  # inspect model to download
-            voice_config = local_config[voice_name]
-            voice_synthesizer_other = Synthesizer(
-                name=voice_name,
-                text_handler=_load_text_handler(voice_config["text_handler"]),
-                engine=Synthesizer.module_from_config(voice_config, "engine", "tacotron2", voice_synthesizer_first.device),
-                vocoder=Synthesizer.module_from_config(voice_config, "vocoder", "waveglow", voice_synthesizer_first.device),
-                sample_rate=voice_synthesizer_first.sample_rate,
-                device=voice_synthesizer_first.device,
-                pause_type=voice_synthesizer_first.pause_type,
-                voice_control_cfg=voice_config["voice_control_cfg"],
-                user_dict=voice_config["user_dict"]
-            )
-            models[voice_name] = voice_synthesizer_other
-
+    general_config = file_voice_config["general"]
+    voice_config = local_config[voice_name]
+    checkpoint = [voice_config["engine"]["tacotron2"]["model_path"], voice_config["vocoder"]["waveglow"]["model_path"]]
+    # the same device is used for registry key and loading, else model can be on other device than its budget
+    device = get_torch_device()
+
+    def loader():
+        inspect_model(voice_name)  # inspect model to download
+        return Synthesizer(
+            name=voice_name,
+            text_handler=_load_text_handler(voice_config["text_handler"]),
+            engine=Synthesizer.module_from_config(voice_config, "engine", "tacotron2", device),
+            vocoder=Synthesizer.module_from_config(voice_config, "vocoder", "waveglow", device),
+            sample_rate=general_config["sample_rate"],
+            device=device,
+            pause_type=general_config["pause_type"],
+            voice_control_cfg=voice_config["voice_control_cfg"],
+            user_dict=voice_config["user_dict"]
+        )
+
+    return model_registry.get("Synthesizer", checkpoint, device, loader)
+
+
+def load_voice_models(user_voice_names: list) -> dict:
+    """
+    Load TTS models for user voices, models keep in registry between requests
+    :param user_voice_names: voice names
+    :return: dict of synthesizers by voice name
+    """
+    models = {voice_name: load_voice_model(voice_name) for voice_name in user_voice_names}
     print("Update loaded TTS models")
     return models
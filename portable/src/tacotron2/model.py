@@ -620,6 +620,61 @@ class Decoder(nn.Module):
         return mel_outputs, gate_outputs, alignments
 
 
+    def inference_batch(self, memory, memory_lengths, max_decoder_steps=None, suppress_gate=False):
+        """ Decoder inference for batch of padded sequences
+        PARAMS
+        ------
+        memory: Encoder outputs (B, T_in, encoder_embedding_dim)
+        memory_lengths: Encoder output lengths for attention masking
+        max_decoder_steps: int or tensor (B,) with max steps for each item
+
+        RETURNS
+        -------
+        mel_outputs: mel outputs from the decoder, frames after stop are zeros
+        gate_outputs: gate outputs from the decoder
+        alignments: sequence of attention weights from the decoder
+        mel_lengths: number of mel frames for each item
+        """
+        B = memory.size(0)
+        if max_decoder_steps is None:
+            max_decoder_steps = self.max_decoder_steps
+        if not torch.is_tensor(max_decoder_steps):
+            max_decoder_steps = torch.full((B,), int(max_decoder_steps), dtype=torch.long)
+        max_decoder_steps = max_decoder_steps.to(memory.device)
+
+        decoder_input = self.get_go_frame(memory)
+
+        self.initialize_decoder_states(memory, mask=~utl.get_mask_from_lengths(memory_lengths))
+
+        # number of decoder steps of each item, zero while item is not stopped
+        steps = torch.zeros(B, dtype=torch.long, device=memory.device)
+        mel_outputs, gate_outputs, alignments = [], [], []
+        while True:
+            decoder_input = self.prenet(decoder_input)
+            mel_output, gate_output, alignment, _ = self.decode(decoder_input)
+
+            finished = steps > 0
+            mel_outputs.append(mel_output.masked_fill(finished.unsqueeze(1), 0.0))
+            gate_outputs.append(gate_output)
+            alignments.append(alignment)
+
+            step = len(mel_outputs)
+            stop = step >= max_decoder_steps
+            if not suppress_gate:
+                stop |= torch.sigmoid(gate_output.data.squeeze(1)) > self.gate_threshold
+            steps.masked_fill_(~finished & stop, step)
+
+            if bool((steps > 0).all()):
+                break
+
+            decoder_input = mel_output
+
+        mel_outputs, gate_outputs, alignments, _ = self.parse_decoder_outputs(
+            mel_outputs, gate_outputs, alignments, [])
+
+        return mel_outputs, gate_outputs, alignments, steps * self.n_frames_per_step
+
+
 class Tacotron2(nn.Module):
     def __init__(self, hparams):
         super(Tacotron2, self).__init__()
@@ -770,6 +825,54 @@ class Tacotron2(nn.Module):
         return outputs
 
 
+    def inference_batch(self, inputs, input_lengths, **kwargs):
+        """
+        Inference for batch of padded sequences, items stop independently by own gate
+        :param inputs: padded sequences (B, T_in)
+        :param input_lengths: lengths of sequences (B,)
+        :param kwargs: max_decoder_steps as int or tensor (B,), reference_mel or token_idx for gst
+        :return: outputs and mel lengths, mels after length of item are zeros
+        """
+        max_decoder_steps = kwargs.get("max_decoder_steps", None)
+
+        # encoder packs sequences and requires lengths in descending order
+        input_lengths, order = torch.sort(input_lengths, descending=True)
+        inputs = inputs[order]
+        if torch.is_tensor(max_decoder_steps):
+            max_decoder_steps = max_decoder_steps[order.to(max_decoder_steps.device)]
+
+        embedded_inputs = self.embedding(inputs).transpose(1, 2)
+        encoder_outputs = self.encoder(embedded_inputs, input_lengths)
+
+        if self.gst is not None:
+            reference_mel = kwargs.pop("reference_mel", None)
+            token_idx = kwargs.pop("token_idx", None)
+
+            gst_output = self.gst.inference(encoder_outputs, reference_mel, token_idx)
+            if gst_output is not None:
+                encoder_outputs += gst_output
+
+        mel_outputs, gate_outputs, alignments, mel_lengths = self.decoder.inference_batch(
+            encoder_outputs, input_lengths, max_decoder_steps)
+
+        mel_outputs_postnet = self.postnet(mel_outputs)
+        mel_outputs_postnet = mel_outputs + mel_outputs_postnet
+
+        outputs = utl.Outputs(
+            mels=mel_outputs,
+            mels_postnet=mel_outputs_postnet,
+            gate=gate_outputs,
+            alignments=alignments
+        )
+        outputs = self.parse_output(outputs, mel_lengths)
+
+        # restore order of items
+        inverse = torch.argsort(order)
+        outputs = utl.Outputs(*(value[inverse] for value in outputs))
+
+        return outputs, mel_lengths[inverse]
+
+
 def load_model(hparams, distributed_run=False):
     model = Tacotron2(hparams)
 
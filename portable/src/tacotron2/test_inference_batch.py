@@ -0,0 +1,101 @@
+import os
+import sys
+
+import torch
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+
+from tacotron2.hparams import create_hparams, read_default_hparams
+from tacotron2.model import Decoder
+
+sys.path.pop(0)
+
+
+def get_decoder(max_decoder_steps=20):
+    config = read_default_hparams()
+    config["max_decoder_steps"] = max_decoder_steps
+    decoder = Decoder(create_hparams(config))
+    decoder.eval()
+    return decoder, config
+
+
+def get_memory(decoder, lengths):
+    memory_lengths = torch.LongTensor(lengths)
+    memory = torch.randn(len(lengths), int(memory_lengths.max()), decoder.encoder_embedding_dim)
+    return memory, memory_lengths
+
+
+def test_inference_batch_with_steps_tensor():
+    torch.manual_seed(0)
+    decoder, config = get_decoder()
+    memory, memory_lengths = get_memory(decoder, [7, 4, 5])
+    max_decoder_steps = torch.LongTensor([6, 3, 4])
+
+    with torch.no_grad():
+        mel_outputs, gate_outputs, alignments, mel_lengths = decoder.inference_batch(
+            memory, memory_lengths, max_decoder_steps=max_decoder_steps, suppress_gate=True
+        )
+
+    n_frames_per_step = config["n_frames_per_step"]
+    assert mel_lengths.tolist() == (max_decoder_steps * n_frames_per_step).tolist()
+    assert mel_outputs.shape == (3, config["n_mel_channels"], 6 * n_frames_per_step)
+    # frames after stop of item are zeros
+    assert bool((mel_outputs[1, :, 3 * n_frames_per_step:] == 0).all())
+    assert alignments.shape[:2] == (3, 6)
+
+
+def test_inference_batch_with_default_steps():
+    torch.manual_seed(0)
+    decoder, config = get_decoder(max_decoder_steps=5)
+    memory, memory_lengths = get_memory(decoder, [3, 6])
+
+    with torch.no_grad():
+        _, _, _, mel_lengths = decoder.inference_batch(memory, memory_lengths, suppress_gate=True)
+
+    assert mel_lengths.tolist() == [5 * config["n_frames_per_step"]] * 2
+
+
+def test_inference_batch_stops_item_by_gate():
+    torch.manual_seed(0)
+    decoder, config = get_decoder(max_decoder_steps=8)
+    memory, memory_lengths = get_memory(decoder, [5, 5])
+    # gate never fires by itself, only first item is stopped on third step
+    torch.nn.init.constant_(decoder.gate_layer.linear_layer.bias, -1e4)
+    decode = decoder.decode
+    calls = []
+
+    def decode_with_gate(decoder_input):
+        mel_output, gate_output, alignment, decoder_output = decode(decoder_input)
+        calls.append(1)
+        if len(calls) == 3:
+            gate_output = gate_output.clone()
+            gate_output[0] = 1e4
+        return mel_output, gate_output, alignment, decoder_output
+
+    decoder.decode = decode_with_gate
+
+    with torch.no_grad():
+        mel_outputs, _, _, mel_lengths = decoder.inference_batch(memory, memory_lengths)
+
+    n_frames_per_step = config["n_frames_per_step"]
+    assert mel_lengths.tolist() == [3 * n_frames_per_step, 8 * n_frames_per_step]
+    assert mel_outputs.shape[2] == 8 * n_frames_per_step
+    assert bool((mel_outputs[0, :, 3 * n_frames_per_step:] == 0).all())
+    assert bool((mel_outputs[1, :, 3 * n_frames_per_step:] != 0).any())
+
+
+def test_inference_batch_item_does_not_depend_on_padding():
+    torch.manual_seed(0)
+    decoder, config = get_decoder(max_decoder_steps=6)
+    # prenet dropout is always on, so it is replaced by the same layers without dropout
+    decoder.prenet.forward = lambda x: torch.nn.Sequential(*decoder.prenet.layers)(x)
+    memory, memory_lengths = get_memory(decoder, [4, 7])
+
+    with torch.no_grad():
+        single_mels, single_gates, _, _ = decoder.inference_batch(
+            memory[:1, :4], memory_lengths[:1], suppress_gate=True)
+        batch_mels, batch_gates, _, _ = decoder.inference_batch(memory, memory_lengths, suppress_gate=True)
+
+    assert torch.allclose(single_mels[0], batch_mels[0], atol=1e-5)
+    assert torch.allclose(single_gates[0], batch_gates[0], atol=1e-5)
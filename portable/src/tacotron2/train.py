@@ -51,6 +51,7 @@ sys.path.insert(0, root_path)
 from speech.tps.tps import Handler
 from tacotron2.model import load_model
 from tacotron2.utils.data_utils import TextMelLoader, TextMelCollate, CustomSampler
+from tacotron2.utils.mel_cache import precompute_mels
 from tacotron2.utils.distributed import apply_gradient_allreduce
 from tacotron2.modules.optimizers import build_optimizer, build_scheduler, SchedulerTypes
 from tacotron2.modules.loss_function import OverallLoss
@@ -114,12 +115,35 @@ def prepare_dataloaders(hparams, distributed_run=False):
     else:
         train_sampler = CustomSampler(trainset, hparams.batch_size, hparams.shuffle, hparams.optimize, hparams.len_diff)
 
-    train_loader = DataLoader(trainset, num_workers=1, sampler=train_sampler,
-                              batch_size=hparams.batch_size, pin_memory=False,
-                              drop_last=False, collate_fn=collate_fn)
+    num_workers, pin_memory = get_loader_params(hparams)
+    train_loader = DataLoader(trainset, num_workers=num_workers, sampler=train_sampler,
+                              batch_size=hparams.batch_size, pin_memory=pin_memory,
+                              drop_last=False, collate_fn=collate_fn, persistent_workers=num_workers > 0)
     return train_loader, valset, collate_fn
 
 
+def get_loader_params(hparams):
+    """Number of data loader workers and pinned memory from hparams"""
+    num_workers = hparams.get("num_workers")
+    num_workers = min(4, os.cpu_count() or 1) if num_workers is None else int(num_workers)
+    pin_memory = hparams.get("pin_memory")
+    pin_memory = torch.cuda.is_available() if pin_memory is None else bool(pin_memory) and torch.cuda.is_available()
+    return num_workers, pin_memory
+
+
+def prepare_mel_cache(hparams, distributed_run=False, rank=0):
+    # Compute mels once before training, data loaders read them from shards
+    if not hparams.get("mel_cache_dir") or hparams.load_mel_from_disk:
+        return
+    if rank == 0:
+        precompute_mels(
+            [hparams.training_files, hparams.validation_files], hparams, hparams.mel_cache_dir,
+            num_workers=hparams.get("preprocess_workers"), shard_size=hparams.get("mel_shard_size") or 1000
+        )
+    if distributed_run:
+        dist.barrier()
+
+
 def prepare_directories_and_logger(output_directory, log_directory, rank):
     root_path = os.path.dirname(os.path.abspath(__file__))
     sys.path.insert(0, root_path)
@@ -211,7 +235,8 @@ def save_checkpoint(model, optimizer, lr_scheduler, criterion, iteration, hparam
     torch.save(train_dict, filepath)
 
 
-def validate(model, criterion, valset, iteration, batch_size, collate_fn, logger, distributed_run, rank, n_gpus):
+def validate(model, criterion, valset, iteration, batch_size, collate_fn, logger, distributed_run, rank, n_gpus,
+             num_workers=1, pin_memory=False):
     """Handles all the validation scoring and printing"""
     shuffle = not distributed_run
 
@@ -220,9 +245,9 @@ def validate(model, criterion, valset, iteration, batch_size, collate_fn, logger
     model.eval()
     with torch.no_grad():
         val_sampler = DistributedSampler(valset) if distributed_run else None
-        val_loader = DataLoader(valset, sampler=val_sampler, num_workers=1,
+        val_loader = DataLoader(valset, sampler=val_sampler, num_workers=num_workers,
                                 shuffle=shuffle, batch_size=batch_size,
-                                pin_memory=False, collate_fn=collate_fn)
+                                pin_memory=pin_memory, collate_fn=collate_fn)
 
         val_loader = tqdm(val_loader, desc="Running validation...") if rank == 0 else val_loader
         for i, batch in enumerate(val_loader):
@@ -277,7 +302,9 @@ def train(hparams, distributed_run=False, rank=0, n_gpus=None):
 
     logger = prepare_directories_and_logger(hparams.output_dir, hparams.log_dir, rank)
     copyfile(hparams.path, os.path.join(hparams.output_dir, 'hparams.yaml'))
+    prepare_mel_cache(hparams, distributed_run, rank)
     train_loader, valset, collate_fn = prepare_dataloaders(hparams, distributed_run)
+    num_workers, pin_memory = get_loader_params(hparams)
 
     # Load checkpoint if one exists
     iteration = 0
@@ -345,7 +372,7 @@ def train(hparams, distributed_run=False, rank=0, n_gpus=None):
 
             if iteration % hparams.iters_per_checkpoint == 0:
                 val_loss = validate(model, criterion, valset, iteration, hparams.batch_size, collate_fn, logger,
-                                    distributed_run, rank, n_gpus)
+                                    distributed_run, rank, n_gpus, num_workers, pin_memory)
                 if rank == 0:
                     checkpoint = os.path.join(
                         hparams.output_dir, "checkpoint_{}".format(iteration))
@@ -360,7 +387,7 @@ def train(hparams, distributed_run=False, rank=0, n_gpus=None):
             if hparams.lr_scheduler == SchedulerTypes.plateau:
                 lr_scheduler.step(
                     validate(model, criterion, valset, iteration, hparams.batch_size, collate_fn,
-                             logger, distributed_run, rank, n_gpus)
+                             logger, distributed_run, rank, n_gpus, num_workers, pin_memory)
                 )
             else:
                 lr_scheduler.step()
@@ -47,6 +47,7 @@ sys.path.insert(0, root_path)
 
 from tacotron2.modules import layers
 from tacotron2.utils.utils import load_filepaths_and_text, Inputs, InputsCTC
+from tacotron2.utils.mel_cache import MelShardReader, get_mel_cache_config, MEL_CACHE_INDEX
 from tacotron2.modules.loss_function import AttentionTypes
 
 sys.path.pop(0)
@@ -76,7 +77,7 @@ class TextMelLoader(torch.utils.data.Dataset):
     def __init__(self, text_handler, filelist_path, hparams):
         self.text_handler = text_handler
 
-        self.data = load_filepaths_and_text(filelist_path)
+        self.data = load_filepaths_and_text(filelist_path) if filelist_path is not None else []
         self.audio_path = hparams.audios_path
         self.alignment_path = hparams.alignments_path
 
@@ -90,6 +91,16 @@ class TextMelLoader(torch.utils.data.Dataset):
         self.sampling_rate = hparams.sampling_rate
         self.load_mel_from_disk = hparams.load_mel_from_disk
 
+        # precomputed mels, see tacotron2.utils.mel_cache.precompute_mels
+        self.mel_cache = None
+        mel_cache_dir = hparams.get("mel_cache_dir")
+        if mel_cache_dir and not self.load_mel_from_disk and os.path.isfile(os.path.join(mel_cache_dir, MEL_CACHE_INDEX)):
+            mel_cache = MelShardReader(mel_cache_dir)
+            if mel_cache.config == get_mel_cache_config(hparams):
+                self.mel_cache = mel_cache
+            else:
+                print("Warning... Mel cache was computed with other audio params and will not use")
+
         self.stft = layers.TacotronSTFT(
             hparams.filter_length, hparams.hop_length, hparams.win_length,
             hparams.n_mel_channels, hparams.sampling_rate, hparams.mel_fmin,
@@ -194,7 +205,9 @@ class TextMelLoader(torch.utils.data.Dataset):
 
 
     def get_mel(self, filename):
-        if not self.load_mel_from_disk:
+        if self.mel_cache is not None and filename in self.mel_cache:
+            melspec = self.mel_cache.get(filename)
+        elif not self.load_mel_from_disk:
             audio = self.get_audio(filename, self.trim_silence, self.add_silence)
             melspec = self.stft.mel_spectrogram(audio)
             melspec = torch.squeeze(melspec, 0)
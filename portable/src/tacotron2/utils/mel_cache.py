@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+root_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, root_path)
+
+from tacotron2.hparams import create_hparams
+from tacotron2.utils.utils import load_filepaths_and_text
+
+sys.path.pop(0)
+
+
+MEL_CACHE_INDEX = "index.json"
+# audio folder and audio params which change mel, cache is recomputed if one of them changed
+MEL_CACHE_PARAMS = (
+    "audios_path", "max_wav_value", "sampling_rate", "filter_length", "hop_length", "win_length", "n_mel_channels",
+    "mel_fmin", "mel_fmax", "add_silence", "trim_silence", "trim_top_db"
+)
+
+_worker_loader = None  # TextMelLoader of pool process
+
+
+def _init_worker(config):
+    global _worker_loader
+    from tacotron2.utils.data_utils import TextMelLoader
+
+    torch.set_num_threads(1)  # parallelism is given by processes
+    _worker_loader = TextMelLoader(None, None, create_hparams(config))
+
+
+def _compute_mel(filename):
+    audio = _worker_loader.get_audio(filename, _worker_loader.trim_silence, _worker_loader.add_silence)
+    mel = _worker_loader.get_mel_from_audio(audio)
+    return filename, mel.numpy().astype(np.float32)
+
+
+def get_mel_cache_config(hparams) -> dict:
+    config = {param: hparams.get(param) for param in MEL_CACHE_PARAMS}
+    if config["audios_path"]:
+        config["audios_path"] = os.path.abspath(config["audios_path"])
+    return config
+
+
+def get_audio_stat(audios_path, filename) -> list:
+    """
+    Size and mtime of audio, mel of item is recomputed if audio was replaced
+    :param audios_path: audio folder
+    :param filename: audio name
+    :return: [size, mtime] or None if audio not found
+    """
+    try:
+        stat = os.stat(os.path.join(audios_path or "", filename))
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime]
+
+
+def precompute_mels(filelist_paths, hparams, cache_dir: str, num_workers: int = None, shard_size: int = 1000) -> None:
+    """
+    Compute trimmed mels once in pool of processes and save them in shards which are read by memory map.
+    Mels which are already in cache are not computed again
+    :param filelist_paths: list of mark files in format audio_name|text
+    :param hparams: hparams
+    :param cache_dir: cache folder
+    :param num_workers: number of processes, if None use number of cpu
+    :param shard_size: number of mels in one shard
+    :return: None
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, MEL_CACHE_INDEX)
+    config = get_mel_cache_config(hparams)
+
+    index = {"config": config, "shards": [], "items": {}}
+    if os.path.isfile(index_path):
+        with open(index_path, "r", encoding="utf-8") as file:
+            cached_index = json.load(file)
+        if cached_index.get("config") == config:
+            index = cached_index
+        else:
+            print("Audio params are changed, mel cache will be recomputed")
+
+    filenames = []
+    seen = set()
+    for filelist_path in filelist_paths:
+        for sample in load_filepaths_and_text(filelist_path):
+            filename = sample[0]
+            if filename in seen:
+                continue
+            seen.add(filename)
+            item = index["items"].get(filename)
+            if item is None or item[3:] != get_audio_stat(config["audios_path"], filename):
+                filenames.append(filename)
+    if not filenames:
+        print("All mels are already in cache")
+        return
+
+    num_workers = num_workers or os.cpu_count() or 1
+    shard_size = max(1, int(shard_size))
+    print(f"Compute {len(filenames)} mels by {num_workers} processes")
+
+    def write_shard(mels):
+        shard_name = f"mels_{len(index['shards'])}.npy"
+        total_frames = sum(mel.shape[1] for _, mel in mels)
+        shard = np.lib.format.open_memmap(
+            os.path.join(cache_dir, shard_name), mode="w+", dtype=np.float32, shape=(mels[0][1].shape[0], total_frames)
+        )
+        start = 0
+        for filename, mel in mels:
+            shard[:, start:start + mel.shape[1]] = mel
+            index["items"][filename] = [len(index["shards"]), start, mel.shape[1]] + (get_audio_stat(config["audios_path"], filename) or [])
+            start += mel.shape[1]
+        shard.flush()
+        del shard
+        index["shards"].append(shard_name)
+        # index is saved after each shard, interrupted preprocessing continues from last shard
+        with open(index_path, "w", encoding="utf-8") as file:
+            json.dump(index, file)
+
+    mels = []
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(dict(hparams),)) as executor:
+        for filename, mel in tqdm(executor.map(_compute_mel, filenames, chunksize=8), total=len(filenames), desc="Mel cache"):
+            mels.append((filename, mel))
+            if len(mels) >= shard_size:
+                write_shard(mels)
+                mels = []
+    if mels:
+        write_shard(mels)
+
+
+class MelShardReader:
+    """
+    Read mels from shards by memory map, shards are opened lazily in each data loader worker
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, MEL_CACHE_INDEX), "r", encoding="utf-8") as file:
+            index = json.load(file)
+        self.config = index["config"]
+        self.shard_names = index["shards"]
+        self.items = index["items"]
+        self.shards = {}
+
+    def __contains__(self, filename):
+        # audio which was changed after preprocessing is read from disk
+        item = self.items.get(filename)
+        return item is not None and item[3:] == get_audio_stat(self.config["audios_path"], filename)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shards"] = {}  # memory maps are not sent to worker processes
+        return state
+
+    def get(self, filename):
+        shard_idx, start, length = self.items[filename][:3]
+        shard = self.shards.get(shard_idx)
+        if shard is None:
+            shard = np.load(os.path.join(self.cache_dir, self.shard_names[shard_idx]), mmap_mode="r")
+            self.shards[shard_idx] = shard
+        return torch.from_numpy(np.array(shard[:, start:start + length]))
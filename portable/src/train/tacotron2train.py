@@ -46,6 +46,7 @@ class Tacotron2Train:
         config["charset"] = param.get("language", "en")
         config["batch_size"] = int(param.get("batch_size", 32))
         config["checkpoint"] = checkpoint
+        config["mel_cache_dir"] = os.path.join(train_path, "mel_cache")
         config_path = save_hparams(train_path, config)
         return config_path
 
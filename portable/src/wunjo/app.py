@@ -9,7 +9,7 @@ import subprocess
 from base64 import b64encode
 from werkzeug.utils import secure_filename
 
-from flask import Flask, render_template, request, send_from_directory, url_for, jsonify
+from flask import Flask, render_template, request, send_from_directory, url_for, jsonify, Response, stream_with_context
 from flask_cors import CORS, cross_origin
 from flaskwebgui import FlaskUI
 
@@ -21,12 +21,14 @@ try:
 except ImportError:
     VIDEO2VIDEO_AVAILABLE = False
     diffusion_models = {}
-from speech.interface import TextToSpeech, VoiceCloneTranslate
+from speech.interface import TextToSpeech, TextToSpeechStream, VoiceCloneTranslate
 from speech.tts_models import load_voice_models, voice_names, file_voice_config, file_custom_voice_config, custom_voice_names
 from speech.rtvc_models import load_rtvc, rtvc_models_config
 from backend.folders import MEDIA_FOLDER, WAVES_FOLDER, DEEPFAKE_FOLDER, TMP_FOLDER, SETTING_FOLDER, CUSTOM_VOICE_FOLDER
 from backend.translator import get_translate
 from backend.general_utils import get_version_app, set_settings, current_time, is_ffmpeg_installed, get_folder_size, format_dir_time
+from backend.model_registry import model_registry
+from backend.jobs import JobQueue, JOB_FINISHED, JOB_FAILED
 
 import logging
 
@@ -35,12 +37,7 @@ cors = CORS(app)
 app.config["CORS_HEADERS"] = "Content-Type"
 
 app.config['DEBUG'] = False
-app.config['SYNTHESIZE_STATUS'] = {"status_code": 200, "message": ""}
-app.config['SYNTHESIZE_RESULT'] = []
 app.config['SEGMENT_ANYTHING_MASK_PREVIEW_RESULT'] = {}  # get segment result
-app.config['SEGMENT_ANYTHING_MODEL'] = {}  # load segment anything model to dynamically change
-app.config['RTVC_LOADED_MODELS'] = {}  # in order to not load model again if it was loaded in prev synthesize (faster)
-app.config['TTS_LOADED_MODELS'] = {}  # in order to not load model again if it was loaded in prev synthesize (faster)
 app.config['USER_LANGUAGE'] = "en"
 app.config['FOLDER_SIZE_RESULT'] = {"audio": get_folder_size(WAVES_FOLDER), "video": get_folder_size(DEEPFAKE_FOLDER)}
 
@@ -48,12 +45,16 @@ logging.getLogger('werkzeug').disabled = True
 
 version_app = get_version_app()
 
+# synthesis jobs run in workers, request context is needed for url_for inside jobs
+job_queue = JobQueue(context=app.test_request_context)
+
 
 def clear_cache():
-    # empty cache before big gpu models
-    del app.config['SEGMENT_ANYTHING_MODEL'], app.config['RTVC_LOADED_MODELS'], app.config['TTS_LOADED_MODELS']
+    # loaded models keep in model_registry and will be evicted by memory limit, here only empty not used memory.
+    # Segment preview and memory are used by running jobs, so they are cleared only if queue is idle
+    if not job_queue.is_idle():
+        return
     app.config['SEGMENT_ANYTHING_MASK_PREVIEW_RESULT'] = {}  # clear segment data
-    app.config['SEGMENT_ANYTHING_MODEL'], app.config['RTVC_LOADED_MODELS'], app.config['TTS_LOADED_MODELS'] = {}, {}, {}
     torch.cuda.empty_cache()
     gc.collect()
 
@@ -207,18 +208,8 @@ def get_voice_list():
 @app.route("/create_segment_anything/", methods=["POST"])
 @cross_origin()
 def create_segment_anything():
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") != 200:
-        print("The process is already running... ")
-        return {"status": 400}
-
-    # empty cache without func clear_cache()
-    torch.cuda.empty_cache()
-    gc.collect()
-
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 300}
-
-    if not app.config['SEGMENT_ANYTHING_MODEL']:
-        app.config['SEGMENT_ANYTHING_MODEL'] = GetSegment.load_model()
+    # models are kept in registry, will be loaded only first time
+    segment_models = GetSegment.load_model()
 
     # get parameters
     request_list = request.get_json()
@@ -228,11 +219,11 @@ def create_segment_anything():
     obj_id = request_list.get("obj_id", 1)
 
     # call get segment anything
-    segment_models = app.config['SEGMENT_ANYTHING_MODEL']
     predictor = segment_models.get("predictor")
     session = segment_models.get("session")
     result_filename = GetSegment.get_segment_mask_file(
-        predictor=predictor, session=session, source=os.path.join(TMP_FOLDER, source), point_list=point_list
+        predictor=predictor, session=session, source=os.path.join(TMP_FOLDER, source), point_list=point_list,
+        current_time=float(current_time), model_key=segment_models.get("model_key")
     )
 
     # Set new data to send in frontend
@@ -243,8 +234,6 @@ def create_segment_anything():
         "point_list": point_list
     }
 
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-
     return {"status": 200}
 
 
@@ -256,24 +245,57 @@ def get_segment_anything():
         "response_code": 0, "response": segment_preview
     }
 
+
+def get_media_url(result, folder="video"):
+    result_filename = f"/{folder}/" + result.replace("\\", "/").split(f"/{folder}/")[-1]
+    return url_for("media_file", filename=result_filename)
+
+
+def update_folder_size():
+    # Update disk space size
+    app.config['FOLDER_SIZE_RESULT'] = {"audio": get_folder_size(WAVES_FOLDER), "video": get_folder_size(DEEPFAKE_FOLDER)}
+
+
+def submit_deepfake_job(func, mode_msg, success_msg, **kwargs):
+    """
+    Submit deepfake job which returns path to result
+    :param func: function of inference
+    :param mode_msg: mode for user
+    :param success_msg: message in console after job
+    :param kwargs: params of function
+    :return: response with job id
+    """
+    request_date = format_dir_time(current_time())
+
+    def run_job():
+        result = func(**kwargs)
+        print(success_msg)
+        update_folder_size()
+        torch.cuda.empty_cache()
+        return [{"mode": mode_msg, "request_mode": "deepfake", "response_url": get_media_url(result), "request_date": request_date, "request_information": get_print_translate("Successfully")}]
+
+    def fallback(err):
+        torch.cuda.empty_cache()
+        return [{"mode": mode_msg, "request_mode": "deepfake", "response_url": "", "request_date": request_date, "request_information": get_print_translate("Error")}]
+
+    job_id = job_queue.submit(run_job, mode=mode_msg, fallback=fallback)
+    if job_id is None:
+        print("The queue of processes is full... ")
+        return {"status": 400}
+    print("Please wait... Processing is queued")
+    return {"status": 200, "job_id": job_id}
+
+
 @app.route("/synthesize_video_merge/", methods=["POST"])
 @cross_origin()
 def synthesize_video_merge():
-    # check what it is not repeat button click
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") != 200:
-        print("The process is already running... ")
-        return {"status": 400}
-
     # Check ffmpeg
     is_ffmpeg = is_ffmpeg_installed()
     if not is_ffmpeg:
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
         return {"status": 400}
 
     # get parameters
     request_list = request.get_json()
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 300}
-    print("Please wait... Processing is started")
 
     if not os.path.exists(DEEPFAKE_FOLDER):
         os.makedirs(DEEPFAKE_FOLDER)
@@ -283,51 +305,22 @@ def synthesize_video_merge():
     audio_path = os.path.join(TMP_FOLDER, audio_name) if audio_name else None
     fps = request_list.get("fps", 30)
 
-    request_time = current_time()
-    request_date = format_dir_time(request_time)
-
-    try:
-        result = VideoEdit.main_merge_frames(
-            output=DEEPFAKE_FOLDER, source_folder=source_folder,
-            audio_path=audio_path, fps=fps
-        )
-    except Exception as err:
-        app.config['SYNTHESIZE_RESULT'] += [{"mode": get_print_translate("Image to video"), "request_mode": "deepfake", "response_url": "", "request_date": request_date, "request_information": get_print_translate("Error")}]
-        print(f"Error ... {err}")
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-        return {"status": 400}
-
-    result_filename = "/video/" + result.replace("\\", "/").split("/video/")[-1]
-    url = url_for("media_file", filename=result_filename)
-
-    app.config['SYNTHESIZE_RESULT'] += [{"mode": get_print_translate("Image to video"), "request_mode": "deepfake", "response_url": url, "request_date": request_date, "request_information": get_print_translate("Successfully")}]
-
-    print("Merge frames to video completed successfully!")
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-    # Update disk space size
-    app.config['FOLDER_SIZE_RESULT'] = {"audio": get_folder_size(WAVES_FOLDER), "video": get_folder_size(DEEPFAKE_FOLDER)}
-
-    return {"status": 200}
+    return submit_deepfake_job(
+        VideoEdit.main_merge_frames, get_print_translate("Image to video"), "Merge frames to video completed successfully!",
+        output=DEEPFAKE_FOLDER, source_folder=source_folder, audio_path=audio_path, fps=fps
+    )
 
 
 @app.route("/synthesize_video_editor/", methods=["POST"])
 @cross_origin()
 def synthesize_video_editor():
-    # check what it is not repeat button click
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") != 200:
-        print("The process is already running... ")
-        return {"status": 400}
-
     # Check ffmpeg
     is_ffmpeg = is_ffmpeg_installed()
     if not is_ffmpeg:
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
         return {"status": 400}
 
     # get parameters
     request_list = request.get_json()
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 300}
-    print("Please wait... Processing is started")
 
     if not os.path.exists(DEEPFAKE_FOLDER):
         os.makedirs(DEEPFAKE_FOLDER)
@@ -344,51 +337,24 @@ def synthesize_video_editor():
     media_start = request_list.get("media_start", 0)
     media_end = request_list.get("media_end", 0)
 
-    request_time = current_time()
-    request_date = format_dir_time(request_time)
-
     if enhancer:
         mode_msg = get_print_translate("Content improve")
     else:
         mode_msg = get_print_translate("Video to images")
 
-    try:
-        result = VideoEdit.main_video_work(
-            output=DEEPFAKE_FOLDER, source=os.path.join(TMP_FOLDER, source),
-            enhancer=enhancer, is_get_frames=is_get_frames,
-            media_start=media_start, media_end=media_end
-        )
-    except Exception as err:
-        app.config['SYNTHESIZE_RESULT'] += [{"mode": mode_msg, "request_mode": "deepfake", "response_url": "", "request_date": request_date, "request_information": get_print_translate("Error")}]
-        print(f"Error ... {err}")
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-        return {"status": 400}
-
-    result_filename = "/video/" + result.replace("\\", "/").split("/video/")[-1]
-    url = url_for("media_file", filename=result_filename)
-
-    app.config['SYNTHESIZE_RESULT'] += [{"mode": mode_msg, "request_mode": "deepfake", "response_url": url, "request_date": request_date, "request_information": get_print_translate("Successfully")}]
-
-    print("Edit video completed successfully!")
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-    # Update disk space size
-    app.config['FOLDER_SIZE_RESULT'] = {"audio": get_folder_size(WAVES_FOLDER), "video": get_folder_size(DEEPFAKE_FOLDER)}
-
-    return {"status": 200}
+    return submit_deepfake_job(
+        VideoEdit.main_video_work, mode_msg, "Edit video completed successfully!",
+        output=DEEPFAKE_FOLDER, source=os.path.join(TMP_FOLDER, source), enhancer=enhancer, is_get_frames=is_get_frames,
+        media_start=media_start, media_end=media_end
+    )
 
 
 @app.route("/synthesize_diffuser/", methods=["POST"])
 @cross_origin()
 def synthesize_diffuser():
-    # check what it is not repeat button click
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") != 200:
-        print("The process is already running... ")
-        return {"status": 400}
-
     # Check ffmpeg
     is_ffmpeg = is_ffmpeg_installed()
     if not is_ffmpeg:
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
         return {"status": 400}
 
     # has to work only with GPU
@@ -404,8 +370,6 @@ def synthesize_diffuser():
 
     # get parameters
     request_list = request.get_json()
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 300}
-    print("Please wait... Processing is started")
 
     if not os.path.exists(DEEPFAKE_FOLDER):
         os.makedirs(DEEPFAKE_FOLDER)
@@ -422,54 +386,26 @@ def synthesize_diffuser():
     thickness_mask = int(request_list.get("thickness_mask", 10))
     sd_model_name = request_list.get("sd_model_name", None)
 
-    request_time = current_time()
-    request_date = format_dir_time(request_time)
-
     clear_cache()  # clear empty, because will be better load segment models again and after empty cache
 
-    try:
-        diffusion_result = Video2Video.main_video_render(
-            source=os.path.join(TMP_FOLDER, source), output_folder=DEEPFAKE_FOLDER, source_start=source_start, sd_model_name=sd_model_name,
-            source_end=source_end, source_type=source_type, masks=masks, interval=interval_generation, thickness_mask=thickness_mask,
-            control_type=controlnet, translation=preprocessor, predictor=None, session=None, segment_percentage=segment_percentage
-        )
-    except Exception as err:
-        app.config['SYNTHESIZE_RESULT'] += [{"mode": get_print_translate("Diffusion"), "request_mode": "deepfake", "response_url": "", "request_date": request_date, "request_information": get_print_translate("Error")}]
-        print(f"Error ... {err}")
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-        return {"status": 400}
-
-    diffusion_result_filename = "/video/" + diffusion_result.replace("\\", "/").split("/video/")[-1]
-    diffusion_url = url_for("media_file", filename=diffusion_result_filename)
-
-    app.config['SYNTHESIZE_RESULT'] += [{"mode": get_print_translate("Diffusion"), "request_mode": "deepfake", "response_url": diffusion_url, "request_date": request_date, "request_information": get_print_translate("Successfully")}]
-
-    print("Diffusion synthesis completed successfully!")
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-    # empty cache
-    torch.cuda.empty_cache()
-
-    return {"status": 200}
+    return submit_deepfake_job(
+        Video2Video.main_video_render, get_print_translate("Diffusion"), "Diffusion synthesis completed successfully!",
+        source=os.path.join(TMP_FOLDER, source), output_folder=DEEPFAKE_FOLDER, source_start=source_start, sd_model_name=sd_model_name,
+        source_end=source_end, source_type=source_type, masks=masks, interval=interval_generation, thickness_mask=thickness_mask,
+        control_type=controlnet, translation=preprocessor, predictor=None, session=None, segment_percentage=segment_percentage
+    )
 
 
 @app.route("/synthesize_retouch/", methods=["POST"])
 @cross_origin()
 def synthesize_retouch():
-    # check what it is not repeat button click
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") != 200:
-        print("The process is already running... ")
-        return {"status": 400}
-
     # Check ffmpeg
     is_ffmpeg = is_ffmpeg_installed()
     if not is_ffmpeg:
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
         return {"status": 400}
 
     # get parameters
     request_list = request.get_json()
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 300}
-    print("Please wait... Processing is started")
 
     if not os.path.exists(DEEPFAKE_FOLDER):
         os.makedirs(DEEPFAKE_FOLDER)
@@ -485,56 +421,27 @@ def synthesize_retouch():
     upscale = request_list.get("upscale", False)
     segment_percentage = int(request_list.get("segment_percentage", 25))
 
-    request_time = current_time()
-    request_date = format_dir_time(request_time)
     # clear empty, because will be better load segment models again and after empty cache, else not empty full
     clear_cache()
 
-    try:
-        retouch_result = Retouch.main_retouch(
-            output=DEEPFAKE_FOLDER, source=os.path.join(TMP_FOLDER, source), source_start=source_start,
-            masks=masks, retouch_model_type=model_type, source_end=source_end, source_type=source_type,
-            predictor=None, session=None, mask_color=mask_color, blur=blur, upscale=upscale, segment_percentage=segment_percentage
-        )
-    except Exception as err:
-        app.config['SYNTHESIZE_RESULT'] += [{"mode": get_print_translate("Content clean-up"), "request_mode": "deepfake", "response_url": "", "request_date": request_date, "request_information": get_print_translate("Error")}]
-        print(f"Error ... {err}")
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-        return {"status": 400}
-
-    retouch_result_filename = "/video/" + retouch_result.replace("\\", "/").split("/video/")[-1]
-    retouch_url = url_for("media_file", filename=retouch_result_filename)
-
-    app.config['SYNTHESIZE_RESULT'] += [{"mode": get_print_translate("Content clean-up"), "request_mode": "deepfake", "response_url": retouch_url, "request_date": request_date, "request_information": get_print_translate("Successfully")}]
-
-    print("Retouch synthesis completed successfully!")
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-    # Update disk space size
-    app.config['FOLDER_SIZE_RESULT'] = {"audio": get_folder_size(WAVES_FOLDER), "video": get_folder_size(DEEPFAKE_FOLDER)}
-    # empty cache
-    torch.cuda.empty_cache()
-
-    return {"status": 200}
+    return submit_deepfake_job(
+        Retouch.main_retouch, get_print_translate("Content clean-up"), "Retouch synthesis completed successfully!",
+        output=DEEPFAKE_FOLDER, source=os.path.join(TMP_FOLDER, source), source_start=source_start,
+        masks=masks, retouch_model_type=model_type, source_end=source_end, source_type=source_type,
+        predictor=None, session=None, mask_color=mask_color, blur=blur, upscale=upscale, segment_percentage=segment_percentage
+    )
 
 
 @app.route("/synthesize_face_swap/", methods=["POST"])
 @cross_origin()
 def synthesize_face_swap():
-    # check what it is not repeat button click
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") != 200:
-        print("The process is already running... ")
-        return {"status": 400}
-
     # Check ffmpeg
     is_ffmpeg = is_ffmpeg_installed()
     if not is_ffmpeg:
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
         return {"status": 400}
 
     # get parameters
     request_list = request.get_json()
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 300}
-    print("Please wait... Processing is started")
 
     if not os.path.exists(DEEPFAKE_FOLDER):
         os.makedirs(DEEPFAKE_FOLDER)
@@ -552,65 +459,35 @@ def synthesize_face_swap():
     similarface = request_list.get("similarface", False)
     similar_coeff = float(request_list.get("similar_coeff", 0.95))
 
-    request_time = current_time()
-    request_date = format_dir_time(request_time)
-
     clear_cache()  # clear empty
 
-    try:
-        face_swap_result = FaceSwap.main_faceswap(
-            deepfake_dir=DEEPFAKE_FOLDER,
-            target=os.path.join(TMP_FOLDER, target_content),
-            target_face_fields=face_target_fields,
-            source=os.path.join(TMP_FOLDER, source_content),
-            source_face_fields=source_face_fields,
-            type_file_source=type_file_source,
-            target_video_start=video_start_target,
-            target_video_end=video_end_target,
-            source_current_time=video_current_time_source,
-            source_video_end=video_end_source,
-            multiface=multiface,
-            similarface=similarface,
-            similar_coeff=similar_coeff
-        )
-    except Exception as err:
-        app.config['SYNTHESIZE_RESULT'] += [{"mode": get_print_translate("Face swap"), "request_mode": "deepfake", "response_url": "", "request_date": request_date, "request_information": get_print_translate("Error")}]
-        print(f"Error ... {err}")
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-        return {"status": 400}
-
-    face_swap_result_filename = "/video/" + face_swap_result.replace("\\", "/").split("/video/")[-1]
-    face_swap_url = url_for("media_file", filename=face_swap_result_filename)
-
-    app.config['SYNTHESIZE_RESULT'] += [{"mode": get_print_translate("Face swap"), "request_mode": "deepfake", "response_url": face_swap_url, "request_date": request_date, "request_information": get_print_translate("Successfully")}]
-
-    print("Face swap synthesis completed successfully!")
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-    # Update disk space size
-    app.config['FOLDER_SIZE_RESULT'] = {"audio": get_folder_size(WAVES_FOLDER), "video": get_folder_size(DEEPFAKE_FOLDER)}
-    # empty cache
-    torch.cuda.empty_cache()
-
-    return {"status": 200}
+    return submit_deepfake_job(
+        FaceSwap.main_faceswap, get_print_translate("Face swap"), "Face swap synthesis completed successfully!",
+        deepfake_dir=DEEPFAKE_FOLDER,
+        target=os.path.join(TMP_FOLDER, target_content),
+        target_face_fields=face_target_fields,
+        source=os.path.join(TMP_FOLDER, source_content),
+        source_face_fields=source_face_fields,
+        type_file_source=type_file_source,
+        target_video_start=video_start_target,
+        target_video_end=video_end_target,
+        source_current_time=video_current_time_source,
+        source_video_end=video_end_source,
+        multiface=multiface,
+        similarface=similarface,
+        similar_coeff=similar_coeff
+    )
 
 
 @app.route("/synthesize_deepfake/", methods=["POST"])
 @cross_origin()
 def synthesize_deepfake():
-    # check what it is not repeat button click
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") != 200:
-        print("The process is already running... ")
-        return {"status": 400}
-
     # Check ffmpeg
     is_ffmpeg = is_ffmpeg_installed()
     if not is_ffmpeg:
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
         return {"status": 400}
 
     request_list = request.get_json()
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 300}
-    print(get_print_translate("Please wait... Processing is started"))
 
     if not os.path.exists(DEEPFAKE_FOLDER):
         os.makedirs(DEEPFAKE_FOLDER)
@@ -630,90 +507,75 @@ def synthesize_deepfake():
     emotion_label = request_list.get("emotion_label", None)
     similar_coeff = float(request_list.get("similar_coeff", 0.95))
 
-    request_time = current_time()
-    request_date = format_dir_time(request_time)
-
     clear_cache()  # clear empty
 
     if type_file == "img":
-        mode_msg = get_print_translate("Face in sync")
-    else:
-        mode_msg = get_print_translate("Lip in sync")
-
-    try:
-        if type_file == "img":
-            deepfake_result = AnimationFaceTalk.main_img_deepfake(
-                deepfake_dir=DEEPFAKE_FOLDER,
-                source_image=source_image,
-                driven_audio=driven_audio,
-                still=still,
-                preprocess=preprocess,
-                face_fields=face_fields,
-                expression_scale=expression_scale,
-                input_yaw=input_yaw,
-                input_pitch=input_pitch,
-                input_roll=input_roll,
-                pose_style=random.randint(0, 45)
-                )
-        elif type_file == "video":
-            deepfake_result = AnimationMouthTalk.main_video_deepfake(
-                deepfake_dir=DEEPFAKE_FOLDER,
-                face=source_image,
-                audio=driven_audio,
-                face_fields=face_fields,
-                video_start=float(media_start),
-                video_end=float(media_end),
-                emotion_label=emotion_label,
-                similar_coeff=similar_coeff
-            )
-
-        torch.cuda.empty_cache()
-    except Exception as err:
-        app.config['SYNTHESIZE_RESULT'] += [{"mode": mode_msg, "request_mode": "deepfake", "response_url": "", "request_date": request_date, "request_information": get_print_translate("Error")}]
-        print(f"Error ... {err}")
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-        return {"status": 400}
-
-
-    deepfake_filename = "/video/" + deepfake_result.replace("\\", "/").split("/video/")[-1]
-    deepfake_url = url_for("media_file", filename=deepfake_filename)
-
-    app.config['SYNTHESIZE_RESULT'] += [{"mode": mode_msg, "request_mode": "deepfake", "response_url": deepfake_url, "request_date": request_date, "request_information": get_print_translate("Successfully")}]
-
-    print("Deepfake synthesis completed successfully!")
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-    # Update disk space size
-    app.config['FOLDER_SIZE_RESULT'] = {"audio": get_folder_size(WAVES_FOLDER), "video": get_folder_size(DEEPFAKE_FOLDER)}
-    # empty cache
-    torch.cuda.empty_cache()
+        return submit_deepfake_job(
+            AnimationFaceTalk.main_img_deepfake, get_print_translate("Face in sync"), "Deepfake synthesis completed successfully!",
+            deepfake_dir=DEEPFAKE_FOLDER,
+            source_image=source_image,
+            driven_audio=driven_audio,
+            still=still,
+            preprocess=preprocess,
+            face_fields=face_fields,
+            expression_scale=expression_scale,
+            input_yaw=input_yaw,
+            input_pitch=input_pitch,
+            input_roll=input_roll,
+            pose_style=random.randint(0, 45)
+        )
+    elif type_file == "video":
+        return submit_deepfake_job(
+            AnimationMouthTalk.main_video_deepfake, get_print_translate("Lip in sync"), "Deepfake synthesis completed successfully!",
+            deepfake_dir=DEEPFAKE_FOLDER,
+            face=source_image,
+            audio=driven_audio,
+            face_fields=face_fields,
+            video_start=float(media_start),
+            video_end=float(media_end),
+            emotion_label=emotion_label,
+            similar_coeff=similar_coeff
+        )
+    print(f"Error ... type of file {type_file} is not supported")
+    return {"status": 400}
 
-    return {"status": 200}
 
 @app.route("/synthesize_result/", methods=["GET"])
 @cross_origin()
 def get_synthesize_result():
-    general_results = app.config['SYNTHESIZE_RESULT']
+    general_results = job_queue.results()
     return {
         "response_code": 0,
         "response": general_results
     }
 
-@app.route("/synthesize_speech/", methods=["POST"])
-@cross_origin()
-def synthesize():
-    # check what it is not repeat button click
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") != 200:
-        print("The process is already running... ")
-        return {"status": 400}
 
-    request_list = request.get_json()
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 300}
-    print(get_print_translate("Please wait... Processing is started"))
-
-    dir_time = current_time()
+def get_speech_result(result, filename, response_code, text, request_date):
+    filename = "/waves/" + filename.replace("\\", "/").split("/waves/")[-1]
+    print("Synthesized file: ", filename)
+    result.pop("response_audio")
+    result["response_url"] = url_for("media_file", filename=filename)
+    # result["response_audio"] = b64encode(audio_bytes).decode("utf-8")
+    result["response_code"] = response_code
+    result["request_date"] = request_date
+    result["request_information"] = text
+    result["request_mode"] = "speech"
+    result["voice"] = get_print_translate(result.get("voice"))
+    return result
+
+
+def synthesize_speech_job(request_list, dir_time):
+    """
+    Job of text to speech and voice clone
+    :param request_list: list of user requests
+    :param dir_time: folder time
+    :return: list of results
+    """
     request_date = format_dir_time(dir_time)
+    speech_results = []
 
-    for request_json in request_list:
+    for n, request_json in enumerate(request_list):
+        job_queue.set_progress(100 * n / len(request_list))
         text = request_json["text"]
         model_type = request_json["voice"]
 
@@ -737,31 +599,26 @@ def synthesize():
         if rtvc_models_config.get(lang_translation) is None:
             rtvc_models_lang = "en"
 
-        # init only one time the models for voice clone if it is needs
-        if (auto_translation or rtvc_audio_clone_voice) and app.config['RTVC_LOADED_MODELS'].get(rtvc_models_lang) is None:
-            # Check ffmpeg
-            is_ffmpeg = is_ffmpeg_installed()
-            if not is_ffmpeg:
-                app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-                return {"status": 400}
+        # models for voice clone if it is needs, models keep in registry between requests
+        rtvc_models = {}
+        if auto_translation or rtvc_audio_clone_voice:
             # init models
             encoder, synthesizer, signature, vocoder = load_rtvc(rtvc_models_lang)
-            app.config['RTVC_LOADED_MODELS'][rtvc_models_lang] = {"encoder": encoder, "synthesizer": synthesizer, "signature": signature, "vocoder": vocoder}
+            rtvc_models = {"encoder": encoder, "synthesizer": synthesizer, "signature": signature, "vocoder": vocoder}
 
-        if model_type:
-            app.config['TTS_LOADED_MODELS'] = load_voice_models(model_type, app.config['TTS_LOADED_MODELS'])
+        tts_models = load_voice_models(model_type) if model_type else {}
 
         for model in model_type:
             # if set auto translate, when get clear translation for source of models to clear synthesis audio
             # get tacotron2 lang from engine
-            tacotron2_lang = app.config['TTS_LOADED_MODELS'][model].engine.charset
+            tacotron2_lang = tts_models[model].engine.charset
             if auto_translation:
                 print("User use auto translation. Translate text before TTS.")
                 tts_text = get_translate(text=text, targetLang=tacotron2_lang)
             else:
                 tts_text = text
 
-            response_code, results = TextToSpeech.get_synthesized_audio(tts_text, model, app.config['TTS_LOADED_MODELS'], os.path.join(WAVES_FOLDER, dir_time), **options)
+            response_code, results = TextToSpeech.get_synthesized_audio(tts_text, model, tts_models, os.path.join(WAVES_FOLDER, dir_time), **options)
 
             if response_code == 0:
                 for result in results:
@@ -771,10 +628,10 @@ def synthesize():
                     if tacotron2_lang != lang_translation and auto_translation:
                         # voice clone on tts audio result
                         # get models
-                        encoder = app.config['RTVC_LOADED_MODELS'][rtvc_models_lang]["encoder"]
-                        synthesizer = app.config['RTVC_LOADED_MODELS'][rtvc_models_lang]["synthesizer"]
-                        signature = app.config['RTVC_LOADED_MODELS'][rtvc_models_lang]["signature"]
-                        vocoder = app.config['RTVC_LOADED_MODELS'][rtvc_models_lang]["vocoder"]
+                        encoder = rtvc_models["encoder"]
+                        synthesizer = rtvc_models["synthesizer"]
+                        signature = rtvc_models["signature"]
+                        vocoder = rtvc_models["vocoder"]
 
                         # text translated inside get_synthesized_audio
                         response_code, result = VoiceCloneTranslate.get_synthesized_audio(
@@ -785,25 +642,15 @@ def synthesize():
                         # get new filename
                         filename = result.pop("filename")
 
-                    filename = "/waves/" + filename.replace("\\", "/").split("/waves/")[-1]
-                    print("Synthesized file: ", filename)
-                    result.pop("response_audio")
-                    result["response_url"] = url_for("media_file", filename=filename)
-                    # result["response_audio"] = b64encode(audio_bytes).decode("utf-8")
-                    result["response_code"] = response_code
-                    result["request_date"] = request_date
-                    result["request_information"] = text
-                    result["request_mode"] = "speech"
-                    result["voice"] = get_print_translate(result.get("voice"))
                     # Add result in frontend
-                    app.config['SYNTHESIZE_RESULT'] += [result]
+                    speech_results += [get_speech_result(result, filename, response_code, text, request_date)]
 
         # here use for voice cloning of audio file without tts
         if use_voice_clone_on_audio:
-            encoder = app.config['RTVC_LOADED_MODELS'][rtvc_models_lang]["encoder"]
-            synthesizer = app.config['RTVC_LOADED_MODELS'][rtvc_models_lang]["synthesizer"]
-            signature = app.config['RTVC_LOADED_MODELS'][rtvc_models_lang]["signature"]
-            vocoder = app.config['RTVC_LOADED_MODELS'][rtvc_models_lang]["vocoder"]
+            encoder = rtvc_models["encoder"]
+            synthesizer = rtvc_models["synthesizer"]
+            signature = rtvc_models["signature"]
+            vocoder = rtvc_models["vocoder"]
             rtvc_audio_clone_path = os.path.join(TMP_FOLDER, rtvc_audio_clone_voice)
 
             response_code, result = VoiceCloneTranslate.get_synthesized_audio(
@@ -812,35 +659,101 @@ def synthesize():
             )
             if response_code == 0:
                 filename = result.pop("filename")
-                filename = "/waves/" + filename.replace("\\", "/").split("/waves/")[-1]
-                print("Synthesized file: ", filename)
-                result.pop("response_audio")
-                result["response_url"] = url_for("media_file", filename=filename)
-                # result["response_audio"] = b64encode(audio_bytes).decode("utf-8")
-                result["response_code"] = response_code
-                result["request_date"] = request_date
-                result["request_information"] = text
-                result["request_mode"] = "speech"
-                result["voice"] = get_print_translate(result.get("voice"))
                 # Add result in frontend
-                app.config['SYNTHESIZE_RESULT'] += [result]
+                speech_results += [get_speech_result(result, filename, response_code, text, request_date)]
 
-    app.config['RTVC_LOADED_MODELS'] = {}  # remove RTVC models
     print("Text to speech synthesis completed successfully!")
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
-    # Update disk space size
-    app.config['FOLDER_SIZE_RESULT'] = {"audio": get_folder_size(WAVES_FOLDER), "video": get_folder_size(DEEPFAKE_FOLDER)}
+    update_folder_size()
     # empty cache
     torch.cuda.empty_cache()
 
-    return {"status": 200}
+    return speech_results
+
+
+@app.route("/synthesize_speech/", methods=["POST"])
+@cross_origin()
+def synthesize():
+    request_list = request.get_json()
+
+    # Check ffmpeg for voice clone
+    is_voice_clone = any(r.get("auto_translation", False) or r.get("rtvc_audio_clone_voice", "") for r in request_list)
+    if is_voice_clone and not is_ffmpeg_installed():
+        return {"status": 400}
+
+    job_id = job_queue.submit(synthesize_speech_job, request_list, current_time(), mode="speech")
+    if job_id is None:
+        print("The queue of processes is full... ")
+        return {"status": 400}
+    print(get_print_translate("Please wait... Processing is queued"))
+    return {"status": 200, "job_id": job_id}
+
+
+@app.route("/synthesize_speech_stream/", methods=["POST"])
+@cross_origin()
+def synthesize_stream():
+    """
+    Stream audio of one voice while text is synthesized sentence by sentence, voice clone is not supported here
+    """
+    request_json = request.get_json()
+    text = request_json.get("text", "")
+    model_type = request_json.get("voice")
+    model_type = model_type[0] if isinstance(model_type, list) and model_type else model_type
+    audio_format = request_json.get("format", "wav")
+    if not text or not model_type or audio_format not in ("wav", "pcm"):
+        return {"status": 400}, 400
+
+    options = {
+        "rate": float(request_json.get("rate", 1.0)),
+        "pitch": float(request_json.get("pitch", 1.0)),
+        "volume": float(request_json.get("volume", 0.0))
+    }
+
+    model = load_voice_models([model_type])[model_type]
+    if request_json.get("auto_translation", False):
+        print("User use auto translation. Translate text before TTS.")
+        text = get_translate(text=text, targetLang=model.engine.charset)
+
+    mimetype = "audio/wav" if audio_format == "wav" else "audio/L16;rate={};channels=1".format(model.sample_rate)
+    audio_gen = TextToSpeechStream.get_stream_audio(text, model, audio_format=audio_format, **options)
+    return Response(stream_with_context(audio_gen), mimetype=mimetype, headers={"X-Sample-Rate": str(model.sample_rate)})
 
 
 @app.route("/synthesize_process/", methods=["GET"])
 @cross_origin()
 def get_synthesize_status():
-    status = app.config['SYNTHESIZE_STATUS']
-    return status
+    # 300 while any job is queued or running as frontend waits for it, queue state is for clients of /jobs/
+    status_code = 200 if job_queue.is_idle() else 300
+    return {
+        "status_code": status_code, "active": job_queue.active(), "workers": job_queue.max_workers,
+        "queue_full": job_queue.is_full()
+    }
+
+
+@app.route("/jobs/", methods=["GET"])
+@cross_origin()
+def get_jobs():
+    return jsonify([{k: v for k, v in job.items() if k != "result"} for job in job_queue.get_jobs()])
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+@cross_origin()
+def get_job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"status": 404}, 404
+    job.pop("result")
+    return job
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+@cross_origin()
+def get_job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"status": 404}, 404
+    if job["status"] not in (JOB_FINISHED, JOB_FAILED):
+        return {"status": 202, "job_status": job["status"], "progress": job["progress"]}, 202
+    return {"status": 200, "job_status": job["status"], "error": job["error"], "response": job["result"] or []}
 
 
 @app.route("/disk_space_used/", methods=["GET"])
@@ -854,7 +767,7 @@ def get_disk_space_used_status():
 @cross_origin()
 def change_processor():
     current_processor = os.environ.get('WUNJO_TORCH_DEVICE', "cpu")
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") == 200:
+    if job_queue.is_idle():
         if not torch.cuda.is_available():
             print("No GPU driver was found on your computer. Working on the GPU will speed up the generation of content several times.")
             print("Visit the documentation https://github.com/wladradchenko/wunjo.wladradchenko.ru/wiki to learn how to install drivers for your computer.")
@@ -935,15 +848,14 @@ def console_log_print():
 @app.route('/training_voice', methods=["POST"])
 @cross_origin()
 def common_training_route():
-    # check what it is not repeat button click
-    if app.config['SYNTHESIZE_STATUS'].get("status_code") != 200:
+    # training uses all memory, it can not run with other jobs
+    if not job_queue.is_idle():
         print("The process is already running... ")
         return {"status": 400}
 
     try:
-        # clear keep models
-        app.config['RTVC_LOADED_MODELS'] = {}
-        app.config['TTS_LOADED_MODELS'] = {}
+        # clear keep models, training needs all memory
+        model_registry.clear()
         # get params and send
         print("Sending parameters to route... ")
         param = request.get_json()
@@ -952,11 +864,9 @@ def common_training_route():
         training_route(param)
     except Exception as err:
         print(f"Error training... {err}")
-        app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
         return {"status": 400}
 
     print("Trained finished successfully!")
-    app.config['SYNTHESIZE_STATUS'] = {"status_code": 200}
     return {"status": 200}
 """TRAIN MODULE"""
 